@@ -9,7 +9,7 @@ from django.db.models import Sum
 from django.db.models.functions import Coalesce
 from django import forms
 from decimal import Decimal, InvalidOperation
-from .models import Invoice, InvoiceLine, DoctorPayment, PaymentAllocation, Expense
+from .models import Invoice, InvoiceLine, DoctorPayment, PaymentAllocation, Expense, InvoiceArtifact
 from django.contrib.admin.widgets import FilteredSelectMultiple
 from billing.services.lot_allocation import simulate_lot_allocation
 from .models import ManualStockIssue
@@ -121,6 +121,15 @@ class PaymentAllocationAdmin(admin.ModelAdmin):
     raw_id_fields = ('payment', 'invoice')
 
 
+@admin.register(InvoiceArtifact)
+class InvoiceArtifactAdmin(admin.ModelAdmin):
+    list_display = ('invoice', 'content_hash', 'paid_total', 'is_stale', 'rendered_at')
+    list_filter = ('is_stale',)
+    search_fields = ('invoice__code', 'content_hash')
+    raw_id_fields = ('invoice',)
+    readonly_fields = ('content_hash', 'paid_total', 'rendered_at')
+
+
 # ----- LabProfile (اختیاری) -----
 if LabProfile:
     @admin.register(LabProfile)
@@ -193,9 +202,9 @@ class ExpenseAdminForm(forms.ModelForm):
 class ExpenseAdmin(admin.ModelAdmin):
     form = ExpenseAdminForm
 
-    list_display  = ('date', 'category', 'amount_fa', 'note', 'created_at')
-    list_filter   = ('category', 'date', 'created_at')
-    search_fields = ('note',)
+    list_display  = ('date', 'category', 'title', 'vendor', 'expense_type', 'amount_fa', 'paid_date', 'created_at')
+    list_filter   = ('category', 'expense_type', 'payment_method', 'date', 'created_at')
+    search_fields = ('title', 'vendor', 'note')
     date_hierarchy = 'date'
     ordering = ('-date', '-id')
 
@@ -211,7 +220,7 @@ class ExpenseAdmin(admin.ModelAdmin):
 
 
 # =====================[ Inventory Admin ]=====================
-from .models import MaterialItem, MaterialLot, StockMovement, BOMRecipe, StockIssue
+from .models import MaterialItem, MaterialLot, StockMovement, BOMRecipe, StockIssue, StockDriftRecord
 from django import forms  # اگر قبلاً نیست، همین بالا اضافه کن
 
 class MaterialLotAdminForm(forms.ModelForm):
@@ -501,6 +510,15 @@ class StockMovementAdmin(admin.ModelAdmin):
     raw_id_fields = ('item', 'lot', 'order')
 
 
+@admin.register(StockDriftRecord)
+class StockDriftRecordAdmin(admin.ModelAdmin):
+    list_display = ('item', 'checked_at', 'last_seen_at', 'snapshot_qty', 'cardex_qty', 'drift_qty', 'movements_count', 'is_resolved')
+    list_filter = ('is_resolved', 'checked_at')
+    search_fields = ('item__name', 'item__code')
+    raw_id_fields = ('item',)
+    readonly_fields = ('checked_at',)
+
+
 @admin.register(BOMRecipe)
 class BOMRecipeAdmin(admin.ModelAdmin):
     list_display  = ('product', 'item', 'qty_per_unit', 'waste_factor', 'is_active', 'updated_at')
@@ -522,10 +540,23 @@ class StockIssueAdmin(admin.ModelAdmin):
     filter_horizontal = ('linked_moves',)
 
 
-from .models import Equipment, Repair
+from .models import Equipment, Repair, EquipmentDepreciation
+
+
+class EquipmentDepreciationInline(admin.TabularInline):
+    """جدول استهلاک ذخیره‌شده (فقط‌خواندنی؛ با ذخیرهٔ تجهیز از نو ساخته می‌شود)."""
+    model = EquipmentDepreciation
+    fields = ('seq', 'accrue_date', 'period', 'amount', 'accumulated', 'book_value')
+    readonly_fields = fields
+    extra = 0
+    max_num = 0
+    can_delete = False
+    classes = ('collapse',)
+
 
 @admin.register(Equipment)
 class EquipmentAdmin(admin.ModelAdmin):
+    inlines = [EquipmentDepreciationInline]
     list_display  = ('code', 'name', 'category', 'purchase_cost', 'useful_life_m',
                      'monthly_dep_display', 'book_value_display', 'is_active')
     list_filter   = ('category', 'is_active')
@@ -555,8 +586,13 @@ class EquipmentAdmin(admin.ModelAdmin):
         return f"{obj.monthly_depreciation():,.0f}"
     monthly_dep_display.short_description = "استهلاک ماهانه"
 
+    def get_queryset(self, request):
+        from billing.services.depreciation import annotate_position
+        return annotate_position(super().get_queryset(request))
+
     def book_value_display(self, obj):
-        return f"{obj.book_value():,.0f}"
+        bv = getattr(obj, 'dep_book_value', None)
+        return f"{(obj.book_value() if bv is None else bv):,.0f}"
     book_value_display.short_description = "ارزش دفتری"
 
 @admin.register(Repair)
@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        # کش خلاصهٔ هزینهٔ سفارش با ذخیره/حذف جدول‌های فرزند باطل می‌شود
+        from billing.services.order_detail import connect_signals
+        connect_signals()
+        # مکعب ماهانهٔ هزینهٔ محصول (مشاور قیمت) با همان رویدادها به‌صورت افزایشی به‌روز می‌شود
+        from billing.services.product_cost_cube import connect_signals as connect_cost_cube_signals
+        connect_cost_cube_signals()
+        # جدول بهای استاندارد BOM (کش) با تغییر BOM یا avg_unit_cost متریال باطل می‌شود
+        from billing.services.standard_cost import connect_signals as connect_standard_cost_signals
+        connect_standard_cost_signals()
+        # جدول استهلاک ماهانهٔ تجهیز با تغییر قیمت/اسقاط/عمر/تاریخ شروع از نو ساخته می‌شود
+        from billing.services.depreciation import connect_signals as connect_depreciation_signals
+        connect_depreciation_signals()
+        # فهرست‌های انتخاب گزارش مصرف متریال (کش) با تغییر آیتم/محصول باطل می‌شوند
+        from billing.services.material_consumption import connect_signals as connect_consumption_signals
+        connect_consumption_signals()
@@ -0,0 +1,60 @@
+"""
+صدور گروهی پیش‌نویس فاکتور برای همهٔ دکترها در یک بازهٔ shipped_date.
+
+مثال:
+    python manage.py draft_invoices --from 1404/07/01 --to 1404/07/30 --dry-run
+    python manage.py draft_invoices --from 1404/07/01 --to 1404/07/30 --doctor 3 --doctor 5
+"""
+import jdatetime
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.services.batch_invoicing import draft_invoices_for_period
+
+
+def _parse_jalali(s: str) -> jdatetime.date:
+    trans = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+    txt = (s or "").strip().translate(trans).replace("-", "/")
+    try:
+        y, m, d = [int(x) for x in txt.split("/")]
+        return jdatetime.date(y, m, d)
+    except Exception:
+        raise CommandError(f"تاریخ جلالی نامعتبر: {s!r} (قالب درست: 1404/07/01)")
+
+
+class Command(BaseCommand):
+    help = "ساخت پیش‌نویس فاکتور برای همهٔ دکترها از سفارش‌های تحویل‌شدهٔ فاکتورنشده در بازهٔ shipped_date"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="period_from", required=True, help="از تاریخ (جلالی)")
+        parser.add_argument("--to", dest="period_to", required=True, help="تا تاریخ (جلالی)")
+        parser.add_argument("--doctor", dest="doctor_ids", type=int, action="append",
+                            help="محدود به دکتر(ها) با این ID؛ قابل تکرار")
+        parser.add_argument("--dry-run", action="store_true", help="فقط گزارش؛ بدون ثبت در دیتابیس")
+
+    def handle(self, *args, **opts):
+        period_from = _parse_jalali(opts["period_from"])
+        period_to = _parse_jalali(opts["period_to"])
+        if period_from > period_to:
+            raise CommandError("بازهٔ تاریخ نامعتبر است (تا تاریخ باید پس از از تاریخ باشد).")
+
+        res = draft_invoices_for_period(
+            period_from, period_to,
+            doctor_ids=opts.get("doctor_ids"),
+            dry_run=opts["dry_run"],
+        )
+
+        for row in res.doctors:
+            target = "(dry-run)" if res.dry_run else f"#{row.invoice_id} {row.invoice_code}"
+            self.stdout.write(
+                f"{row.doctor_name}: {row.orders_count} سفارش، جمع {row.grand_total} → {target}"
+            )
+        for name, ids in res.unmatched.items():
+            self.stdout.write(self.style.WARNING(
+                f"دکتر «{name}» در جدول دکترها پیدا نشد؛ {len(ids)} سفارش رد شد: {ids[:20]}"
+            ))
+
+        summary = f"{res.invoices_count} فاکتور، {res.lines_count} خط، جمع کل {res.grand_total}"
+        if res.dry_run:
+            self.stdout.write(self.style.NOTICE(f"[dry-run] {summary}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
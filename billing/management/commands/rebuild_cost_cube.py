@@ -0,0 +1,24 @@
+"""
+بازسازی مکعب ماهانهٔ هزینهٔ محصول (billing.ProductMonthlyCost) از روی سفارش‌ها.
+
+به‌روزرسانی روزمره با سیگنال‌ها افزایشی است؛ این دستور برای بار اول، بعد از ورود دادهٔ انبوه
+(loaddata/اسکریپت) یا برای اطمینان از هم‌خوانی است.
+
+مثال:
+    python manage.py rebuild_cost_cube
+    python manage.py rebuild_cost_cube --product crown_zirconia
+"""
+from django.core.management.base import BaseCommand
+
+from billing.services.product_cost_cube import rebuild
+
+
+class Command(BaseCommand):
+    help = "بازسازی مکعب ماهانهٔ هزینهٔ محصولات (مشاور قیمت)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", default="", help="فقط همین کُد محصول (Order.order_type)")
+
+    def handle(self, *args, **opts):
+        n = rebuild(opts["product"] or None)
+        self.stdout.write(self.style.SUCCESS(f"{n} سلول (محصول × ماه) بازسازی شد."))
@@ -0,0 +1,28 @@
+"""
+بازسازی جدول استهلاک ماهانهٔ تجهیزات (billing.EquipmentDepreciation).
+
+به‌روزرسانی روزمره با سیگنال ذخیرهٔ Equipment است؛ این دستور برای بعد از ورود دادهٔ انبوه
+(loaddata/اسکریپت/update) یا برای اطمینان از هم‌خوانی است.
+
+مثال:
+    python manage.py rebuild_depreciation
+    python manage.py rebuild_depreciation --code furnace-01
+"""
+from django.core.management.base import BaseCommand
+
+from billing.models import Equipment
+from billing.services.depreciation import rebuild
+
+
+class Command(BaseCommand):
+    help = "بازسازی جدول استهلاک ماهانهٔ تجهیزات"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--code", default="", help="فقط همین کُد تجهیز")
+
+    def handle(self, *args, **opts):
+        qs = Equipment.objects.all()
+        if opts["code"]:
+            qs = qs.filter(code=opts["code"])
+        n = rebuild(qs)
+        self.stdout.write(self.style.SUCCESS(f"{n} ردیف استهلاک ساخته شد."))
@@ -0,0 +1,39 @@
+"""
+مقایسهٔ اسنپ‌شات موجودی (MaterialItem.stock_qty) با جمع کارتکس و ثبت اختلاف‌ها.
+
+مثال:
+    python manage.py reconcile_stock            # فقط ثبت اختلاف‌ها در StockDriftRecord
+    python manage.py reconcile_stock --fix      # + بازسازی اسنپ‌شات آیتم‌های دارای اختلاف
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.services.stock_reconciliation import record_stock_drift
+
+
+class Command(BaseCommand):
+    help = "کنترل هم‌خوانی موجودی لحظه‌ای با کارتکس و ثبت اختلاف‌ها"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="بازسازی اسنپ‌شات آیتم‌های دارای اختلاف")
+        parser.add_argument("--tolerance", default="0", help="حداقل اختلاف قابل‌گزارش (پیش‌فرض 0)")
+        parser.add_argument("--include-inactive", action="store_true", help="آیتم‌های غیرفعال هم بررسی شوند")
+
+    def handle(self, *args, **opts):
+        try:
+            tol = Decimal(str(opts["tolerance"]))
+        except (InvalidOperation, ValueError):
+            raise CommandError("tolerance نامعتبر است.")
+
+        drifts = record_stock_drift(fix=opts["fix"], tolerance=tol,
+                                    include_inactive=opts["include_inactive"])
+        for d in drifts:
+            self.stdout.write(self.style.WARNING(
+                f"{d.item_name} (#{d.item_id}): اسنپ‌شات {d.snapshot_qty} | کارتکس {d.cardex_qty} | اختلاف {d.drift_qty}"
+            ))
+        if drifts:
+            msg = f"{len(drifts)} آیتم دارای اختلاف" + (" — اسنپ‌شات‌ها بازسازی شد." if opts["fix"] else ".")
+            self.stdout.write(self.style.NOTICE(msg))
+        else:
+            self.stdout.write(self.style.SUCCESS("موجودی همهٔ آیتم‌ها با کارتکس هم‌خوان است."))
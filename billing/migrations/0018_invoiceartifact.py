@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:24
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0017_delete_digitallabcharge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pdf_file', models.FileField(upload_to='invoices/pdf/%Y/%m/')),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('paid_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('is_stale', models.BooleanField(default=False)),
+                ('rendered_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_artifact', to='billing.invoice')),
+            ],
+            options={
+                'verbose_name': 'Invoice PDF',
+                'verbose_name_plural': 'Invoice PDFs',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0018_invoiceartifact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockDriftRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checked_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('snapshot_qty', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('cardex_qty', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('drift_qty', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('movements_count', models.PositiveIntegerField(default=0)),
+                ('is_resolved', models.BooleanField(db_index=True, default=False)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, default='', max_length=160)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drift_records', to='billing.materialitem')),
+            ],
+            options={
+                'verbose_name': 'اختلاف موجودی',
+                'verbose_name_plural': 'اختلاف\u200cهای موجودی',
+                'ordering': ['-checked_at', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:39
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0019_stockdriftrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductMonthlyCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_code', models.CharField(db_index=True, max_length=50)),
+                ('period', models.PositiveIntegerField(db_index=True, help_text='سال و ماه جلالی به\u200cصورت YYYYMM')),
+                ('is_closed', models.BooleanField(default=False)),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('material_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('digital_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('labor_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'هزینهٔ ماهانهٔ محصول',
+                'verbose_name_plural': 'مکعب هزینهٔ ماهانهٔ محصولات',
+                'ordering': ['product_code', '-period'],
+                'constraints': [models.UniqueConstraint(fields=('product_code', 'period', 'is_closed'), name='uniq_product_cost_cell')],
+            },
+        ),
+    ]
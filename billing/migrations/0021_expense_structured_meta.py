@@ -0,0 +1,139 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:46
+
+import re
+from datetime import date, datetime
+
+from django.db import migrations, models
+
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "0123456789" * 2)
+_META_KEYS = {
+    "عنوان": "title",
+    "فروشنده": "vendor",
+    "ماهیت": "expense_type",
+    "وقوع": "occurred_date",
+    "پرداخت": "paid_date",
+    "تاریخ‌پرداخت": "paid_date",
+    "روش‌پرداخت": "payment_method",
+}
+_TYPES = {"opex", "recurring", "unexpected", "capex", "tools"}
+_METHODS = {"cash", "card", "transfer", "other"}
+
+
+def _parse_date(raw):
+    """ISO، میلادی اسلشی یا جلالی اسلشی → date میلادی (یا None)."""
+    s = str(raw or "").strip().translate(_DIGITS).replace(".", "/")
+    if not s:
+        return None
+    try:
+        if len(s) == 10 and s[4] == "-" and s[7] == "-":
+            return datetime.strptime(s, "%Y-%m-%d").date()
+        m = re.match(r"^(\d{4})/(\d{1,2})/(\d{1,2})$", s)
+        if m:
+            y, mth, dd = map(int, m.groups())
+            if y >= 1600:
+                return date(y, mth, dd)
+            import jdatetime
+            return jdatetime.date(y, mth, dd).togregorian()
+    except Exception:
+        pass
+    return None
+
+
+def _split_note(note):
+    """
+    «عنوان: … | فروشنده: … | ماهیت: … | … | یادداشت آزاد» → (fields, free_note).
+    توکن‌هایی که قابل تفسیر نیستند (کلید ناشناخته، تاریخ نامعتبر، مقدار خارج از choices)
+    در یادداشت آزاد باقی می‌مانند تا چیزی از دست نرود.
+    """
+    fields, rest = {}, []
+    for tok in (t.strip() for t in str(note or "").split("|")):
+        if not tok:
+            continue
+        key, sep, val = tok.partition(":")
+        attr = _META_KEYS.get(key.strip()) if sep else None
+        val = val.strip()
+        if attr is None or attr in fields:
+            rest.append(tok)
+            continue
+        if attr in ("occurred_date", "paid_date"):
+            d = _parse_date(val)
+            if d is None:
+                rest.append(tok)
+                continue
+            fields[attr] = d
+        elif attr == "expense_type" and val not in _TYPES:
+            rest.append(tok)
+        elif attr == "payment_method" and val not in _METHODS:
+            rest.append(tok)
+        else:
+            fields[attr] = val[:160]
+    return fields, " | ".join(rest)[:255]
+
+
+def backfill_meta(apps, schema_editor):
+    """یک‌بار پارس note های موجود؛ دسته‌ای (iterator + bulk_update) تا کل جدول در حافظه نیاید."""
+    Expense = apps.get_model("billing", "Expense")
+    cols = ["title", "vendor", "expense_type", "occurred_date", "paid_date", "payment_method", "note"]
+    batch = []
+    for e in Expense.objects.exclude(note="").only("id", "note").order_by("id").iterator(chunk_size=500):
+        fields, free = _split_note(e.note)
+        if not fields:
+            continue
+        for k, v in fields.items():
+            setattr(e, k, v)
+        e.note = free
+        batch.append(e)
+        if len(batch) >= 500:
+            Expense.objects.bulk_update(batch, cols)
+            batch = []
+    if batch:
+        Expense.objects.bulk_update(batch, cols)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0020_productmonthlycost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='expense_type',
+            field=models.CharField(blank=True, choices=[('opex', 'جاری'), ('recurring', 'تکرارشونده'), ('unexpected', 'نامنظم/تعمیرات'), ('capex', 'سرمایه\u200cای'), ('tools', 'ابزار مصرفی')], default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='occurred_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='paid_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='payment_method',
+            field=models.CharField(blank=True, choices=[('cash', 'نقد'), ('card', 'کارت'), ('transfer', 'حواله/کارت\u200cبه\u200cکارت'), ('other', 'سایر')], default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='vendor',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['vendor'], name='expense_vendor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['expense_type', 'date'], name='expense_type_date_idx'),
+        ),
+        migrations.RunPython(backfill_meta, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_schedules(apps, schema_editor):
+    """جدول استهلاک تجهیزات موجود (همان تابع خالص سرویس؛ مدل‌های تاریخی)."""
+    from billing.services.depreciation import schedule_rows
+
+    Equipment = apps.get_model('billing', 'Equipment')
+    EquipmentDepreciation = apps.get_model('billing', 'EquipmentDepreciation')
+    batch = []
+    for eq in Equipment.objects.order_by('id').iterator():
+        for r in schedule_rows(eq.start_use_date or eq.purchase_date, eq.purchase_cost,
+                               eq.salvage_value, eq.useful_life_m):
+            batch.append(EquipmentDepreciation(equipment_id=eq.pk, **r._asdict()))
+        if len(batch) >= 500:
+            EquipmentDepreciation.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        EquipmentDepreciation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0021_expense_structured_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentDepreciation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(verbose_name='ماه شماره')),
+                ('accrue_date', models.DateField(verbose_name='تاریخ ثبت')),
+                ('period', models.PositiveIntegerField(db_index=True, help_text='سال و ماه جلالی به\u200cصورت YYYYMM')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='استهلاک ماه')),
+                ('accumulated', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='استهلاک انباشته')),
+                ('book_value', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='ارزش دفتری')),
+                ('equipment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='depreciation_rows', to='billing.equipment', verbose_name='تجهیز')),
+            ],
+            options={
+                'verbose_name': 'استهلاک ماهانهٔ تجهیز',
+                'verbose_name_plural': 'جدول استهلاک تجهیزات',
+                'ordering': ['equipment', 'seq'],
+                'indexes': [models.Index(fields=['equipment', 'accrue_date'], name='billing_equ_equipme_23eef8_idx'), models.Index(fields=['accrue_date'], name='billing_equ_accrue__e72119_idx')],
+                'constraints': [models.UniqueConstraint(fields=('equipment', 'seq'), name='uniq_equipment_dep_seq')],
+            },
+        ),
+        migrations.RunPython(build_schedules, migrations.RunPython.noop),
+    ]
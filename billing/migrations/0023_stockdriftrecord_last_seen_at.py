@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0022_equipment_depreciation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockdriftrecord',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
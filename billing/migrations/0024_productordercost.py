@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:35
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def clear_cube(apps, schema_editor):
+    """
+    مکعب موجود سهم سفارش‌ها را ندارد؛ پاک می‌شود تا ensure_product/rebuild_cost_cube آن را همراه
+    ProductOrderCost از نو بسازد (جدول مشتق‌شده است).
+    """
+    apps.get_model('billing', 'ProductMonthlyCost').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0023_stockdriftrecord_last_seen_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductOrderCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.PositiveIntegerField(unique=True)),
+                ('product_code', models.CharField(max_length=50)),
+                ('period', models.PositiveIntegerField()),
+                ('is_closed', models.BooleanField(default=False)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('material_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('digital_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('labor_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+            ],
+            options={
+                'verbose_name': 'سهم سفارش در مکعب هزینه',
+                'verbose_name_plural': 'سهم سفارش\u200cها در مکعب هزینه',
+                'indexes': [models.Index(fields=['product_code', 'period', 'is_closed'], name='billing_pro_product_df5c5c_idx')],
+            },
+        ),
+        migrations.RunPython(clear_cube, migrations.RunPython.noop),
+    ]
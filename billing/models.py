@@ -267,6 +267,38 @@ def _update_invoice_status_after_allocation(sender, instance, **kwargs):
         #     invoice.amount_due = max(Decimal("0.00"), grand_total - total_alloc)
         invoice.save(update_fields=["status"])
 
+
+# =====================[ NEW: آرتیفکت PDF فاکتور صادرشده ]=====================
+class InvoiceArtifact(models.Model):
+    """
+    فایل PDF رندرشدهٔ یک فاکتور صادرشده (یک‌بار رندر، چندبار سرو).
+    - در زمان صدور یا اولین چاپ ساخته می‌شود (billing.services.invoice_pdf).
+    - content_hash = SHA-256 محتوای PDF (برای ETag/بررسی یکسانی).
+    - paid_total مبلغ پرداختی لحظهٔ رندر است؛ با تغییر تخصیص‌ها is_stale=True می‌شود.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, related_name='pdf_artifact')
+    pdf_file = models.FileField(upload_to='invoices/pdf/%Y/%m/')
+    content_hash = models.CharField(max_length=64, db_index=True)
+    paid_total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    is_stale = models.BooleanField(default=False)
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Invoice PDF"
+        verbose_name_plural = "Invoice PDFs"
+
+    def __str__(self):
+        return f'PDF of {self.invoice} ({self.content_hash[:8]})'
+
+
+@receiver([post_save, post_delete], sender=PaymentAllocation)
+def _mark_invoice_artifact_stale(sender, instance, **kwargs):
+    """با تغییر تخصیص‌ها مبلغ پرداختی فاکتور عوض می‌شود → PDF ذخیره‌شده باید دوباره ساخته شود."""
+    try:
+        InvoiceArtifact.objects.filter(invoice_id=instance.invoice_id, is_stale=False).update(is_stale=True)
+    except Exception:
+        pass
+
 # =====================[ NEW ]=====================
 class LabProfile(models.Model):
     """
@@ -327,18 +359,41 @@ class Expense(models.Model):
         REPAIRS   = 'repairs',   'تعمیرات/نگهداری'
         SALARY    = 'salary',    'دستمزد/حق‌الزحمه'
 
+    class ExpenseType(models.TextChoices):
+        OPEX       = 'opex',       'جاری'
+        RECURRING  = 'recurring',  'تکرارشونده'
+        UNEXPECTED = 'unexpected', 'نامنظم/تعمیرات'
+        CAPEX      = 'capex',      'سرمایه‌ای'
+        TOOLS      = 'tools',      'ابزار مصرفی'
+
+    class PaymentMethod(models.TextChoices):
+        CASH     = 'cash',     'نقد'
+        CARD     = 'card',     'کارت'
+        TRANSFER = 'transfer', 'حواله/کارت‌به‌کارت'
+        OTHER    = 'other',    'سایر'
+
     date       = models.DateField()
     category   = models.CharField(max_length=24, choices=Category.choices, db_index=True)
     amount     = models.DecimalField(max_digits=14, decimal_places=2)
     note       = models.CharField(max_length=255, blank=True)
     attachment = models.FileField(upload_to='expenses/', null=True, blank=True)
 
+    # متادیتای ساخت‌یافته (قبلاً به صورت «کلید: مقدار | ...» داخل note بسته‌بندی می‌شد)
+    title          = models.CharField(max_length=160, blank=True, default='')
+    vendor         = models.CharField(max_length=160, blank=True, default='')
+    expense_type   = models.CharField(max_length=16, choices=ExpenseType.choices, blank=True, default='')
+    occurred_date  = models.DateField(null=True, blank=True)
+    paid_date      = models.DateField(null=True, blank=True)
+    payment_method = models.CharField(max_length=16, choices=PaymentMethod.choices, blank=True, default='')
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['date']),
             models.Index(fields=['category']),
+            models.Index(fields=['vendor'], name='expense_vendor_idx'),
+            models.Index(fields=['expense_type', 'date'], name='expense_type_date_idx'),
         ]
         ordering = ['-date', '-id']
 
@@ -827,19 +882,49 @@ class Equipment(models.Model):
         per = (cost - salvage) / Decimal(life)
         return per.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
-    def accumulated_depreciation(self) -> Decimal:
-        used = min(self.months_used(), self.useful_life_m or 0)
-        acc = self.monthly_depreciation() * Decimal(used)
-        return acc.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    def accumulated_depreciation(self, as_of=None) -> Decimal:
+        # همان منطق جدول استهلاک ذخیره‌شده (ماه آخر اختلاف گرد کردن را جذب می‌کند)
+        from billing.services.depreciation import position
+        return position(self, as_of).accumulated
+
+    def book_value(self, as_of=None) -> Decimal:
+        # ارزش دفتری = قیمت خرید - استهلاک انباشته (ماه آخر دقیقاً به ارزش اسقاط می‌رسد)
+        from billing.services.depreciation import position
+        return position(self, as_of).book_value
 
-    def book_value(self) -> Decimal:
-        # ارزش دفتری = قیمت خرید - استهلاک انباشته (نه کمتر از ارزش اسقاط)
-        cost = self.purchase_cost or Decimal('0.00')
-        salvage = self.salvage_value or Decimal('0.00')
-        bv = cost - self.accumulated_depreciation()
-        if bv < salvage:
-            bv = salvage
-        return bv.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+# =====================[ NEW: جدول استهلاک ماهانهٔ تجهیزات ]=====================
+class EquipmentDepreciation(models.Model):
+    """
+    یک ردیف = استهلاک یک ماه از عمر مفید یک تجهیز (خط مستقیم).
+    با تغییر قیمت خرید/اسقاط/عمر/تاریخ شروع، کل جدول آن تجهیز از نو ساخته می‌شود؛
+    ر.ک. billing/services/depreciation.py
+    - accrue_date: روزی که این ماه در months_used() شمرده می‌شود (هم‌خوان با منطق قبلی).
+    - accumulated/book_value: وضعیت پس از ثبت همین ماه.
+    """
+    equipment   = models.ForeignKey('Equipment', on_delete=models.CASCADE, related_name='depreciation_rows',
+                                    verbose_name="تجهیز")
+    seq         = models.PositiveIntegerField(verbose_name="ماه شماره")
+    accrue_date = models.DateField(verbose_name="تاریخ ثبت")
+    period      = models.PositiveIntegerField(db_index=True, help_text="سال و ماه جلالی به‌صورت YYYYMM")
+    amount      = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="استهلاک ماه")
+    accumulated = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="استهلاک انباشته")
+    book_value  = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="ارزش دفتری")
+
+    class Meta:
+        ordering = ['equipment', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['equipment', 'seq'], name='uniq_equipment_dep_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['equipment', 'accrue_date']),
+            models.Index(fields=['accrue_date']),
+        ]
+        verbose_name = "استهلاک ماهانهٔ تجهیز"
+        verbose_name_plural = "جدول استهلاک تجهیزات"
+
+    def __str__(self):
+        return f"{self.equipment_id} · {self.seq} · {self.amount}"
 
 
 class Repair(models.Model):
@@ -882,12 +967,48 @@ class Repair(models.Model):
         super().save(*args, **kwargs)
 
 # ===== Keep MaterialItem snapshot always consistent with cardex =====
+import threading
+from contextlib import contextmanager
+
+_snapshot_defer = threading.local()
+
+
+@contextmanager
+def deferred_snapshot_recompute():
+    """
+    برای عملیات گروهی روی کارتکس (مثل لغو تخصیص لات): بازسازی اسنپ‌شات به ازای هر حرکت
+    انجام نمی‌شود و آیتم‌های درگیر در پایان فقط یک‌بار بازسازی می‌شوند.
+    """
+    outer = getattr(_snapshot_defer, "items", None)
+    if outer is not None:
+        yield outer
+        return
+    _snapshot_defer.items = set()
+    try:
+        yield _snapshot_defer.items
+        item_ids = set(_snapshot_defer.items)
+    finally:
+        _snapshot_defer.items = None
+    for item in MaterialItem.objects.filter(pk__in=item_ids):
+        item.recompute_snapshot()
+
+
+def _snapshot_deferred(instance) -> bool:
+    items = getattr(_snapshot_defer, "items", None)
+    if items is None:
+        return False
+    items.add(instance.item_id)
+    return True
+
+
 @receiver(post_delete, sender=StockMovement)
 def _recompute_item_snapshot_after_delete(sender, instance, **kwargs):
     """
     هر حرکت کارتکس که حذف شد (حتی با bulk delete)،
     اسنپ‌شات آیتم مربوطه را از روی کل کارتکس بازسازی کن.
     """
+    if _snapshot_deferred(instance):
+        return
     try:
         instance.item.recompute_snapshot()
     except Exception:
@@ -901,7 +1022,98 @@ def _recompute_item_snapshot_after_save(sender, instance, **kwargs):
     اسنپ‌شات آیتم دوباره از روی کارتکس بازسازی شود.
     (کمی هزینه‌ی محاسبه دارد، اما خطای موجودی منفیِ کاذب را برای همیشه می‌بندد.)
     """
+    if _snapshot_deferred(instance):
+        return
     try:
         instance.item.recompute_snapshot()
     except Exception:
         pass
+
+
+# =====================[ NEW: کنترل هم‌خوانی اسنپ‌شات موجودی با کارتکس ]=====================
+class StockDriftRecord(models.Model):
+    """
+    نتیجهٔ اجرای reconcile_stock: هر ردیف یعنی stock_qty آیتم با جمع کارتکس یکی نبوده.
+    هر آیتم حداکثر یک رکورد باز دارد؛ اجراهای بعدی همان را با مقادیر تازه به‌روز می‌کنند.
+    drift_qty = cardex_qty - snapshot_qty
+    """
+    item          = models.ForeignKey('MaterialItem', on_delete=models.CASCADE, related_name='drift_records')
+    checked_at    = models.DateTimeField(auto_now_add=True, db_index=True)
+    # آخرین اجرایی که اختلاف هنوز دیده شد (رکورد باز در اجراهای بعدی به‌روز می‌شود، تکرار نمی‌شود)
+    last_seen_at  = models.DateTimeField(null=True, blank=True)
+    snapshot_qty  = models.DecimalField(max_digits=12, decimal_places=3)
+    cardex_qty    = models.DecimalField(max_digits=12, decimal_places=3)
+    drift_qty     = models.DecimalField(max_digits=12, decimal_places=3)
+    movements_count = models.PositiveIntegerField(default=0)
+    # اگر اجرای بعدی اختلاف را نبیند یا با --fix اصلاح شود، resolved می‌شود
+    is_resolved   = models.BooleanField(default=False, db_index=True)
+    resolved_at   = models.DateTimeField(null=True, blank=True)
+    note          = models.CharField(max_length=160, blank=True, default="")
+
+    class Meta:
+        ordering = ['-checked_at', '-id']
+        verbose_name = "اختلاف موجودی"
+        verbose_name_plural = "اختلاف‌های موجودی"
+
+    def __str__(self):
+        return f"{self.item} · drift {self.drift_qty}"
+
+
+# =====================[ NEW: مکعب ماهانهٔ بهای تمام‌شدهٔ محصول ]=====================
+class ProductMonthlyCost(models.Model):
+    """
+    یک ردیف = جمع هزینه/درآمد سفارش‌های یک محصول (Order.order_type) در یک ماه جلالی.
+    ماه از order_date (یا در نبودش created_at) و is_closed = delivered یا shipped_date دار.
+    با سیگنال‌های Order/StockIssue/DigitalLabTransfer/StageWorkLog/InvoiceLine به‌صورت افزایشی
+    (تفاضل سهم سفارش‌های درگیر، ر.ک. ProductOrderCost) به‌روز می‌شود؛ ر.ک. billing/services/product_cost_cube.py
+    """
+    product_code  = models.CharField(max_length=50, db_index=True)
+    period        = models.PositiveIntegerField(db_index=True, help_text="سال و ماه جلالی به‌صورت YYYYMM")
+    is_closed     = models.BooleanField(default=False)
+
+    orders_count  = models.PositiveIntegerField(default=0)
+    units         = models.PositiveIntegerField(default=0)
+    revenue       = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    material_cost = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    digital_cost  = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    labor_cost    = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    refreshed_at  = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['product_code', '-period']
+        constraints = [
+            models.UniqueConstraint(fields=['product_code', 'period', 'is_closed'],
+                                    name='uniq_product_cost_cell'),
+        ]
+        verbose_name = "هزینهٔ ماهانهٔ محصول"
+        verbose_name_plural = "مکعب هزینهٔ ماهانهٔ محصولات"
+
+    def __str__(self):
+        return f"{self.product_code} · {self.period // 100}/{self.period % 100:02d}"
+
+
+class ProductOrderCost(models.Model):
+    """
+    سهم هر سفارش در مکعب: سلولی که در آن شمرده شده و مقادیری که آخرین بار به آن اضافه شد.
+    به‌روزرسانی افزایشی سهم قبلی را از سلول قبلی کم و سهم تازه را به سلول جدید اضافه می‌کند
+    (بدون پیمایش دوبارهٔ کل سفارش‌های ماه). order_id عمداً FK نیست تا بعد از حذف سفارش هم
+    سهمش کم شود. فقط سفارش‌های محصولاتی که مکعبشان ساخته شده ردیف دارند.
+    """
+    order_id      = models.PositiveIntegerField(unique=True)
+    product_code  = models.CharField(max_length=50)
+    period        = models.PositiveIntegerField()
+    is_closed     = models.BooleanField(default=False)
+
+    units         = models.PositiveIntegerField(default=0)
+    revenue       = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    material_cost = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    digital_cost  = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    labor_cost    = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        indexes = [models.Index(fields=['product_code', 'period', 'is_closed'])]
+        verbose_name = "سهم سفارش در مکعب هزینه"
+        verbose_name_plural = "سهم سفارش‌ها در مکعب هزینه"
+
+    def __str__(self):
+        return f"#{self.order_id} · {self.product_code} · {self.period}"
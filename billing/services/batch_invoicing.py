@@ -0,0 +1,231 @@
+"""
+صدور گروهی پیش‌نویس فاکتور برای همهٔ دکترها در یک بازهٔ shipped_date.
+
+- سفارش‌های تحویل‌شده (delivered) و فاکتورنشده‌ی بازه، بر اساس نام دکتر گروه‌بندی می‌شوند.
+- برای هر دکتر یک Invoice (Draft) ساخته می‌شود؛ همهٔ فاکتورها و خطوط با bulk_create درج می‌شوند.
+- جمع‌ها (subtotal/grand_total/amount_due) در حافظه محاسبه می‌شوند (بدون recompute_totals).
+- کل عملیات در یک تراکنش است؛ در حالت dry_run هیچ چیزی در DB نوشته نمی‌شود.
+- bulk_create سیگنال ندارد؛ مکعب هزینه و کش خلاصهٔ سفارش برای سفارش‌های فاکتورشده دستی علامت می‌خورند.
+"""
+from __future__ import annotations
+
+import datetime
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+import jdatetime
+from django.db import transaction
+from django.utils import timezone
+
+from billing.models import Invoice, InvoiceLine
+from core.utils.jalali import to_gregorian, to_jalali
+from core.models import Doctor, Order
+
+ZERO = Decimal("0.00")
+
+
+def _q2(x) -> Decimal:
+    return Decimal(x or 0).quantize(Decimal("0.01"))
+
+
+def _as_jdate(d):
+    """ورودی میلادی یا جلالی → jdatetime.date (برای فیلتر روی jDateField)."""
+    return to_jalali(d)
+
+
+def _as_gdate(d):
+    """ورودی میلادی یا جلالی → datetime.date (برای Invoice.period_from/to که DateField است)."""
+    if d is None:
+        return None
+    if isinstance(d, jdatetime.date):
+        return to_gregorian(d)
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+def _doctor_key(name: str) -> str:
+    return (name or "").strip().lower()
+
+
+def _line_values(o: Order):
+    """
+    همان منطق InvoiceCreateDraftView.post:
+    line_total = total_price (اگر > 0) وگرنه unit_count * price
+    """
+    uc = int(o.unit_count or 1)
+    up = _q2(o.price)
+    try:
+        tp = o.total_price
+        tp = Decimal(str(tp)) if tp not in (None, "") else None
+    except Exception:
+        tp = None
+    line_total = _q2(tp) if (tp is not None and tp > 0) else _q2(Decimal(uc) * up)
+    return uc, up, line_total
+
+
+@dataclass
+class DoctorBatchResult:
+    doctor_id: int
+    doctor_name: str
+    order_ids: List[int] = field(default_factory=list)
+    subtotal: Decimal = ZERO
+    grand_total: Decimal = ZERO
+    invoice_id: Optional[int] = None
+    invoice_code: str = ""
+
+    @property
+    def orders_count(self) -> int:
+        return len(self.order_ids)
+
+    def to_dict(self):
+        d = asdict(self)
+        d["orders_count"] = self.orders_count
+        for k in ("subtotal", "grand_total"):
+            d[k] = str(d[k])
+        return d
+
+
+@dataclass
+class BatchInvoiceResult:
+    period_from: object
+    period_to: object
+    dry_run: bool
+    doctors: List[DoctorBatchResult] = field(default_factory=list)
+    # نام‌هایی که در Order.doctor آمده‌اند ولی Doctor متناظر ندارند → {نام: [order_id, ...]}
+    unmatched: Dict[str, List[int]] = field(default_factory=dict)
+
+    @property
+    def invoices_count(self) -> int:
+        return len(self.doctors)
+
+    @property
+    def lines_count(self) -> int:
+        return sum(r.orders_count for r in self.doctors)
+
+    @property
+    def grand_total(self) -> Decimal:
+        return _q2(sum((r.grand_total for r in self.doctors), ZERO))
+
+    def to_dict(self):
+        return {
+            "period_from": str(self.period_from),
+            "period_to": str(self.period_to),
+            "dry_run": self.dry_run,
+            "invoices_count": self.invoices_count,
+            "lines_count": self.lines_count,
+            "grand_total": str(self.grand_total),
+            "doctors": [r.to_dict() for r in self.doctors],
+            "unmatched": self.unmatched,
+        }
+
+
+def _new_draft_code() -> str:
+    # همان الگوی کُد موقت در InvoiceCreateDraftView
+    return f"DRAFT-{timezone.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+
+
+def draft_invoices_for_period(
+    period_from,
+    period_to,
+    *,
+    doctor_ids: Optional[Iterable[int]] = None,
+    dry_run: bool = False,
+) -> BatchInvoiceResult:
+    """
+    ساخت پیش‌نویس فاکتور برای همهٔ دکترها (یا دکترهای انتخاب‌شده) در بازهٔ shipped_date.
+
+    ورودی:
+      - period_from / period_to: تاریخ جلالی (jdatetime.date) یا میلادی (datetime.date)
+      - doctor_ids: محدود کردن به چند دکتر (اختیاری)
+      - dry_run: فقط محاسبه و گزارش؛ بدون نوشتن در DB
+    خروجی: BatchInvoiceResult با نتیجهٔ هر دکتر.
+    """
+    j_from, j_to = _as_jdate(period_from), _as_jdate(period_to)
+    result = BatchInvoiceResult(period_from=j_from, period_to=j_to, dry_run=dry_run)
+
+    doctors_qs = Doctor.objects.all()
+    if doctor_ids:
+        doctors_qs = doctors_qs.filter(pk__in=list(doctor_ids))
+    doctors_by_key = {}
+    for d in doctors_qs.order_by("name", "id"):
+        # اگر دو دکتر هم‌نام باشند، اولی ملاک است (مثل _filter_by_doctor که iexact روی نام است)
+        doctors_by_key.setdefault(_doctor_key(d.name), d)
+
+    with transaction.atomic():
+        orders_qs = (
+            Order.objects
+            .filter(status="delivered",
+                    shipped_date__gte=j_from, shipped_date__lte=j_to,
+                    invoice_line__isnull=True)
+            .only("id", "doctor", "unit_count", "price", "shipped_date")
+            .order_by("doctor", "shipped_date", "id")
+        )
+        if not dry_run:
+            orders_qs = orders_qs.select_for_update()
+
+        # گروه‌بندی سفارش‌ها بر اساس دکتر (Order.doctor متنی است)
+        groups: "OrderedDict[int, tuple]" = OrderedDict()
+        for o in orders_qs:
+            key = _doctor_key(o.doctor)
+            doc = doctors_by_key.get(key)
+            if doc is None:
+                if not doctor_ids:
+                    result.unmatched.setdefault((o.doctor or "").strip() or "—", []).append(o.id)
+                continue
+            if doc.id not in groups:
+                groups[doc.id] = (doc, DoctorBatchResult(doctor_id=doc.id, doctor_name=doc.name), [])
+            _, row, lines = groups[doc.id]
+            uc, up, line_total = _line_values(o)
+            row.order_ids.append(o.id)
+            row.subtotal += _q2(Decimal(uc) * up)
+            row.grand_total += line_total
+            lines.append((o, uc, up, line_total))
+
+        result.doctors = [row for (_, row, _) in groups.values()]
+        if dry_run or not groups:
+            return result
+
+        g_from, g_to = _as_gdate(j_from), _as_gdate(j_to)
+        invoices = []
+        for doc, row, lines in groups.values():
+            row.invoice_code = _new_draft_code()
+            invoices.append(Invoice(
+                code=row.invoice_code,
+                doctor=doc,
+                status=Invoice.Status.DRAFT,
+                period_from=g_from,
+                period_to=g_to,
+                subtotal=_q2(row.subtotal),
+                grand_total=_q2(row.grand_total),
+                amount_due=_q2(row.grand_total),
+                notes=f"فاکتور پیش‌نویس از {row.orders_count} سفارش (صدور گروهی)",
+            ))
+        Invoice.objects.bulk_create(invoices)
+
+        line_objs = []
+        for inv, (doc, row, lines) in zip(invoices, groups.values()):
+            row.invoice_id = inv.pk
+            for o, uc, up, line_total in lines:
+                line_objs.append(InvoiceLine(
+                    invoice=inv,
+                    order_id=o.id,
+                    description=f"Order #{o.id}",
+                    unit_count=uc,
+                    unit_price=up,
+                    discount_amount=ZERO,
+                    line_total=line_total,
+                ))
+        # OneToOne روی order اجازهٔ فاکتور دوباره نمی‌دهد؛ در صورت تداخل، کل تراکنش برمی‌گردد.
+        InvoiceLine.objects.bulk_create(line_objs, batch_size=500)
+
+        # bulk_create سیگنال post_save ندارد؛ درآمد این سفارش‌ها در مکعب هزینه و کش خلاصه عوض شده
+        from billing.services import order_detail, product_cost_cube
+        order_ids = [ln.order_id for ln in line_objs]
+        product_cost_cube.mark_dirty(order_ids=order_ids)
+        order_detail.invalidate_order_cost(*order_ids)
+
+    return result
@@ -0,0 +1,205 @@
+"""
+جدول استهلاک ماهانهٔ تجهیزات (billing.EquipmentDepreciation) — خط مستقیم.
+
+- برای هر تجهیز به ازای هر ماه از عمر مفید یک ردیف ذخیره می‌شود (مبلغ ماه، انباشته، ارزش دفتری).
+  ماه آخر اختلاف گرد کردن را جذب می‌کند تا جمع استهلاک دقیقاً «قیمت خرید − اسقاط» شود.
+- تاریخ ثبت هر ماه (accrue_date) طوری است که تعداد ردیف‌های تا امروز = Equipment.months_used().
+- با تغییر قیمت خرید/اسقاط/عمر/تاریخ شروع (سیگنال pre_save/post_save) جدول همان تجهیز
+  از نو ساخته می‌شود؛ بقیهٔ ویرایش‌ها (نام، محل، ...) کاری به جدول ندارند.
+- گزارش‌ها (ارزش دفتری کل، استهلاک ماه/دوره، دفتر دارایی) با Subquery/aggregate سمت DB.
+"""
+from __future__ import annotations
+
+import calendar
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterator, NamedTuple, Optional
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_save
+from django.utils import timezone
+
+from core.utils.jalali import period_of as jalali_period_of
+
+ZERO = Decimal("0.00")
+SCHEDULE_FIELDS = ("purchase_date", "start_use_date", "purchase_cost", "salvage_value", "useful_life_m")
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+
+
+def _q2(x) -> Decimal:
+    return x.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def period_of(d) -> int:
+    """تاریخ میلادی → YYYYMM جلالی (مثل مکعب هزینهٔ محصول)."""
+    return jalali_period_of(d)
+
+
+def _accrue_date(start: date, k: int) -> date:
+    """
+    روزی که ماه (k+1)ام در months_used() شمرده می‌شود: همان روزِ شروع در k ماه بعد؛
+    اگر آن روز در آن ماه نباشد (مثلاً ۳۱ام)، اول ماه بعدش.
+    """
+    m0 = start.month - 1 + k
+    y, m = start.year + m0 // 12, m0 % 12 + 1
+    if start.day <= calendar.monthrange(y, m)[1]:
+        return date(y, m, start.day)
+    m0 += 1
+    return date(start.year + m0 // 12, m0 % 12 + 1, 1)
+
+
+class ScheduleRow(NamedTuple):
+    seq: int
+    accrue_date: date
+    period: int
+    amount: Decimal
+    accumulated: Decimal
+    book_value: Decimal
+
+
+def schedule_rows(start, cost, salvage, life) -> Iterator[ScheduleRow]:
+    """تابع خالص (بدون DB)؛ در مایگریشن و مدل هم استفاده می‌شود."""
+    cost = cost or ZERO
+    salvage = salvage or ZERO
+    life = life or 0
+    if not start or life <= 0 or cost <= salvage:
+        return
+    base = cost - salvage
+    per = _q2(base / Decimal(life))
+    acc = ZERO
+    for k in range(life):
+        amount = base - acc if k == life - 1 else min(per, base - acc)
+        acc += amount
+        d = _accrue_date(start, k)
+        yield ScheduleRow(k + 1, d, period_of(d), amount, acc, cost - acc)
+
+
+def _schedule_for(equipment) -> Iterator[ScheduleRow]:
+    return schedule_rows(
+        equipment.start_use_date or equipment.purchase_date,
+        equipment.purchase_cost, equipment.salvage_value, equipment.useful_life_m,
+    )
+
+
+@dataclass
+class Position:
+    accumulated: Decimal
+    book_value: Decimal
+
+
+def position(equipment, as_of: Optional[date] = None) -> Position:
+    """وضعیت یک تجهیز در تاریخ as_of بدون DB (برای متدهای مدل و اشیای ذخیره‌نشده)."""
+    as_of = as_of or timezone.localdate()
+    pos = Position(accumulated=ZERO, book_value=equipment.purchase_cost or ZERO)
+    for r in _schedule_for(equipment):
+        if r.accrue_date > as_of:
+            break
+        pos = Position(accumulated=r.accumulated, book_value=r.book_value)
+    return pos
+
+
+# ---------- ساخت/بازسازی جدول ----------
+def regenerate(equipment) -> int:
+    from billing.models import EquipmentDepreciation
+
+    rows = [EquipmentDepreciation(equipment_id=equipment.pk, **r._asdict()) for r in _schedule_for(equipment)]
+    with transaction.atomic():
+        EquipmentDepreciation.objects.filter(equipment_id=equipment.pk).delete()
+        EquipmentDepreciation.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def rebuild(equipment_qs=None) -> int:
+    """بازسازی کامل (یا برای یک کوئری‌ست)؛ خروجی: تعداد ردیف‌های ساخته‌شده."""
+    from billing.models import Equipment
+
+    qs = Equipment.objects.all() if equipment_qs is None else equipment_qs
+    n = 0
+    for eq in qs.only("id", *SCHEDULE_FIELDS).iterator():
+        n += regenerate(eq)
+    return n
+
+
+# ---------- خواندن سمت DB ----------
+def annotate_position(qs, as_of: Optional[date] = None):
+    """
+    dep_accumulated / dep_book_value (آخرین ردیف تا as_of) و dep_month (استهلاک ماه جلالی as_of)
+    را با Subquery روی کوئری‌ست Equipment اضافه می‌کند.
+    """
+    from billing.models import EquipmentDepreciation
+
+    as_of = as_of or timezone.localdate()
+    last = (EquipmentDepreciation.objects
+            .filter(equipment=OuterRef("pk"), accrue_date__lte=as_of)
+            .order_by("-seq"))
+    month = EquipmentDepreciation.objects.filter(equipment=OuterRef("pk"), period=period_of(as_of))
+    return qs.annotate(
+        dep_accumulated=Coalesce(Subquery(last.values("accumulated")[:1]), Value(ZERO), output_field=_DEC),
+        dep_book_value=Coalesce(Subquery(last.values("book_value")[:1]), F("purchase_cost"), output_field=_DEC),
+        dep_month=Coalesce(Subquery(month.values("amount")[:1]), Value(ZERO), output_field=_DEC),
+    )
+
+
+@dataclass
+class RegisterTotals:
+    purchase_cost: Decimal = ZERO
+    accumulated: Decimal = ZERO
+    book_value: Decimal = ZERO
+    month_expense: Decimal = ZERO
+
+
+def register_totals(qs, as_of: Optional[date] = None) -> RegisterTotals:
+    """جمع دفتر دارایی برای کوئری‌ست Equipment در یک کوئری."""
+    agg = annotate_position(qs.order_by(), as_of).aggregate(
+        cost=Sum("purchase_cost"), acc=Sum("dep_accumulated"),
+        bv=Sum("dep_book_value"), month=Sum("dep_month"),
+    )
+    return RegisterTotals(
+        purchase_cost=agg["cost"] or ZERO,
+        accumulated=agg["acc"] or ZERO,
+        book_value=agg["bv"] or ZERO,
+        month_expense=agg["month"] or ZERO,
+    )
+
+
+def period_expense(date_from: Optional[date] = None, date_to: Optional[date] = None) -> Decimal:
+    """جمع استهلاک ماه‌هایی که accrue_date آن‌ها در بازه است (برای سود و زیان دوره)."""
+    from billing.models import EquipmentDepreciation
+
+    qs = EquipmentDepreciation.objects.all()
+    if date_from:
+        qs = qs.filter(accrue_date__gte=date_from)
+    if date_to:
+        qs = qs.filter(accrue_date__lte=date_to)
+    return qs.aggregate(s=Sum("amount"))["s"] or ZERO
+
+
+# ---------- سیگنال‌ها ----------
+def _on_equipment_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(SCHEDULE_FIELDS):
+        instance._dep_dirty = False
+        return
+    if instance.pk is None:
+        instance._dep_dirty = True
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*SCHEDULE_FIELDS).first()
+    instance._dep_dirty = old is None or any(old[f] != getattr(instance, f) for f in SCHEDULE_FIELDS)
+
+
+def _on_equipment_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created or getattr(instance, "_dep_dirty", True):
+        regenerate(instance)
+    instance._dep_dirty = False
+
+
+def connect_signals():
+    """در BillingConfig.ready صدا زده می‌شود."""
+    pre_save.connect(_on_equipment_pre_save, sender="billing.Equipment", dispatch_uid="depreciation_pre_save")
+    post_save.connect(_on_equipment_save, sender="billing.Equipment", dispatch_uid="depreciation_save")
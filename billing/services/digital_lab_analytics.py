@@ -0,0 +1,204 @@
+"""
+تحلیل لاب دیجیتال با یک لایهٔ اعلانی «بُعد × سنجه».
+
+- بُعدها (DIMENSIONS): lab, stage, month, doctor
+- سنجه‌ها (MEASURES): charge, credit, net, attempts, redos, orders
+  و سنجهٔ مشتق redo_rate (= redos / attempts) که بعد از کوئری حساب می‌شود.
+- هر بُعدِ خواسته‌شده دقیقاً یک کوئری GROUP BY است؛ KPIهای کل هم یک aggregate واحد
+  (شامل تعداد سفارش یکتا با COUNT DISTINCT).
+- زمان چرخه (turnaround = received_date - sent_date) با یک کوئری سبک روی ردیف‌های دریافت‌شده
+  خوانده و صدک‌ها (p50/p90/p95) در پایتون حساب می‌شوند (SQLite تابع percentile ندارد).
+- زنجیره‌های ری‌ورک (chain_root / chain_depth، core/utils/dl_chains.py): بازده بار اول به تفکیک لاب،
+  ری‌ورک به تفکیک لاب × مرحله و پرهزینه‌ترین/عمیق‌ترین زنجیره‌ها — هر کدام یک کوئری GROUP BY.
+
+مثال:
+    report = analyze(qs, dimensions=("lab", "stage", "month"), measures=("charge", "credit", "net", "attempts"))
+    report.totals / report.by["lab"] / report.turnaround
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+ZERO = Decimal("0.00")
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+
+
+def _dsum(field_name):
+    return Coalesce(Sum(field_name), Value(ZERO, output_field=_DEC), output_field=_DEC)
+
+
+# ---------- تعریف‌ها ----------
+# هر بُعد: تابعی که عبارت گروه‌بندی تازه می‌سازد
+DIMENSIONS = {
+    "lab":    lambda: F("lab_name"),
+    "stage":  lambda: F("stage_name"),
+    "month":  lambda: TruncMonth("sent_date"),
+    "doctor": lambda: F("order__doctor"),
+}
+
+# هر سنجه: تابعی که عبارت aggregate تازه می‌سازد
+MEASURES = {
+    "charge":   lambda: _dsum("charge_amount"),
+    "credit":   lambda: _dsum("credit_amount"),
+    "net":      lambda: _dsum("charge_amount") - _dsum("credit_amount"),
+    "attempts": lambda: Count("id"),
+    "redos":    lambda: Count("id", filter=Q(is_redo=True)),
+    "orders":   lambda: Count("order_id", distinct=True),
+}
+
+# سنجه‌های مشتق: (وابستگی‌ها, تابع محاسبه روی ردیف)
+DERIVED = {
+    "redo_rate": (("redos", "attempts"),
+                  lambda r: (Decimal(r["redos"]) / Decimal(r["attempts"]) * 100).quantize(Decimal("0.1"))
+                  if r.get("attempts") else Decimal("0.0")),
+}
+
+DEFAULT_MEASURES = ("charge", "credit", "net", "attempts", "redos", "redo_rate")
+
+
+@dataclass
+class TurnaroundStats:
+    count: int = 0
+    mean: Optional[float] = None
+    p50: Optional[float] = None
+    p90: Optional[float] = None
+    p95: Optional[float] = None
+    max: Optional[int] = None
+
+
+@dataclass
+class DigitalLabAnalytics:
+    totals: dict = field(default_factory=dict)
+    by: Dict[str, List[dict]] = field(default_factory=dict)
+    turnaround: TurnaroundStats = field(default_factory=TurnaroundStats)
+    turnaround_by_lab: List[dict] = field(default_factory=list)
+    first_pass_yield: List[dict] = field(default_factory=list)   # به تفکیک لاب
+    redo_counts: List[dict] = field(default_factory=list)        # به تفکیک لاب × مرحله
+    chains: List[dict] = field(default_factory=list)             # زنجیره‌های ری‌ورک‌دار (عمیق/پرهزینه)
+
+
+# ---------- کامپایل ----------
+def _split_measures(measures: Iterable[str]):
+    base, derived = [], []
+    for m in measures:
+        if m in MEASURES:
+            if m not in base:
+                base.append(m)
+        elif m in DERIVED:
+            derived.append(m)
+            for dep in DERIVED[m][0]:
+                if dep not in base:
+                    base.append(dep)
+        else:
+            raise ValueError(f"سنجهٔ ناشناخته: {m}")
+    return base, derived
+
+
+def _apply_derived(row, derived):
+    for m in derived:
+        row[m] = DERIVED[m][1](row)
+    return row
+
+
+def aggregate_totals(qs, measures=DEFAULT_MEASURES) -> dict:
+    """همهٔ سنجه‌ها روی کل qs در یک aggregate."""
+    base, derived = _split_measures(measures)
+    row = qs.order_by().aggregate(**{m: MEASURES[m]() for m in base})
+    return _apply_derived(row, derived)
+
+
+def group_by(qs, dimension: str, measures=DEFAULT_MEASURES, order_by=None, limit=None) -> List[dict]:
+    """یک کوئری GROUP BY برای یک بُعد؛ کلید بُعد در خروجی همان نام بُعد است (lab/stage/month/doctor)."""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"بُعد ناشناخته: {dimension}")
+    base, derived = _split_measures(measures)
+    g = (
+        qs.order_by()
+        .annotate(**{f"_dim_{dimension}": DIMENSIONS[dimension]()})
+        .values(f"_dim_{dimension}")
+        .annotate(**{m: MEASURES[m]() for m in base})
+    )
+    if order_by:
+        g = g.order_by(*order_by)
+    elif dimension == "month":
+        g = g.order_by(f"_dim_{dimension}")
+    if limit:
+        g = g[:limit]
+    out = []
+    for r in g:
+        r[dimension] = r.pop(f"_dim_{dimension}")
+        out.append(_apply_derived(r, derived))
+    return out
+
+
+# ---------- زمان چرخه ----------
+def _percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * (p / 100.0)
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return float(sorted_vals[int(k)])
+    return round(float(sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)), 1)
+
+
+def _stats(days) -> TurnaroundStats:
+    days = sorted(days)
+    if not days:
+        return TurnaroundStats()
+    return TurnaroundStats(
+        count=len(days),
+        mean=round(sum(days) / len(days), 1),
+        p50=_percentile(days, 50),
+        p90=_percentile(days, 90),
+        p95=_percentile(days, 95),
+        max=days[-1],
+    )
+
+
+def turnaround(qs, by_lab_limit=20):
+    """(آمار کل, آمار به تفکیک لاب) — فقط ردیف‌هایی که received_date دارند؛ یک کوئری سه‌ستونه."""
+    per_lab: Dict[str, list] = {}
+    all_days = []
+    rows = (qs.order_by()
+            .filter(received_date__isnull=False)
+            .exclude(status="cancelled")
+            .values_list("lab_name", "sent_date", "received_date"))
+    for lab, sent, received in rows.iterator():
+        if not sent or not received:
+            continue
+        d = (received - sent).days
+        if d < 0:
+            continue
+        all_days.append(d)
+        per_lab.setdefault(lab or "", []).append(d)
+    by_lab = [{"lab": k, **_stats(v).__dict__} for k, v in per_lab.items()]
+    by_lab.sort(key=lambda r: (-(r["count"] or 0), r["lab"]))
+    return _stats(all_days), by_lab[:by_lab_limit]
+
+
+# ---------- API اصلی ----------
+def analyze(qs, dimensions=("lab", "stage", "month", "doctor"), measures=DEFAULT_MEASURES,
+            limit=20, with_turnaround=True, with_chains=True) -> DigitalLabAnalytics:
+    totals_measures = tuple(measures) + (("orders",) if "orders" not in measures else ())
+    res = DigitalLabAnalytics(totals=aggregate_totals(qs, totals_measures))
+    rank = [f"-{m}" for m in ("net", "charge") if m in measures]
+    for dim in dimensions:
+        if dim == "month":
+            res.by[dim] = group_by(qs, dim, measures)
+        else:
+            res.by[dim] = group_by(qs, dim, measures, order_by=rank or None, limit=limit)
+    if with_turnaround:
+        res.turnaround, res.turnaround_by_lab = turnaround(qs)
+    if with_chains:
+        from core.utils.dl_chains import chain_costs, first_pass_yield, redo_counts
+        res.first_pass_yield = first_pass_yield(qs)
+        res.redo_counts = list(redo_counts(qs)[:limit])
+        res.chains = list(chain_costs(qs.filter(chain_root__isnull=False)).filter(attempts__gt=1)[:limit])
+    return res
@@ -0,0 +1,79 @@
+"""
+آرتیفکت PDF فاکتور: رندر یک‌باره با WeasyPrint و سرو مستقیم فایل ذخیره‌شده.
+
+- فاکتورهای صادرشده عملاً تغییرناپذیرند؛ پس PDF فقط یک‌بار (هنگام صدور یا اولین چاپ) ساخته می‌شود.
+- PDF کنار SHA-256 محتوایش در InvoiceArtifact ذخیره می‌شود.
+- فقط وقتی تخصیص پرداخت‌ها عوض شود (is_stale) یا فایل گم شده باشد، دوباره ساخته می‌شود.
+- پیش‌نویس‌ها ذخیره نمی‌شوند (هنوز قابل تغییرند).
+"""
+from __future__ import annotations
+
+import hashlib
+from decimal import Decimal
+from typing import Optional
+
+from django.core.files.base import ContentFile
+
+from billing.models import Invoice, InvoiceArtifact
+
+
+def is_cacheable(invoice: Invoice) -> bool:
+    """فقط فاکتورهای غیر Draft آرتیفکت دائمی دارند."""
+    return invoice.status != Invoice.Status.DRAFT
+
+
+def html_to_pdf(html: str, base_url: Optional[str] = None) -> bytes:
+    # import محلی: weasyprint سنگین است و فقط هنگام رندر لازم می‌شود
+    from weasyprint import HTML
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def get_fresh_artifact(invoice: Invoice) -> Optional[InvoiceArtifact]:
+    """
+    آرتیفکت معتبر فاکتور را برمی‌گرداند؛ اگر نبود، کهنه بود یا فایلش از روی دیسک پاک شده بود → None.
+    """
+    if not is_cacheable(invoice):
+        return None
+    art = InvoiceArtifact.objects.filter(invoice=invoice).first()
+    if art is None or art.is_stale or not art.pdf_file:
+        return None
+    try:
+        if not art.pdf_file.storage.exists(art.pdf_file.name):
+            return None
+    except Exception:
+        return None
+    return art
+
+
+def store_artifact(invoice: Invoice, pdf_bytes: bytes, paid_total=None) -> InvoiceArtifact:
+    """
+    ذخیره/جایگزینی PDF فاکتور. اگر محتوا با نسخهٔ قبلی یکی باشد، فایل دوباره نوشته نمی‌شود.
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    paid_total = Decimal(str(paid_total or 0)).quantize(Decimal("0.01"))
+
+    art, _ = InvoiceArtifact.objects.get_or_create(
+        invoice=invoice,
+        defaults={"content_hash": "", "paid_total": paid_total},
+    )
+    if art.content_hash == digest and art.pdf_file:
+        art.is_stale = False
+        art.paid_total = paid_total
+        art.save(update_fields=["is_stale", "paid_total", "rendered_at"])
+        return art
+
+    old_name = art.pdf_file.name if art.pdf_file else None
+    label = (invoice.code or f"invoice-{invoice.pk}").replace("/", "-")
+    art.pdf_file.save(f"{label}-{digest[:8]}.pdf", ContentFile(pdf_bytes), save=False)
+    art.content_hash = digest
+    art.paid_total = paid_total
+    art.is_stale = False
+    art.save()
+
+    if old_name and old_name != art.pdf_file.name:
+        try:
+            art.pdf_file.storage.delete(old_name)
+        except Exception:
+            pass
+    return art
+
@@ -0,0 +1,259 @@
+"""
+تحلیل مصرف متریال (حرکت‌های issue کارتکس) — پشتوانهٔ MaterialConsumptionReportView.
+
+- مقدار مصرف و هزینهٔ ردیف در SQL: ABS(qty) و ABS(qty) × unit_cost_effective
+  (همان تعریف هزینهٔ مصرف در جزئیات سفارش و گزارش انحراف BOM).
+- نام آیتم/واحد/دکتر با join در همان کوئری (values/annotate) خوانده می‌شود؛ نه به ازای هر ردیف.
+- گروه‌بندی‌ها سمت DB: آیتم، محصول، دکتر، سفارش، محصول × آیتم و آیتم × ماه. ماه جلالی است؛
+  مثل گزارش دستمزد، GROUP BY روی روز در SQL و جمع روزها به ماه جلالی در پایتون.
+- CSV با StreamingHttpResponse روی values_list(...).iterator() تولید می‌شود.
+- فهرست‌های انتخاب (آیتم/محصول/دکتر) در کش جنگو نگه داشته و با تغییر آیتم/محصول باطل می‌شوند.
+"""
+from __future__ import annotations
+
+import csv
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Func, Sum
+from django.db.models.signals import post_delete, post_save
+
+from core.utils.jalali import jalali_str
+
+ZERO = Decimal("0.00")
+DIMS_CACHE_KEY = "material_consumption_dims:v1"
+DIMS_TTL = 600
+_QTY = DecimalField(max_digits=14, decimal_places=3)
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+Q3 = Decimal("0.001")
+Q2 = Decimal("0.01")
+
+
+def _q(x, places=Q2) -> Decimal:
+    """SQLite حاصل‌ضرب/جمع اعشاری را با دقت float برمی‌گرداند؛ برای نمایش/خروجی گرد می‌شود."""
+    return Decimal(x or 0).quantize(places)
+
+
+def _qty_expr():
+    return Func(F("qty"), function="ABS", output_field=_QTY)
+
+
+def _cost_expr():
+    return ExpressionWrapper(_qty_expr() * F("unit_cost_effective"), output_field=_DEC)
+
+
+@dataclass
+class ConsumptionFilters:
+    start: Optional[object] = None      # date میلادی
+    end: Optional[object] = None
+    item_id: Optional[int] = None
+    product: str = ""
+    doctor: str = ""
+    order_id: Optional[int] = None
+
+
+def filtered_moves(f: ConsumptionFilters):
+    from billing.models import StockMovement
+
+    qs = StockMovement.objects.filter(movement_type=StockMovement.MoveType.ISSUE)
+    if f.start:
+        qs = qs.filter(happened_at__gte=f.start)
+    if f.end:
+        qs = qs.filter(happened_at__lte=f.end)
+    if f.item_id:
+        qs = qs.filter(item_id=f.item_id)
+    if f.product:
+        qs = qs.filter(product_code=f.product)
+    if f.doctor:
+        qs = qs.filter(order__doctor__icontains=f.doctor)
+    if f.order_id:
+        qs = qs.filter(order_id=f.order_id)
+    return qs
+
+
+def detail_rows(qs):
+    """ردیف‌های جزئی به‌صورت مدل با annotation (برای صفحه‌بندی keyset)؛ بدون select_related."""
+    return qs.annotate(
+        item_name=F("item__name"), item_uom=F("item__uom"), doctor_name=F("order__doctor"),
+        qty_abs=_qty_expr(), total_cost=_cost_expr(),
+    )
+
+
+# ---------- جمع‌ها ----------
+@dataclass
+class ConsumptionTotals:
+    rows: int = 0
+    qty: Decimal = ZERO
+    cost: Decimal = ZERO
+
+    @property
+    def avg_unit_cost(self) -> Decimal:
+        if not self.qty:
+            return ZERO
+        return (self.cost / self.qty).quantize(Decimal("0.01"))
+
+
+def totals(qs) -> ConsumptionTotals:
+    agg = qs.order_by().aggregate(n=Count("id"), q=Sum(_qty_expr()), c=Sum(_cost_expr()))
+    return ConsumptionTotals(rows=agg["n"] or 0, qty=_q(agg["q"], Q3), cost=_q(agg["c"]))
+
+
+# ---------- گروه‌بندی ----------
+# کلید → (عنوان، ستون‌های values، سرستون‌ها)
+GROUPINGS: "OrderedDict[str, tuple]" = OrderedDict([
+    ("item",         ("آیتم",           ("item_id", "item__name", "item__uom"), ("آیتم", "واحد"))),
+    ("product",      ("محصول",          ("product_code",),                       ("محصول",))),
+    ("doctor",       ("دکتر",           ("order__doctor",),                      ("دکتر",))),
+    ("order",        ("سفارش",          ("order_id", "order__doctor"),           ("سفارش", "دکتر"))),
+    ("product_item", ("محصول × آیتم",   ("product_code", "item_id", "item__name", "item__uom"),
+                      ("محصول", "آیتم", "واحد"))),
+    ("item_month",   ("آیتم × ماه",     ("item_id", "item__name", "item__uom", "happened_at"),
+                      ("آیتم", "واحد", "ماه"))),
+])
+
+
+@dataclass
+class GroupedReport:
+    group: str
+    headers: tuple = ()
+    rows: List[dict] = field(default_factory=list)     # [{labels: [...], qty, cost, n}]
+
+
+def _jmonth(d) -> str:
+    try:
+        return jalali_str(d)[:7]
+    except Exception:
+        return "—"
+
+
+def _labels(group: str, r: dict, products: Dict[str, str]) -> list:
+    product = lambda: products.get(r["product_code"] or "", r["product_code"] or "—")
+    if group == "item":
+        return [r["item__name"], r["item__uom"]]
+    if group == "product":
+        return [product()]
+    if group == "doctor":
+        return [r["order__doctor"] or "—"]
+    if group == "order":
+        return [r["order_id"] or "—", r["order__doctor"] or "—"]
+    if group == "product_item":
+        return [product(), r["item__name"], r["item__uom"]]
+    return [r["item__name"], r["item__uom"], _jmonth(r["happened_at"])]
+
+
+def grouped(qs, group: str) -> GroupedReport:
+    """یک GROUP BY؛ برای آیتم × ماه، روزها در پایتون به ماه جلالی جمع می‌شوند."""
+    _, values, headers = GROUPINGS[group]
+    products = dimension_choices()["product_names"]
+    raw = (qs.order_by().values(*values)
+           .annotate(qty_sum=Sum(_qty_expr()), cost_sum=Sum(_cost_expr()), n=Count("id")))
+    buckets: "OrderedDict[tuple, dict]" = OrderedDict()
+    for r in raw:
+        labels = _labels(group, r, products)
+        b = buckets.setdefault(tuple(labels), {"labels": labels, "qty": ZERO, "cost": ZERO, "n": 0})
+        b["qty"] += r["qty_sum"] or ZERO
+        b["cost"] += r["cost_sum"] or ZERO
+        b["n"] += r["n"]
+    rows = list(buckets.values())
+    for b in rows:
+        b["qty"], b["cost"] = _q(b["qty"], Q3), _q(b["cost"])
+    if group == "item_month":
+        rows.sort(key=lambda b: (str(b["labels"][0]), b["labels"][2]))
+    else:
+        rows.sort(key=lambda b: -b["cost"])
+    return GroupedReport(group=group, headers=headers, rows=rows)
+
+
+# ---------- CSV جریانی ----------
+class _Echo:
+    """شبه‌فایل برای csv.writer: هر سطر را برمی‌گرداند به‌جای نوشتن در حافظه."""
+    def write(self, value):
+        return value
+
+
+DETAIL_CSV_HEADER = ["تاریخ", "آیتم", "مقدار", "واحد", "هزینه واحد", "جمع هزینه", "دکتر", "کد محصول", "سفارش"]
+
+
+def iter_detail_csv(qs):
+    w = csv.writer(_Echo())
+    yield "\ufeff"
+    yield w.writerow(DETAIL_CSV_HEADER)
+    rows = (qs.order_by("-happened_at", "-id")
+            .values_list("happened_at", "item__name", _qty_expr(), "item__uom", "unit_cost_effective",
+                         _cost_expr(), "order__doctor", "product_code", "order_id")
+            .iterator(chunk_size=2000))
+    for (d, name, qty, uom, unit_cost, cost, doctor, product, order_id) in rows:
+        yield w.writerow([d.isoformat() if d else "", name, _q(qty, Q3), uom, unit_cost, _q(cost),
+                          doctor or "", product, order_id or ""])
+
+
+def iter_grouped_csv(report: GroupedReport):
+    w = csv.writer(_Echo())
+    yield "\ufeff"
+    yield w.writerow(list(report.headers) + ["تعداد ردیف", "مقدار", "جمع هزینه"])
+    for r in report.rows:
+        yield w.writerow(list(r["labels"]) + [r["n"], r["qty"], r["cost"]])
+
+
+# ---------- فهرست‌های انتخاب (کش) ----------
+def _load_dimensions() -> dict:
+    from billing.models import MaterialItem, StockMovement
+    from core.models import Product
+
+    products = list(Product.objects.order_by("name").values_list("code", "name"))
+    return {
+        "items": list(MaterialItem.objects.order_by("name").values_list("id", "name")),
+        "products": products,
+        "product_names": dict(products),
+        "doctors": list(
+            StockMovement.objects.filter(movement_type=StockMovement.MoveType.ISSUE, order__isnull=False)
+            .exclude(order__doctor__isnull=True).exclude(order__doctor="")
+            .order_by("order__doctor").values_list("order__doctor", flat=True).distinct()
+        ),
+    }
+
+
+def dimension_choices() -> dict:
+    dims = None
+    try:
+        dims = cache.get(DIMS_CACHE_KEY)
+    except Exception:
+        pass
+    if dims is None:
+        dims = _load_dimensions()
+        try:
+            cache.set(DIMS_CACHE_KEY, dims, DIMS_TTL)
+        except Exception:
+            pass
+    return dims
+
+
+def invalidate_dimensions(*args, **kwargs) -> None:
+    try:
+        cache.delete(DIMS_CACHE_KEY)
+    except Exception:
+        pass
+
+
+def _on_item_save(sender, instance, raw=False, **kwargs):
+    """ذخیرهٔ آیتم با هر حرکت کارتکس تکرار می‌شود؛ فقط اگر نام/آیتم جدید بود کش باطل شود."""
+    if raw:
+        return
+    try:
+        dims = cache.get(DIMS_CACHE_KEY)
+    except Exception:
+        return
+    if dims is not None and (instance.pk, instance.name) not in set(dims["items"]):
+        invalidate_dimensions()
+
+
+def connect_signals():
+    """در BillingConfig.ready صدا زده می‌شود (فهرست دکترها با TTL تازه می‌شود)."""
+    post_save.connect(_on_item_save, sender="billing.MaterialItem", dispatch_uid="consumption_dims_item_save")
+    post_delete.connect(invalidate_dimensions, sender="billing.MaterialItem",
+                        dispatch_uid="consumption_dims_item_delete")
+    post_save.connect(invalidate_dimensions, sender="core.Product", dispatch_uid="consumption_dims_product_save")
+    post_delete.connect(invalidate_dimensions, sender="core.Product", dispatch_uid="consumption_dims_product_delete")
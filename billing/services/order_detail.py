@@ -0,0 +1,343 @@
+"""
+اسمبلر صفحهٔ جزئیات سفارش (core.views.order_detail).
+
+- همهٔ ردیف‌های لازم صفحه (رویدادها، مصرف‌ها + حرکت‌های پیوندی، انتقال‌های لاب دیجیتال،
+  لاگ‌های دستمزد، خط فاکتور) با prefetch_related/select_related در چند کوئری ثابت خوانده می‌شوند.
+- همهٔ جمع‌ها (مبلغ هر مصرف، هزینهٔ لاب دیجیتال، PnL، دستمزد به تفکیک مرحله/تکنسین)
+  از همین ردیف‌های داخل حافظه ساخته می‌شوند؛ بدون aggregate جداگانه.
+- خلاصهٔ هزینه‌ها (OrderCostSummary، همراه مبلغ هر ردیف مصرف) در Django cache به ازای هر سفارش
+  نگه داشته می‌شود و با post_save/post_delete جدول‌های فرزند (و m2m مصرف↔حرکت) باطل می‌شود.
+  با کش گرم، حرکت‌های پیوندی prefetch نمی‌شوند و summarize اجرا نمی‌شود.
+  کش پیش‌فرض باید بین workerها مشترک باشد (CACHES در settings)؛ وگرنه باطل‌سازی فقط در worker
+  نویسنده اثر دارد.
+  به‌روزرسانی‌های گروهی (queryset.update) سیگنال ندارند؛ برای آن‌ها TTL کوتاه
+  (ORDER_COST_CACHE_TTL، پیش‌فرض ۶۰۰ ثانیه) گذاشته شده است.
+
+معنای اعداد PnL دقیقاً همان get_order_pnl است (تا صفحه پس از بازنویسی همان ارقام را نشان دهد).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+
+ZERO = Decimal("0.00")
+CACHE_KEY = "order_cost_summary:{}"
+
+
+def _ttl() -> int:
+    try:
+        return int(getattr(settings, "ORDER_COST_CACHE_TTL", 600))
+    except Exception:
+        return 600
+
+
+def _d(x) -> Decimal:
+    if x is None:
+        return Decimal("0")
+    return x if isinstance(x, Decimal) else Decimal(str(x))
+
+
+def _q2(x) -> Decimal:
+    return _d(x).quantize(Decimal("0.01"))
+
+
+def _bankers_round(x, places: int = 2) -> Decimal:
+    # همان گرد کردن get_order_pnl
+    return _d(x).quantize(Decimal(10) ** -places, rounding=ROUND_HALF_EVEN)
+
+
+@dataclass
+class OrderCostSummary:
+    order_id: int
+    # همان کلیدهای get_order_pnl
+    revenue: Decimal = ZERO
+    material_cogs: Decimal = ZERO
+    digital_lab_cost: Decimal = ZERO
+    allocation_share: Decimal = ZERO
+    labor_cost: Decimal = ZERO
+    gross_profit: Decimal = ZERO
+    net_profit: Decimal = ZERO
+    # ارقام نمایشی صفحه
+    issue_costs_total: Decimal = ZERO          # جمع |qty| × unit_cost حرکت‌های issue پیوندی
+    digital_lab_net: Decimal = ZERO            # charge - credit انتقال‌های غیرلغو (Order.digital_lab_cost)
+    wage_total: Decimal = ZERO                 # جمع total_wage همهٔ لاگ‌ها
+    wages_by_stage: List[dict] = field(default_factory=list)
+    wages_by_tech: List[dict] = field(default_factory=list)
+    issue_row_costs: Dict[int, Decimal] = field(default_factory=dict)   # StockIssue.id → row_cost
+
+    def pnl(self) -> dict:
+        return {
+            "revenue": self.revenue,
+            "material_cogs": self.material_cogs,
+            "digital_lab_cost": self.digital_lab_cost,
+            "allocation_share": self.allocation_share,
+            "labor_cost": self.labor_cost,
+            "gross_profit": self.gross_profit,
+            "net_profit": self.net_profit,
+        }
+
+    def to_dict(self):
+        d = asdict(self)
+        for k, v in list(d.items()):
+            if isinstance(v, Decimal):
+                d[k] = str(v)
+        for key in ("wages_by_stage", "wages_by_tech"):
+            d[key] = [{**r, "total": str(r["total"])} for r in d[key]]
+        d["issue_row_costs"] = {k: str(v) for k, v in d["issue_row_costs"].items()}
+        return d
+
+
+@dataclass
+class OrderDetailBundle:
+    order: object
+    events: list
+    stock_issues: list
+    digital_lab_transfers: list
+    wage_logs: list
+    summary: OrderCostSummary
+
+
+# ---------- بارگذاری ----------
+def _linked_moves_prefetch():
+    from billing.models import StockMovement
+    return Prefetch(
+        "linked_moves",
+        queryset=StockMovement.objects.only("id", "movement_type", "qty", "unit_cost_effective"),
+    )
+
+
+def _load_order(order_id: int, with_moves: bool = True):
+    """with_moves=False: حرکت‌های پیوندی خوانده نمی‌شوند (فقط برای summarize لازم‌اند)."""
+    from core.models import Order, OrderEvent, DigitalLabTransfer, StageWorkLog
+    from billing.models import StockIssue
+
+    issues = StockIssue.objects.select_related("item").order_by("happened_at")
+    if with_moves:
+        issues = issues.prefetch_related(_linked_moves_prefetch())
+    return (
+        Order.objects
+        .select_related("patient", "invoice_line")
+        .prefetch_related(
+            Prefetch("events", queryset=OrderEvent.objects.order_by("happened_at", "id")),
+            Prefetch("stock_issues", queryset=issues),
+            Prefetch("digital_lab_transfers",
+                     queryset=DigitalLabTransfer.objects.order_by("-sent_date", "-id")),
+            Prefetch("stage_worklogs",
+                     queryset=(StageWorkLog.objects
+                               .select_related("stage_tpl", "stage_inst", "technician")
+                               .order_by("-created_at", "-id"))),
+        )
+        .get(pk=order_id)
+    )
+
+
+def _invoice_line_total(order) -> Optional[Decimal]:
+    try:
+        line = order.invoice_line
+    except Exception:
+        return None
+    return _d(line.line_total) if line is not None else None
+
+
+# ---------- محاسبه از ردیف‌های داخل حافظه ----------
+def summarize(order, stock_issues, transfers, wage_logs) -> OrderCostSummary:
+    """
+    ساخت OrderCostSummary بدون هیچ کوئری اضافه.
+    روی هر StockIssue مقدار row_cost را هم می‌گذارد (برای قالب).
+    """
+    s = OrderCostSummary(order_id=order.pk)
+
+    # درآمد: خط فاکتور؛ اگر نبود price × unit_count
+    revenue = _invoice_line_total(order) or Decimal("0")
+    if revenue == 0:
+        revenue = _d(order.price) * Decimal(order.unit_count or 1)
+
+    # متریال
+    issue_total = ZERO
+    material_cogs = Decimal("0")
+    for si in stock_issues:
+        row_cost = Decimal("0")
+        for mv in si.linked_moves.all():
+            qty = _d(mv.qty)
+            cost = _d(mv.unit_cost_effective)
+            material_cogs += qty * cost  # مثل get_order_pnl: علامت خود qty
+            if mv.movement_type == "issue":
+                row_cost += abs(qty) * cost
+        si.row_cost = _q2(row_cost)
+        s.issue_row_costs[si.pk] = si.row_cost
+        issue_total += si.row_cost
+
+    # لاب دیجیتال
+    dl_all = Decimal("0")   # get_order_pnl: همهٔ ردیف‌ها
+    dl_net = Decimal("0")   # Order.digital_lab_cost: بدون لغوشده‌ها
+    for t in transfers:
+        net = _d(t.charge_amount) - _d(t.credit_amount)
+        dl_all += net
+        if t.status != "cancelled":
+            dl_net += net
+
+    # دستمزد
+    labor = Decimal("0")
+    wage_total = Decimal("0")
+    by_stage: "OrderedDict[str, Decimal]" = OrderedDict()
+    by_tech: "OrderedDict[str, Decimal]" = OrderedDict()
+    for w in wage_logs:
+        amount = _d(w.total_wage)
+        wage_total += amount
+        if w.status == "done":
+            labor += amount
+        stage_label = w.stage_tpl.label if w.stage_tpl_id and w.stage_tpl else None
+        tech_name = w.technician.name if w.technician_id and w.technician else None
+        by_stage[stage_label] = by_stage.get(stage_label, Decimal("0")) + amount
+        by_tech[tech_name] = by_tech.get(tech_name, Decimal("0")) + amount
+
+    s.revenue = _bankers_round(revenue)
+    s.material_cogs = _bankers_round(material_cogs)
+    s.digital_lab_cost = _bankers_round(dl_all)
+    s.labor_cost = _bankers_round(labor)
+    s.allocation_share = _bankers_round(0)
+    s.gross_profit = _bankers_round(revenue - material_cogs)
+    s.net_profit = _bankers_round(revenue - (material_cogs + dl_all + labor))
+
+    s.issue_costs_total = _q2(issue_total)
+    s.digital_lab_net = dl_net
+    s.wage_total = wage_total
+    # همان کلیدهای values() قبلی تا قالب دست نخورد
+    s.wages_by_stage = [{"stage_tpl__label": k, "total": v} for k, v in by_stage.items()]
+    s.wages_by_tech = [{"technician__name": k, "total": v} for k, v in by_tech.items()]
+    return s
+
+
+# ---------- API ----------
+def _cache_get(order_id: int) -> Optional[OrderCostSummary]:
+    try:
+        return cache.get(CACHE_KEY.format(order_id))
+    except Exception:
+        return None
+
+
+def _cache_set(summary: OrderCostSummary) -> None:
+    try:
+        cache.set(CACHE_KEY.format(summary.order_id), summary, _ttl())
+    except Exception:
+        pass
+
+
+def build_order_detail(order_id: int, use_cache: bool = True) -> OrderDetailBundle:
+    """
+    همهٔ داده‌های صفحهٔ جزئیات سفارش. اگر سفارش نبود Order.DoesNotExist بالا می‌رود.
+    خلاصهٔ هزینه‌ها اگر در کش بود از همان خوانده می‌شود (row_cost ردیف‌های مصرف هم از کش)؛
+    وگرنه از ردیف‌های تازه ساخته و در کش نوشته می‌شود.
+    """
+    summary = _cache_get(order_id) if use_cache else None
+    order = _load_order(order_id, with_moves=summary is None)
+    stock_issues = list(order.stock_issues.all())
+    transfers = list(order.digital_lab_transfers.all())
+    wage_logs = list(order.stage_worklogs.all())
+
+    row_costs = getattr(summary, "issue_row_costs", None)
+    if row_costs is not None and all(si.pk in row_costs for si in stock_issues):
+        for si in stock_issues:
+            si.row_cost = row_costs[si.pk]
+    else:
+        if summary is not None:
+            # کش با ردیف‌های فعلی نمی‌خواند (مثلاً نسخهٔ قدیمی کش)؛ از نو حساب می‌شود
+            prefetch_related_objects(stock_issues, _linked_moves_prefetch())
+        summary = summarize(order, stock_issues, transfers, wage_logs)
+        _cache_set(summary)
+    return OrderDetailBundle(
+        order=order,
+        events=list(order.events.all()),
+        stock_issues=stock_issues,
+        digital_lab_transfers=transfers,
+        wage_logs=wage_logs,
+        summary=summary,
+    )
+
+
+def get_order_cost_summary(order_id: int) -> OrderCostSummary:
+    """خلاصهٔ هزینه/سود یک سفارش — از کش؛ در صورت نبود، از یک بارگذاری prefetch‌شده."""
+    hit = _cache_get(order_id)
+    if hit is not None:
+        return hit
+    return build_order_detail(order_id, use_cache=False).summary
+
+
+def _delete_keys(keys) -> None:
+    try:
+        cache.delete_many(keys)
+    except Exception:
+        pass
+
+
+def invalidate_order_cost(*order_ids) -> None:
+    """
+    حذف فوری + دوباره بعد از commit: درخواستی که وسط تراکنش، دادهٔ commit‌شدهٔ قبلی را
+    خوانده و در کش نوشته، بعد از commit پاک می‌شود.
+    """
+    keys = [CACHE_KEY.format(oid) for oid in set(order_ids) if oid]
+    if not keys:
+        return
+    _delete_keys(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _delete_keys(keys))
+
+
+# ---------- سیگنال‌ها ----------
+def _on_child_change(sender, instance, **kwargs):
+    invalidate_order_cost(getattr(instance, "order_id", None))
+
+
+def _on_order_change(sender, instance, **kwargs):
+    invalidate_order_cost(instance.pk)
+
+
+def _on_movement_change(sender, instance, **kwargs):
+    # حرکت هم order مستقیم دارد و هم از طریق StockIssue.linked_moves به سفارش‌ها وصل است
+    ids = {getattr(instance, "order_id", None)}
+    if instance.pk:
+        try:
+            ids.update(instance.linked_issues.values_list("order_id", flat=True))
+        except Exception:
+            pass
+    invalidate_order_cost(*ids)
+
+
+def _on_linked_moves_change(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+    if not reverse:
+        invalidate_order_cost(instance.order_id)
+        return
+    # سمت StockMovement: سفارش‌های StockIssueهای درگیر
+    from billing.models import StockIssue
+    qs = StockIssue.objects.filter(pk__in=pk_set) if pk_set else instance.linked_issues.all()
+    invalidate_order_cost(*qs.values_list("order_id", flat=True))
+
+
+def connect_signals():
+    """در BillingConfig.ready صدا زده می‌شود."""
+    from billing.models import StockIssue
+
+    for label in ("billing.StockIssue", "core.DigitalLabTransfer", "core.StageWorkLog",
+                  "billing.InvoiceLine"):
+        post_save.connect(_on_child_change, sender=label, dispatch_uid=f"order_cost_save_{label}")
+        post_delete.connect(_on_child_change, sender=label, dispatch_uid=f"order_cost_delete_{label}")
+
+    post_save.connect(_on_order_change, sender="core.Order", dispatch_uid="order_cost_save_order")
+    post_delete.connect(_on_order_change, sender="core.Order", dispatch_uid="order_cost_delete_order")
+    post_save.connect(_on_movement_change, sender="billing.StockMovement",
+                      dispatch_uid="order_cost_save_movement")
+    # pre_delete: بعد از حذف، ردیف‌های m2m هم رفته‌اند و linked_issues خالی است
+    pre_delete.connect(_on_movement_change, sender="billing.StockMovement",
+                       dispatch_uid="order_cost_delete_movement")
+    m2m_changed.connect(_on_linked_moves_change, sender=StockIssue.linked_moves.through,
+                        dispatch_uid="order_cost_linked_moves")
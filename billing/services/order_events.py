@@ -0,0 +1,145 @@
+"""
+ثبت گروهی رویداد سفارش (add_order_event_bulk).
+
+- دادهٔ مشترک فرم فقط یک‌بار با OrderEventForm اعتبارسنجی می‌شود (نه به ازای هر سفارش).
+- فایل پیوست فقط یک‌بار در storage ذخیره می‌شود و همهٔ رویدادها به همان فایل اشاره می‌کنند.
+- رویدادها با bulk_create درج می‌شوند.
+- همگام‌سازی وضعیت سفارش (مثل add_order_event) با UPDATEهای گروهی:
+    * FINAL_SHIPMENT → shipped_date = happened_at و status = delivered
+    * RECEIVED_IN_LAB / RECEIVED_FROM_DIGITAL / ADJUSTMENT → سفارش‌های delivered که
+      shipped_date <= happened_at دارند به in_progress برمی‌گردند (و یادداشت اصلاح روی رویدادشان).
+- bulk_create سیگنال post_save ندارد؛ این مدل هم receiver ندارد. UPDATE های گروهی سفارش هم سیگنال
+  ندارند، پس مکعب هزینه (product_cost_cube) و کش خلاصهٔ سفارش (order_detail) دستی علامت می‌خورند.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Iterable, List
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.forms import OrderEventForm
+from core.models import Order, OrderEvent
+
+REOPEN_NOTE = "بازگشت پس از ارسال نهایی (اصلاح)"
+
+REOPEN_EVENT_TYPES = (
+    OrderEvent.EventType.RECEIVED_IN_LAB,
+    OrderEvent.EventType.RECEIVED_FROM_DIGITAL,
+    OrderEvent.EventType.ADJUSTMENT,
+)
+
+
+@dataclass
+class BulkEventResult:
+    created_ids: List[int] = field(default_factory=list)
+    missing_order_ids: List[int] = field(default_factory=list)   # IDهایی که سفارش‌شان پیدا نشد
+    delivered_ids: List[int] = field(default_factory=list)       # FINAL_SHIPMENT → delivered
+    reopened_ids: List[int] = field(default_factory=list)        # delivered → in_progress
+    errors: dict = field(default_factory=dict)                   # خطاهای فرم (اعتبارسنجی مشترک)
+
+    @property
+    def ok(self) -> int:
+        return len(self.created_ids)
+
+    @property
+    def fail(self) -> int:
+        return len(self.missing_order_ids)
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+
+def _store_attachment_once(upload):
+    """ذخیرهٔ یک‌بارهٔ فایل با همان upload_to فیلد؛ خروجی: نام فایل در storage."""
+    f = OrderEvent._meta.get_field("attachment")
+    name = f.generate_filename(None, upload.name)
+    return f.storage.save(name, upload, max_length=f.max_length)
+
+
+def _mark_cost_caches(orders) -> None:
+    from billing.services import order_detail, product_cost_cube
+    product_cost_cube.mark_dirty(order_ids=[o.id for o in orders])
+    order_detail.invalidate_order_cost(*(o.id for o in orders))
+
+
+def create_events_bulk(order_ids: Iterable[int], data, files=None) -> BulkEventResult:
+    """
+    data: QueryDict/دیکشنری نرمال‌شده (تاریخ، stage و direction از قبل پر شده‌اند)
+    files: request.FILES (اختیاری)
+    """
+    result = BulkEventResult()
+    order_ids = list(dict.fromkeys(int(x) for x in order_ids))
+    if not order_ids:
+        return result
+
+    # stage_instance به یک سفارش خاص تعلق دارد و در ثبت گروهی معنا ندارد
+    if hasattr(data, "copy"):
+        data = data.copy()
+    data.pop("stage_instance", None)
+
+    form = OrderEventForm(data, files)
+    if not form.is_valid():
+        result.errors = {k: list(v) for k, v in form.errors.items()}
+        return result
+
+    cd = form.cleaned_data
+    event_type = cd["event_type"]
+    happened_at = cd["happened_at"]
+    notes = cd.get("notes") or ""
+
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids)
+            .only("id", "status", "shipped_date")
+        )
+        found = {o.id for o in orders}
+        result.missing_order_ids = [i for i in order_ids if i not in found]
+        if not orders:
+            return result
+
+        reopen_ids = set()
+        if event_type in REOPEN_EVENT_TYPES and happened_at:
+            reopen_ids = {
+                o.id for o in orders
+                if o.status == "delivered" and o.shipped_date and happened_at >= o.shipped_date
+            }
+
+        attachment_name = None
+        upload = cd.get("attachment")
+        if upload:
+            attachment_name = _store_attachment_once(upload)
+
+        events = []
+        for o in orders:
+            ev = OrderEvent(
+                order_id=o.id,
+                event_type=event_type,
+                happened_at=happened_at,
+                direction=cd.get("direction") or "",
+                stage=cd.get("stage") or "",
+                notes=notes,
+            )
+            if attachment_name:
+                ev.attachment.name = attachment_name
+            if o.id in reopen_ids and not notes.strip():
+                ev.notes = REOPEN_NOTE
+            events.append(ev)
+        OrderEvent.objects.bulk_create(events, batch_size=500)
+        result.created_ids = [ev.pk for ev in events if ev.pk]
+
+        # update سیگنال ندارد؛ مکعب هزینه و کش خلاصهٔ سفارش دستی علامت می‌خورند
+        if event_type == OrderEvent.EventType.FINAL_SHIPMENT:
+            _mark_cost_caches(orders)
+            Order.objects.filter(id__in=found).update(
+                shipped_date=happened_at, status="delivered", updated_at=timezone.now())
+            result.delivered_ids = sorted(found)
+        elif reopen_ids:
+            _mark_cost_caches([o for o in orders if o.id in reopen_ids])
+            Order.objects.filter(id__in=reopen_ids).update(status="in_progress", updated_at=timezone.now())
+            result.reopened_ids = sorted(reopen_ids)
+
+    return result
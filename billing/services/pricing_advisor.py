@@ -5,9 +5,7 @@ from decimal import Decimal, ROUND_HALF_EVEN
 from typing import Optional, List, Dict
 from datetime import date
 
-from django.db.models import Q
-from core.models import Order
-from billing.services.order_pnl import get_order_pnl
+from billing.services import product_cost_cube as cube
 
 QDEC = Decimal
 
@@ -15,84 +13,36 @@ QDEC = Decimal
 ENABLE_LABOR = True
 
 
-def _get_order_units(order, pnl: dict) -> QDEC:
-    """
-    تعداد واحدهای واقعی یک سفارش برای همین product_code.
-    اول از خروجی get_order_pnl می‌خوانیم؛ اگر نبود، از فیلدهای رایج Order حدس می‌زنیم.
-    هرچه شد، حداقل 1.
-    """
-    # از خروجی PnL اگر داشت:
-    for key in ("units", "unit_count", "order_qty", "quantity"):
-        v = pnl.get(key)
-        if v is not None:
-            try:
-                q = QDEC(str(v))
-                if q > 0:
-                    return q
-            except Exception:
-                pass
-
-    # از خود مدل Order اگر فیلدی داشت:
-    for attr in ("units", "unit_count", "quantity", "count", "tooth_count"):
-        v = getattr(order, attr, None)
-        if v is not None:
-            try:
-                q = QDEC(str(v))
-                if q > 0:
-                    return q
-            except Exception:
-                pass
-
-    # حداقل 1
-    return QDEC("1")
-
-
 # ـــــــــــ محاسبات بر اساس BOM و میانگین تاریخی لاب دیجیتال ـــــــــــ
 
 def estimate_material_cost_from_bom(product_code: str) -> QDEC:
     """
-    محاسبه هزینهٔ مواد استاندارد از جدول BOM:
-    جمع qty_standard × unit_cost_effective برای هر ردیف.
+    هزینهٔ مواد استاندارد یک واحد از BOM (billing.BOMRecipe):
+    جمع qty_per_unit × (1 + تلفات) × avg_unit_cost فعلی هر متریال (کش‌شده؛ ر.ک. standard_cost).
     اگر BOM خالی باشد یا خطا دهد، صفر برمی‌گرداند.
     """
     try:
-        from core.models import ProductBOM  # مدل BOM استاندارد
-    except Exception:
-        return QDEC("0")
-
-    try:
-        items = ProductBOM.objects.filter(product__code=product_code)
-        total = QDEC("0")
-        for it in items:
-            qty = QDEC(str(getattr(it, "qty_standard", 0) or 0))
-            unit_cost = QDEC(str(getattr(it, "unit_cost_effective", 0) or 0))
-            total += qty * unit_cost
-        return total
+        from billing.services.standard_cost import standard_unit_cost
+        return standard_unit_cost(product_code)
     except Exception:
         return QDEC("0")
 
 
 def estimate_digital_from_history(product_code: str, days: int = 90) -> QDEC:
     """
-    میانگین هزینهٔ لاب دیجیتال در N روز اخیر برای همین محصول.
-    اگر داده کم باشد، صفر برمی‌گرداند.
+    میانگین هزینهٔ لاب دیجیتال «به‌ازای هر واحد» در N روز اخیر برای همین محصول،
+    از ردیف‌های مکعب ماهانه (دقت ماهانه: ماه‌هایی که در بازه می‌افتند کامل حساب می‌شوند).
+    اگر داده‌ای نباشد، صفر برمی‌گرداند.
     """
+    from datetime import timedelta, date
+
     try:
-        from datetime import timedelta, date
-        from core.models import Order
-        from billing.services.order_pnl import get_order_pnl
+        cube.ensure_product(product_code)
+        since = cube.period_of(date.today() - timedelta(days=days))
+        t = cube.totals(cube.cube_rows(product_code, period_from=since))
     except Exception:
         return QDEC("0")
-
-    since = date.today() - timedelta(days=days)
-    qs = Order.objects.filter(order_type=product_code, created_at__date__gte=since)
-    total = QDEC("0"); n = 0
-    for o in qs.only("id"):
-        pnl = get_order_pnl(o.id)
-        val = QDEC(str(pnl.get("digital_lab_cost", 0) or 0))
-        total += val
-        n += 1
-    return (total / n) if n else QDEC("0")
+    return t.per_unit("digital_cost")
 
 
 def estimate_labor_cost(product_code: str) -> QDEC:
@@ -127,7 +77,8 @@ def _r(x: Decimal, places: int = 2) -> Decimal:
 
 @dataclass
 class ProductCostRow:
-    order_id: int
+    period: str                        # ماه جلالی «1404/07» (هر ردیف = یک ماه از مکعب)
+    n_orders: int
     revenue: Decimal
     material_cogs: Decimal
     digital_lab_cost: Decimal
@@ -142,7 +93,7 @@ class ProductCostSummary:
     avg_revenue: Decimal
     avg_material: Decimal
     avg_dlab: Decimal
-    avg_labor: Decimal                 # = هزینهٔ دستمزد (فعلاً صفر چون ENABLE_LABOR=False)
+    avg_labor: Decimal                 # = هزینهٔ دستمزد (صفر اگر ENABLE_LABOR=False)
     avg_total_cost: Decimal            # = material + dlab (+ labor اگر فعال شود)
     avg_gross_profit: Decimal
     avg_net_profit: Decimal
@@ -165,7 +116,8 @@ class ProductCostSummary:
             "suggested_price_markup": str(_r(self.suggested_price_markup)),
             "rows": [
                 {
-                    "order_id": r.order_id,
+                    "period": r.period,
+                    "n_orders": r.n_orders,
                     "revenue": str(_r(r.revenue)),
                     "material_cogs": str(_r(r.material_cogs)),
                     "digital_lab_cost": str(_r(r.digital_lab_cost)),
@@ -191,28 +143,20 @@ def compute_product_pricing_summary(
 ) -> ProductCostSummary:
     """
     - ورودی اصلی: product_code (همان Order.order_type)
-    - فیلتر بازه‌ی تاریخی روی order_date (یا در نبود آن، created_at__date)
-    - محاسبه میانگین‌ها «به‌ازای هر واحد» بر اساس PnL واقعی هر سفارش (get_order_pnl)
+    - فیلتر بازه‌ی تاریخی با دقت ماه جلالی روی مکعب ProductMonthlyCost
+      (ماه سفارش = order_date یا در نبود آن created_at)
+    - میانگین‌ها «به‌ازای هر واحد» = جمع هر ستون ÷ جمع واحدها (وزن‌دار با unit_count)
     - «هزینه کل واحد» = material + digital (+ labor اگر ENABLE_LABOR=True)
     """
-    qs = Order.objects.filter(order_type=product_code)
-    if date_from:
-        try:
-            qs = qs.filter(order_date__gte=date_from)
-        except Exception:
-            qs = qs.filter(created_at__date__gte=date_from)
-    if date_to:
-        try:
-            qs = qs.filter(order_date__lte=date_to)
-        except Exception:
-            qs = qs.filter(created_at__date__lte=date_to)
-
-    if not include_open:
-        qs = qs.filter(Q(status="delivered") | Q(shipped_date__isnull=False))
-
-    orders = list(qs.only("id"))
-    rows: List[ProductCostRow] = []
-    if not orders:
+    cube.ensure_product(product_code)
+    qs = cube.cube_rows(
+        product_code,
+        period_from=cube.period_of(date_from),
+        period_to=cube.period_of(date_to),
+        include_open=include_open,
+    )
+    t = cube.totals(qs)
+    if not t.orders_count:
         return ProductCostSummary(
             product_code=product_code,
             n_orders=0,
@@ -228,58 +172,38 @@ def compute_product_pricing_summary(
             rows=[],
         )
 
-    # جمع‌های «پرواحد»
-    rev_s_u = QDEC("0"); mat_s_u = QDEC("0"); dlab_s_u = QDEC("0"); labor_s_u = QDEC("0"); g_s_u = QDEC("0"); n_s_u = QDEC("0")
-    units_s = QDEC("0")
-
-    for order in orders:
-        pnl = get_order_pnl(order.id)
-
-        units = _get_order_units(order, pnl)
-        if units <= 0:
-            units = QDEC("1")
-
-        # اعداد «به‌ازای هر واحد»
-        rev_u  = QDEC(str(pnl["revenue"]))          / units
-        mat_u  = QDEC(str(pnl["material_cogs"]))    / units
-        dlab_u = QDEC(str(pnl["digital_lab_cost"])) / units
-        g_u    = QDEC(str(pnl["gross_profit"]))     / units
-        n_u    = QDEC(str(pnl["net_profit"]))       / units
-
-        # دستمزد (فعلاً صفر اگر ENABLE_LABOR=False)
-        if "labor_cost" in pnl:
-            labor_u_calc = QDEC(str(pnl.get("labor_cost") or 0)) / units
-        else:
-            labor_u_calc = estimate_labor_cost(product_code)
-        labor_u = labor_u_calc if ENABLE_LABOR else QDEC("0")
-
+    # ردیف‌های نمونه: ماه‌های اخیر (باز و بسته‌ی یک ماه با هم جمع می‌شوند)
+    by_period: Dict[int, Dict] = {}
+    for c in qs.order_by("-period").values(
+        "period", "orders_count", "units", "revenue", "material_cost", "digital_cost", "labor_cost"
+    ):
+        agg = by_period.setdefault(c["period"], {k: 0 for k in c if k != "period"})
+        for k, v in c.items():
+            if k != "period":
+                agg[k] += v
+    rows: List[ProductCostRow] = []
+    for period, c in by_period.items():
+        units = QDEC(c["units"] or 1)
         rows.append(ProductCostRow(
-            order_id=order.id,
-            revenue=rev_u,
-            material_cogs=mat_u,
-            digital_lab_cost=dlab_u,
-            gross_profit=g_u,
-            net_profit=n_u,
+            period=f"{period // 100}/{period % 100:02d}",
+            n_orders=c["orders_count"],
+            revenue=c["revenue"] / units,
+            material_cogs=c["material_cost"] / units,
+            digital_lab_cost=c["digital_cost"] / units,
+            gross_profit=(c["revenue"] - c["material_cost"]) / units,
+            net_profit=(c["revenue"] - c["material_cost"] - c["digital_cost"] - c["labor_cost"]) / units,
         ))
 
-        rev_s_u  += rev_u
-        mat_s_u  += mat_u
-        dlab_s_u += dlab_u
-        labor_s_u += labor_u
-        g_s_u    += g_u
-        n_s_u    += n_u
-        units_s  += units
-
-    n = len(rows)
+    n = t.orders_count
 
     # میانگین‌ها «به‌ازای هر واحد»
-    avg_rev   = (rev_s_u / n) if n else QDEC("0")
-    avg_mat   = (mat_s_u / n) if n else QDEC("0")
-    avg_dlab  = (dlab_s_u / n) if n else QDEC("0")
-    avg_labor = (labor_s_u / n) if n else QDEC("0")
+    avg_rev   = t.per_unit("revenue")
+    avg_mat   = t.per_unit("material_cost")
+    avg_dlab  = t.per_unit("digital_cost")
+    avg_labor = t.per_unit("labor_cost") if ENABLE_LABOR else QDEC("0")
     avg_cost  = avg_mat + avg_dlab + (avg_labor if ENABLE_LABOR else QDEC("0"))
-    avg_g     = (g_s_u / n) if n else QDEC("0")
-    avg_n     = (n_s_u / n) if n else QDEC("0")
+    avg_g     = avg_rev - avg_mat
+    avg_n     = avg_rev - avg_mat - avg_dlab - t.per_unit("labor_cost")
 
     # ـــــــــــ حالت‌های روش محاسبه (history / bom / hybrid) ـــــــــــ
     if method.lower() == "bom":
@@ -340,5 +264,5 @@ def compute_product_pricing_summary(
         avg_net_profit=avg_n,
         suggested_price_margin=suggested_by_margin,
         suggested_price_markup=suggested_by_markup,
-        rows=rows[: min(n, 25)],
+        rows=rows[:25],
     )
@@ -0,0 +1,479 @@
+"""
+مکعب ماهانهٔ بهای تمام‌شدهٔ محصول (billing.ProductMonthlyCost).
+
+- هر سلول = (product_code, ماه جلالی YYYYMM, is_closed) با جمع سفارش‌ها، واحدها، درآمد،
+  مواد، لاب دیجیتال و دستمزد — همان تعریف‌های get_order_pnl (درآمد: خط فاکتور یا price × unit_count).
+- محاسبهٔ «واقعیت» سفارش‌ها دسته‌ای است: برای هر دسته از سفارش‌ها چهار کوئری GROUP BY order_id
+  (فاکتور، مواد، لاب دیجیتال، دستمزد) به‌جای یک get_order_pnl به ازای هر سفارش.
+- به‌روزرسانی افزایشی: سیگنال‌ها سفارش‌های درگیر را «کثیف» علامت می‌زنند و بعد از commit
+  تراکنش فقط «واقعیت» همان سفارش‌ها حساب می‌شود؛ سهم قبلی هر سفارش (billing.ProductOrderCost)
+  از سلول قبلی کم و سهم تازه به سلول جدید اضافه می‌شود. هزینهٔ هر ذخیره مستقل از تعداد
+  سفارش‌های ماه است (بازسازی کامل سلول در ماه پرکار ثانیه‌ها طول می‌کشید).
+  چند ذخیره در یک تراکنش ⇒ یک محاسبه. مسیرهای گروهی بدون سیگنال (order_events، batch_invoicing)
+  mark_dirty را خودشان صدا می‌زنند. خطای به‌روزرسانی لاگ می‌شود؛ rebuild_cost_cube همه‌چیز را
+  (همراه سهم‌ها) از نو می‌سازد.
+- مکعب هر محصول اولین بار با ensure_product/rebuild ساخته می‌شود؛ تا آن موقع سفارش‌های آن
+  محصول در به‌روزرسانی افزایشی نادیده گرفته می‌شوند (تا مکعب نیمه‌کاره ساخته نشود).
+- مشاور قیمت (pricing_advisor) به‌جای پیمایش سفارش‌ها فقط چند ده ردیف مکعب را می‌خواند.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import jdatetime
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from core.utils.jalali import period_of as jalali_period_of
+
+ZERO = Decimal("0.00")
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+_DEC6 = DecimalField(max_digits=18, decimal_places=6)
+BATCH = 500
+
+Cell = Tuple[str, int, bool]   # (product_code, period, is_closed)
+SUM_FIELDS = ("orders_count", "units", "revenue", "material_cost", "digital_cost", "labor_cost")
+
+logger = logging.getLogger(__name__)
+
+
+def _q2(x) -> Decimal:
+    return (x or ZERO).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+def period_of(d) -> Optional[int]:
+    """تاریخ جلالی/میلادی/datetime → YYYYMM جلالی."""
+    if d is None:
+        return None
+    if isinstance(d, (jdatetime.date, jdatetime.datetime)):
+        return d.year * 100 + d.month
+    try:
+        return jalali_period_of(d)
+    except Exception:
+        return None
+
+
+def cell_of(order_type, order_date, created_at, status, shipped_date) -> Optional[Cell]:
+    if not order_type:
+        return None
+    period = period_of(order_date) or period_of(created_at)
+    if period is None:
+        return None
+    return (order_type, period, status == "delivered" or shipped_date is not None)
+
+
+_CELL_FIELDS = ("id", "order_type", "order_date", "created_at", "status", "shipped_date",
+                "unit_count", "price")
+
+
+def _order_cell(row) -> Optional[Cell]:
+    return cell_of(row["order_type"], row["order_date"], row["created_at"], row["status"],
+                   row["shipped_date"])
+
+
+# ---------- واقعیت سفارش‌ها (دسته‌ای) ----------
+def _sum_by_order(qs, expr) -> Dict[int, Decimal]:
+    return {
+        r["order_id"]: r["t"] or ZERO
+        for r in qs.order_by().values("order_id").annotate(t=Sum(expr, output_field=_DEC6))
+    }
+
+
+def _facts(order_rows) -> Dict[int, dict]:
+    """{order_id: {units, revenue, material, digital, labor}} با چهار کوئری GROUP BY."""
+    from billing.models import InvoiceLine, StockIssue
+    from core.models import DigitalLabTransfer, StageWorkLog
+
+    ids = [r["id"] for r in order_rows]
+    inv = _sum_by_order(InvoiceLine.objects.filter(order_id__in=ids), F("line_total"))
+    mat = _sum_by_order(
+        StockIssue.objects.filter(order_id__in=ids),
+        ExpressionWrapper(
+            Coalesce(F("linked_moves__qty"), Value(Decimal("0"))) *
+            Coalesce(F("linked_moves__unit_cost_effective"), Value(Decimal("0"))),
+            output_field=_DEC6,
+        ),
+    )
+    dl = _sum_by_order(
+        DigitalLabTransfer.objects.filter(order_id__in=ids),
+        Coalesce(F("charge_amount"), Value(ZERO)) - Coalesce(F("credit_amount"), Value(ZERO)),
+    )
+    lab = _sum_by_order(StageWorkLog.objects.filter(order_id__in=ids, status="done"), F("total_wage"))
+
+    out = {}
+    for r in order_rows:
+        oid = r["id"]
+        units = r["unit_count"] or 1
+        revenue = inv.get(oid) or ZERO
+        if revenue == 0:
+            revenue = (r["price"] or ZERO) * Decimal(units)
+        out[oid] = {
+            "units": units,
+            "revenue": _q2(revenue),
+            "material": _q2(mat.get(oid)),
+            "digital": _q2(dl.get(oid)),
+            "labor": _q2(lab.get(oid)),
+        }
+    return out
+
+
+# ---------- بازسازی سلول‌ها ----------
+def _empty():
+    return {"orders_count": 0, "units": 0, "revenue": ZERO, "material_cost": ZERO,
+            "digital_cost": ZERO, "labor_cost": ZERO}
+
+
+def _contribution(f) -> dict:
+    """واقعیت یک سفارش (خروجی _facts) → سهمش در ستون‌های سلول."""
+    return {"orders_count": 1, "units": f["units"], "revenue": f["revenue"],
+            "material_cost": f["material"], "digital_cost": f["digital"], "labor_cost": f["labor"]}
+
+
+def _add(acc: dict, contrib: dict, sign: int = 1) -> None:
+    for k in SUM_FIELDS:
+        acc[k] += sign * contrib[k]
+
+
+def _fact_row(order_id: int, cell: Cell, contrib: dict):
+    from billing.models import ProductOrderCost
+    pc, period, closed = cell
+    return ProductOrderCost(order_id=order_id, product_code=pc, period=period, is_closed=closed,
+                            **{k: contrib[k] for k in SUM_FIELDS if k != "orders_count"})
+
+
+def _fact_contribution(fact) -> dict:
+    return {"orders_count": 1, **{k: getattr(fact, k) for k in SUM_FIELDS if k != "orders_count"}}
+
+
+def _fold(order_qs, only_cells: Optional[Set[Cell]] = None, facts_out: Optional[list] = None) -> Dict[Cell, dict]:
+    """جمع سلول‌ها؛ با facts_out سهم هر سفارش (ProductOrderCost) هم جمع‌آوری می‌شود."""
+    cells: Dict[Cell, dict] = defaultdict(_empty)
+    batch = []
+
+    def flush():
+        facts = _facts(batch)
+        for r in batch:
+            contrib = _contribution(facts[r["id"]])
+            _add(cells[r["_cell"]], contrib)
+            if facts_out is not None:
+                facts_out.append(_fact_row(r["id"], r["_cell"], contrib))
+        batch.clear()
+
+    for r in order_qs.order_by().values(*_CELL_FIELDS).iterator(chunk_size=2000):
+        cell = _order_cell(r)
+        if cell is None or (only_cells is not None and cell not in only_cells):
+            continue
+        r["_cell"] = cell
+        batch.append(r)
+        if len(batch) >= BATCH:
+            flush()
+    if batch:
+        flush()
+    return cells
+
+
+def _write(cells: Dict[Cell, dict], scope: Iterable[Cell]) -> int:
+    """سلول‌های scope را با مقادیر cells جایگزین می‌کند (سلول خالی ⇒ حذف ردیف)."""
+    from billing.models import ProductMonthlyCost
+
+    n = 0
+    for cell in scope:
+        pc, period, closed = cell
+        values = cells.get(cell)
+        if not values or not values["orders_count"]:
+            ProductMonthlyCost.objects.filter(product_code=pc, period=period, is_closed=closed).delete()
+            continue
+        ProductMonthlyCost.objects.update_or_create(
+            product_code=pc, period=period, is_closed=closed, defaults=values,
+        )
+        n += 1
+    return n
+
+
+def _period_bounds(period: int):
+    """[اول ماه، اول ماه بعد) جلالی برای پیش‌فیلتر سفارش‌های یک سلول."""
+    y, m = divmod(period, 100)
+    return jdatetime.date(y, m, 1), jdatetime.date(y + (m == 12), (m % 12) + 1, 1)
+
+
+def refresh_cells(cells: Iterable[Cell]) -> int:
+    """بازسازی دقیق چند سلول؛ سفارش‌ها بر اساس محصول و بازهٔ ماه پیش‌فیلتر می‌شوند."""
+    from core.models import Order
+
+    cells = set(c for c in cells if c)
+    if not cells:
+        return 0
+    cond = Q()
+    for pc, period, _closed in cells:
+        j_start, j_end = _period_bounds(period)
+        # created_at با یک روز حاشیه (منطقهٔ زمانی)؛ عضویت دقیق را _fold با only_cells تعیین می‌کند
+        g_start = j_start.togregorian() - datetime.timedelta(days=1)
+        g_end = j_end.togregorian() + datetime.timedelta(days=1)
+        cond |= Q(order_type=pc) & (
+            Q(order_date__gte=j_start, order_date__lt=j_end)
+            | Q(order_date__isnull=True, created_at__date__gte=g_start, created_at__date__lt=g_end)
+        )
+    facts = []
+    with transaction.atomic():
+        folded = _fold(Order.objects.filter(cond), only_cells=cells, facts_out=facts)
+        _replace_facts(facts, cell_q=_cells_q(cells))
+        return _write(folded, cells)
+
+
+def _cells_q(cells: Iterable[Cell]) -> Q:
+    q = Q()
+    for pc, period, closed in cells:
+        q |= Q(product_code=pc, period=period, is_closed=closed)
+    return q
+
+
+def _replace_facts(facts: list, cell_q: Optional[Q] = None) -> None:
+    """سهم‌های سلول‌های cell_q (یا همه) و سفارش‌های facts را با facts جایگزین می‌کند."""
+    from billing.models import ProductOrderCost
+
+    stale = ProductOrderCost.objects.all()
+    if cell_q is not None:
+        stale = stale.filter(cell_q | Q(order_id__in=[f.order_id for f in facts]))
+    stale.delete()
+    ProductOrderCost.objects.bulk_create(facts, batch_size=BATCH)
+
+
+def rebuild(product_code: Optional[str] = None) -> int:
+    """بازسازی کامل (یا فقط یک محصول)؛ ردیف‌های یتیم حذف می‌شوند."""
+    from billing.models import ProductMonthlyCost
+    from core.models import Order
+
+    qs = Order.objects.exclude(order_type__isnull=True).exclude(order_type="")
+    existing = ProductMonthlyCost.objects.all()
+    if product_code:
+        qs = qs.filter(order_type=product_code)
+        existing = existing.filter(product_code=product_code)
+    facts = []
+    with transaction.atomic():
+        folded = _fold(qs, facts_out=facts)
+        _replace_facts(facts, cell_q=Q(product_code=product_code) if product_code else None)
+        scope = set(folded) | {(r[0], r[1], r[2]) for r in
+                               existing.values_list("product_code", "period", "is_closed")}
+        return _write(folded, scope)
+
+
+# ---------- به‌روزرسانی افزایشی (تفاضل سهم سفارش‌ها) ----------
+def _apply_deltas(deltas: Dict[Cell, dict]) -> None:
+    from billing.models import ProductMonthlyCost
+
+    cells = [c for c, d in deltas.items() if any(d.values())]
+    if not cells:
+        return
+    rows = {(r.product_code, r.period, r.is_closed): r
+            for r in ProductMonthlyCost.objects.filter(_cells_q(cells))}
+    for cell in cells:
+        d, row = deltas[cell], rows.get(cell)
+        if row is None:
+            if d["orders_count"] > 0:
+                pc, period, closed = cell
+                ProductMonthlyCost.objects.create(product_code=pc, period=period, is_closed=closed, **d)
+            continue
+        for k in SUM_FIELDS:
+            setattr(row, k, getattr(row, k) + d[k])
+        if row.orders_count <= 0:
+            row.delete()
+        else:
+            row.save()
+
+
+@transaction.atomic
+def apply_orders(order_ids: Iterable[int]) -> int:
+    """
+    سهم سفارش‌ها را در مکعب به‌روز می‌کند: سهم ثبت‌شدهٔ قبلی از سلول قبلی کم، سهم فعلی به سلول
+    فعلی اضافه. سفارش حذف‌شده فقط کم می‌شود. سفارش‌های محصولی که هنوز مکعب ندارد نادیده
+    گرفته می‌شوند (ensure_product بعداً کل محصول را می‌سازد). خروجی: تعداد سلول‌های تغییرکرده.
+    """
+    from billing.models import ProductMonthlyCost, ProductOrderCost
+    from core.models import Order
+
+    ids = {i for i in order_ids if i}
+    if not ids:
+        return 0
+    old = list(ProductOrderCost.objects.filter(order_id__in=ids))
+    rows = []
+    for r in Order.objects.filter(pk__in=ids).values(*_CELL_FIELDS):
+        r["_cell"] = _order_cell(r)
+        if r["_cell"] is not None:
+            rows.append(r)
+    products = {f.product_code for f in old} | {r["_cell"][0] for r in rows}
+    cubed = set(ProductMonthlyCost.objects.filter(product_code__in=products)
+                .values_list("product_code", flat=True).distinct())
+
+    deltas: Dict[Cell, dict] = defaultdict(_empty)
+    for f in old:
+        _add(deltas[(f.product_code, f.period, f.is_closed)], _fact_contribution(f), -1)
+    rows = [r for r in rows if r["_cell"][0] in cubed]
+    facts = _facts(rows) if rows else {}
+    new = []
+    for r in rows:
+        contrib = _contribution(facts[r["id"]])
+        _add(deltas[r["_cell"]], contrib)
+        new.append(_fact_row(r["id"], r["_cell"], contrib))
+
+    _apply_deltas(deltas)
+    ProductOrderCost.objects.filter(order_id__in=ids).delete()
+    ProductOrderCost.objects.bulk_create(new, batch_size=BATCH)
+    return sum(1 for d in deltas.values() if any(d.values()))
+
+
+def ensure_product(product_code: str) -> None:
+    """اگر برای محصولی سفارش هست ولی مکعب خالی است (قبل از اولین بازسازی) → بازسازی همان محصول."""
+    from billing.models import ProductMonthlyCost
+    from core.models import Order
+
+    if ProductMonthlyCost.objects.filter(product_code=product_code).exists():
+        return
+    if Order.objects.filter(order_type=product_code).exists():
+        rebuild(product_code)
+
+
+# ---------- خواندن ----------
+@dataclass
+class CubeTotals:
+    orders_count: int = 0
+    units: int = 0
+    revenue: Decimal = ZERO
+    material_cost: Decimal = ZERO
+    digital_cost: Decimal = ZERO
+    labor_cost: Decimal = ZERO
+
+    def per_unit(self, attr: str) -> Decimal:
+        return (getattr(self, attr) / Decimal(self.units)) if self.units else Decimal("0")
+
+
+def cube_rows(product_code: str, period_from: Optional[int] = None, period_to: Optional[int] = None,
+              include_open: bool = True):
+    from billing.models import ProductMonthlyCost
+
+    qs = ProductMonthlyCost.objects.filter(product_code=product_code)
+    if period_from:
+        qs = qs.filter(period__gte=period_from)
+    if period_to:
+        qs = qs.filter(period__lte=period_to)
+    if not include_open:
+        qs = qs.filter(is_closed=True)
+    return qs
+
+
+def totals(qs) -> CubeTotals:
+    agg = qs.order_by().aggregate(
+        orders_count=Sum("orders_count"), units=Sum("units"),
+        revenue=Sum("revenue"), material_cost=Sum("material_cost"),
+        digital_cost=Sum("digital_cost"), labor_cost=Sum("labor_cost"),
+    )
+    return CubeTotals(**{k: (v if v is not None else CubeTotals.__dataclass_fields__[k].default)
+                         for k, v in agg.items()})
+
+
+# ---------- علامت‌گذاری و سیگنال‌ها ----------
+# مجموعهٔ کثیف‌ها به ازای thread (= اتصال Django). پرچم «زمان‌بندی‌شده» نگه داشته نمی‌شود:
+# اگر تراکنش rollback شود Django callback های on_commit آن را دور می‌ریزد و پرچم ماندگار
+# جلوی زمان‌بندی بعدی را می‌گرفت. پس هر mark_dirty یک callback ثبت می‌کند و اولین callback
+# پس از commit همه را خالی می‌کند؛ بقیه کاری نمی‌کنند. باقی‌ماندهٔ یک تراکنش rollback‌شده
+# هم با commit بعدی بازسازی می‌شود (فقط یک محاسبهٔ اضافهٔ بی‌ضرر).
+_state = threading.local()
+
+
+def _pending():
+    if not hasattr(_state, "cells"):
+        _state.cells, _state.orders = set(), set()
+    return _state
+
+
+def _flush():
+    st = _pending()
+    if not (st.cells or st.orders):
+        return
+    cells, order_ids = set(st.cells), set(st.orders)
+    st.cells.clear()
+    st.orders.clear()
+    try:
+        apply_orders(order_ids)
+        if cells:
+            refresh_cells(cells)
+    except Exception:
+        # مکعب کمکی است؛ خطای آن نباید ذخیرهٔ اصلی را خراب کند، ولی باید دیده شود
+        logger.exception("به‌روزرسانی مکعب هزینه ناموفق بود (سفارش‌ها: %s، سلول‌ها: %s)؛ "
+                         "rebuild_cost_cube را اجرا کنید", sorted(order_ids)[:20], sorted(cells)[:20])
+
+
+def mark_dirty(order_ids=(), cells=()) -> None:
+    """
+    سفارش‌ها را برای به‌روزرسانی افزایشی بعد از commit علامت می‌زند (cells: بازسازی کامل سلول).
+    مسیرهای گروهی که سیگنال ندارند (queryset.update، bulk_create) باید خودشان این را صدا بزنند.
+    """
+    st = _pending()
+    st.orders.update(i for i in order_ids if i)
+    st.cells.update(c for c in cells if c)
+    if st.orders or st.cells:
+        transaction.on_commit(_flush)
+
+
+def _on_order_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_dirty(order_ids=[instance.pk])
+
+
+def _on_order_delete(sender, instance, **kwargs):
+    # سهم ثبت‌شدهٔ سفارش (ProductOrderCost) از سلولش کم می‌شود
+    mark_dirty(order_ids=[instance.pk])
+
+
+def _on_child_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_dirty(order_ids=[getattr(instance, "order_id", None)])
+
+
+def _on_movement_change(sender, instance, raw=False, **kwargs):
+    if raw or not instance.pk:
+        return
+    try:
+        ids = list(instance.linked_issues.values_list("order_id", flat=True))
+    except Exception:
+        ids = []
+    mark_dirty(order_ids=ids)
+
+
+def _on_linked_moves_change(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+    if not reverse:
+        mark_dirty(order_ids=[instance.order_id])
+        return
+    from billing.models import StockIssue
+    qs = StockIssue.objects.filter(pk__in=pk_set) if pk_set else instance.linked_issues.all()
+    mark_dirty(order_ids=list(qs.values_list("order_id", flat=True)))
+
+
+def connect_signals():
+    """در BillingConfig.ready صدا زده می‌شود."""
+    from billing.models import StockIssue
+
+    for label in ("billing.StockIssue", "core.DigitalLabTransfer", "core.StageWorkLog",
+                  "billing.InvoiceLine"):
+        post_save.connect(_on_child_change, sender=label, dispatch_uid=f"cost_cube_save_{label}")
+        post_delete.connect(_on_child_change, sender=label, dispatch_uid=f"cost_cube_delete_{label}")
+
+    post_save.connect(_on_order_save, sender="core.Order", dispatch_uid="cost_cube_save_order")
+    post_delete.connect(_on_order_delete, sender="core.Order", dispatch_uid="cost_cube_delete_order")
+    post_save.connect(_on_movement_change, sender="billing.StockMovement",
+                      dispatch_uid="cost_cube_save_movement")
+    pre_delete.connect(_on_movement_change, sender="billing.StockMovement",
+                       dispatch_uid="cost_cube_delete_movement")
+    m2m_changed.connect(_on_linked_moves_change, sender=StockIssue.linked_moves.through,
+                        dispatch_uid="cost_cube_linked_moves")
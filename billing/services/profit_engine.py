@@ -0,0 +1,333 @@
+"""
+موتور تحلیل سود و زیان سفارش‌ها (پشتوانهٔ api_profit_summary و profit_report).
+
+- ستون‌های PnL هر سفارش با Subquery روی همان کوئری Order (نه get_order_pnl به ازای هر سفارش):
+  درآمد (خط فاکتور یا price × unit_count)، مواد (StockIssue × linked_moves)، لاب دیجیتال
+  (charge − credit)، دستمزد انجام‌شده (در بازه و کل) — همان تعریف‌های get_order_pnl.
+- وضعیت تحقق هر سفارش با annotation: وضعیت فاکتور، amount_due، grand_total و «تحویل‌شده»
+  (status=delivered یا shipped_date) در یک ستون pe_bucket دسته‌بندی می‌شود:
+    realized   — فاکتور paid یا amount_due = 0
+    unrealized — فاکتور باز، یا بدون فاکتور ولی تحویل‌شده (درآمد مورد انتظار = price × unit_count)
+    none       — بقیه (در گزارش realized/unrealized نمی‌آید)
+- جمع هر باکت با یک GROUP BY pe_bucket؛ خروجی‌ها Decimal تایپ‌شده‌اند و تبدیل به رشته فقط
+  در لبهٔ JSON (view) انجام می‌شود.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, List, Optional
+
+from django.db.models import (
+    Case, CharField, Count, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce, Lower, NullIf
+
+ZERO = Decimal("0.00")
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+
+REALIZED = "realized"
+UNREALIZED = "unrealized"
+NONE = "none"
+BUCKETS = (REALIZED, UNREALIZED)
+
+
+def q2(x) -> Decimal:
+    return (x or ZERO).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+@dataclass
+class Criteria:
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    doctor: Optional[str] = None
+    order_type: Optional[str] = None
+
+
+def orders_for(c: Criteria):
+    """سفارش‌های بازه (order_date) با تطابق دقیق دکتر/نوع سفارش."""
+    from core.models import Order
+
+    qs = Order.objects.all()
+    if c.date_from:
+        qs = qs.filter(order_date__gte=c.date_from)
+    if c.date_to:
+        qs = qs.filter(order_date__lte=c.date_to)
+    if c.doctor:
+        qs = qs.filter(doctor=c.doctor)
+    if c.order_type:
+        qs = qs.filter(order_type=c.order_type)
+    return qs
+
+
+def paid_invoice_orders(date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """سفارش‌های خطوط فاکتورهای paid که issued_at آن‌ها در بازه است (fallback حالت realized)."""
+    from core.models import Order
+
+    qs = Order.objects.filter(invoice_line__invoice__status="paid")
+    if date_from:
+        qs = qs.filter(invoice_line__invoice__issued_at__date__gte=date_from)
+    if date_to:
+        qs = qs.filter(invoice_line__invoice__issued_at__date__lte=date_to)
+    return qs
+
+
+# ---------- ستون‌های PnL ----------
+def _sum_per_order(qs, expr):
+    sub = qs.filter(order=OuterRef("pk")).order_by().values("order").annotate(t=Sum(expr, output_field=_DEC))
+    return Coalesce(Subquery(sub.values("t")[:1], output_field=_DEC), Value(ZERO), output_field=_DEC)
+
+
+def annotate_pnl(qs, wage_from: Optional[date] = None, wage_to: Optional[date] = None):
+    """
+    pe_revenue, pe_material, pe_digital, pe_wage (دستمزد done در بازهٔ wage_from..wage_to)
+    و pe_labor (کل دستمزد done، برای net_profit مثل get_order_pnl).
+    """
+    from billing.models import StockIssue
+    from core.models import DigitalLabTransfer, StageWorkLog
+
+    done = StageWorkLog.objects.filter(status=StageWorkLog.Status.DONE)
+    done_in_range = done
+    if wage_from:
+        done_in_range = done_in_range.filter(finished_at__gte=wage_from)
+    if wage_to:
+        done_in_range = done_in_range.filter(finished_at__lte=wage_to)
+
+    units = Coalesce(NullIf(F("unit_count"), 0), 1)
+    line_total = Coalesce(F("invoice_line__line_total"), Value(ZERO), output_field=_DEC)
+    return qs.annotate(
+        pe_revenue=Case(
+            When(~Q(invoice_line__line_total=0) & Q(invoice_line__line_total__isnull=False), then=line_total),
+            default=ExpressionWrapper(Coalesce(F("price"), Value(ZERO)) * units, output_field=_DEC),
+            output_field=_DEC,
+        ),
+        pe_material=_sum_per_order(
+            StockIssue.objects.all(),
+            ExpressionWrapper(
+                Coalesce(F("linked_moves__qty"), Value(Decimal("0"))) *
+                Coalesce(F("linked_moves__unit_cost_effective"), Value(Decimal("0"))),
+                output_field=_DEC,
+            ),
+        ),
+        pe_digital=_sum_per_order(
+            DigitalLabTransfer.objects.all(),
+            ExpressionWrapper(Coalesce(F("charge_amount"), Value(ZERO)) - Coalesce(F("credit_amount"), Value(ZERO)),
+                              output_field=_DEC),
+        ),
+        pe_wage=_sum_per_order(done_in_range, F("total_wage")),
+        pe_labor=_sum_per_order(done, F("total_wage")),
+    )
+
+
+# ---------- وضعیت تحقق ----------
+def annotate_settlement(qs):
+    """
+    روی کوئری annotate_pnl: pe_invoice_status، pe_bucket، pe_line_revenue، pe_expected_revenue
+    و مبالغ فاکتور (pe_grand_total، pe_amount_due) برای سهم مانده.
+    """
+    has_line = Q(invoice_line__isnull=False)
+    settled = has_line & (Q(invoice_line__invoice__status="paid") | Q(invoice_line__invoice__amount_due=0))
+    delivered = Q(status="delivered") | Q(shipped_date__isnull=False)
+    line_calc = ExpressionWrapper(
+        F("invoice_line__unit_count") * F("invoice_line__unit_price") - F("invoice_line__discount_amount"),
+        output_field=_DEC,
+    )
+    qs = qs.annotate(
+        pe_invoice_status=Case(
+            When(has_line, then=Lower("invoice_line__invoice__status")),
+            When(delivered, then=Value("delivered")),
+            default=Value(""), output_field=CharField(),
+        ),
+        pe_bucket=Case(
+            When(settled, then=Value(REALIZED)),
+            When(has_line, then=Value(UNREALIZED)),
+            When(delivered, then=Value(UNREALIZED)),
+            default=Value(NONE), output_field=CharField(),
+        ),
+        # درآمد خط فاکتور؛ اگر line_total صفر/خالی بود از تعداد × قیمت − تخفیف
+        pe_line_revenue=Case(
+            When(has_line & ~Q(invoice_line__line_total=0) & Q(invoice_line__line_total__isnull=False),
+                 then=F("invoice_line__line_total")),
+            When(has_line, then=line_calc),
+            default=Value(None), output_field=_DEC,
+        ),
+    )
+    expected = Case(
+        When(has_line, then=F("pe_line_revenue")),
+        default=ExpressionWrapper(Coalesce(F("price"), Value(ZERO)) * Coalesce(NullIf(F("unit_count"), 0), 1),
+                                  output_field=_DEC),
+        output_field=_DEC,
+    )
+    return qs.annotate(
+        pe_expected_revenue=expected,
+        pe_grand_total=F("invoice_line__invoice__grand_total"),
+        pe_amount_due=F("invoice_line__invoice__amount_due"),
+    )
+
+
+def receivable_share(bucket, line_revenue, expected_revenue, grand_total, amount_due) -> Decimal:
+    """
+    سهم سفارش از مانده: line / grand_total × amount_due؛ بدون فاکتور = کل درآمد مورد انتظار.
+    در پایتون (SQLite تقسیم دو مقدار صحیح را صحیح برمی‌گرداند).
+    """
+    if bucket == REALIZED:
+        return ZERO
+    if line_revenue is None:
+        return expected_revenue
+    if grand_total and grand_total > 0:
+        return q2(line_revenue / grand_total * (amount_due or ZERO))
+    return line_revenue
+
+
+def analysis_queryset(qs, wage_from: Optional[date] = None, wage_to: Optional[date] = None):
+    return annotate_settlement(annotate_pnl(qs, wage_from, wage_to))
+
+
+# ---------- جمع باکت‌ها ----------
+@dataclass
+class BucketTotals:
+    orders: int = 0
+    revenue: Decimal = ZERO              # realized: درآمد خط فاکتور؛ unrealized: درآمد مورد انتظار
+    material_cogs: Decimal = ZERO
+    digital_lab_cost: Decimal = ZERO
+    wage_cost: Decimal = ZERO
+
+    @property
+    def gross_profit(self) -> Decimal:
+        return self.revenue - (self.material_cogs + self.digital_lab_cost + self.wage_cost)
+
+    def __add__(self, other: "BucketTotals") -> "BucketTotals":
+        return BucketTotals(
+            orders=self.orders + other.orders,
+            revenue=self.revenue + other.revenue,
+            material_cogs=self.material_cogs + other.material_cogs,
+            digital_lab_cost=self.digital_lab_cost + other.digital_lab_cost,
+            wage_cost=self.wage_cost + other.wage_cost,
+        )
+
+
+def bucket_totals(qs) -> Dict[str, BucketTotals]:
+    """یک GROUP BY pe_bucket روی analysis_queryset."""
+    out = {b: BucketTotals() for b in BUCKETS}
+    rows = (qs.order_by().values("pe_bucket")
+            .annotate(n=Count("id"),
+                      rev=Sum(Case(When(pe_bucket=REALIZED, then=F("pe_line_revenue")),
+                                   default=F("pe_expected_revenue"), output_field=_DEC)),
+                      mat=Sum("pe_material"), dl=Sum("pe_digital"), wage=Sum("pe_wage")))
+    for r in rows:
+        if r["pe_bucket"] not in out:
+            continue
+        out[r["pe_bucket"]] = BucketTotals(
+            orders=r["n"], revenue=q2(r["rev"]), material_cogs=q2(r["mat"]), digital_lab_cost=q2(r["dl"]),
+            wage_cost=q2(r["wage"]),
+        )
+    return out
+
+
+# ---------- ردیف‌ها ----------
+ROW_FIELDS = (
+    "id", "doctor", "order_type", "pe_bucket", "pe_invoice_status", "pe_revenue", "pe_material",
+    "pe_digital", "pe_wage", "pe_labor", "pe_line_revenue", "pe_expected_revenue", "pe_grand_total", "pe_amount_due",
+)
+
+
+@dataclass
+class SettlementRow:
+    order_id: int
+    doctor_name: Optional[str]
+    product_code: Optional[str]
+    bucket: str
+    invoice_status: str
+    revenue: Decimal                 # درآمد PnL سفارش (خط فاکتور یا price × unit_count)
+    material_cogs: Decimal
+    digital_lab_cost: Decimal
+    wage_cost: Decimal
+    labor_total: Decimal             # کل دستمزد done (بدون فیلتر بازه)
+    line_revenue: Optional[Decimal]
+    expected_revenue: Decimal
+    receivable: Decimal
+
+    @property
+    def costs(self) -> Decimal:
+        return self.material_cogs + self.digital_lab_cost + self.wage_cost
+
+
+def iter_rows(qs, bucket: Optional[str] = None):
+    if bucket:
+        qs = qs.filter(pe_bucket=bucket)
+    for r in qs.order_by("id").values(*ROW_FIELDS).iterator(chunk_size=2000):
+        line_revenue = None if r["pe_line_revenue"] is None else q2(r["pe_line_revenue"])
+        expected = q2(r["pe_expected_revenue"])
+        yield SettlementRow(
+            order_id=r["id"], doctor_name=r["doctor"], product_code=r["order_type"],
+            bucket=r["pe_bucket"], invoice_status=r["pe_invoice_status"] or "",
+            revenue=q2(r["pe_revenue"]), material_cogs=q2(r["pe_material"]),
+            digital_lab_cost=q2(r["pe_digital"]), wage_cost=q2(r["pe_wage"]), labor_total=q2(r["pe_labor"]),
+            line_revenue=line_revenue, expected_revenue=expected,
+            receivable=receivable_share(r["pe_bucket"], line_revenue, expected, r["pe_grand_total"],
+                                        r["pe_amount_due"]),
+        )
+
+
+# ---------- هزینه‌های دوره ----------
+def period_costs(date_from: Optional[date] = None, date_to: Optional[date] = None, *,
+                 include_expense: bool = True, include_depreciation: bool = False):
+    """(هزینه‌های دوره Expense، استهلاک تجهیزات) در بازه؛ هر دو Decimal."""
+    from billing.models import Expense
+
+    opex = ZERO
+    if include_expense:
+        exp_qs = Expense.objects.all()
+        if date_from:
+            exp_qs = exp_qs.filter(date__gte=date_from)
+        if date_to:
+            exp_qs = exp_qs.filter(date__lte=date_to)
+        opex = exp_qs.aggregate(t=Sum("amount", output_field=_DEC))["t"] or ZERO
+    dep = ZERO
+    if include_depreciation:
+        from billing.services.depreciation import period_expense
+        dep = period_expense(date_from, date_to)
+    return opex, dep
+
+
+# ---------- تحلیل کامل ----------
+@dataclass
+class SettlementAnalysis:
+    realized: BucketTotals
+    unrealized: BucketTotals
+    realized_rows: List[SettlementRow]
+    unrealized_rows: List[SettlementRow]
+    opex_period: Decimal = ZERO
+    depreciation_period: Decimal = ZERO
+    used_paid_fallback: bool = False
+
+    @property
+    def both(self) -> BucketTotals:
+        return self.realized + self.unrealized
+
+
+def analyze(c: Criteria, *, include_expense: bool = True, include_depreciation: bool = False,
+            paid_fallback: bool = False) -> SettlementAnalysis:
+    """
+    تفکیک realized/unrealized برای سفارش‌های Criteria.
+    paid_fallback: اگر هیچ سفارش realized نبود، خطوط فاکتورهای paid صادرشده در بازه جایگزین می‌شوند.
+    """
+    qs = analysis_queryset(orders_for(c), c.date_from, c.date_to)
+    totals = bucket_totals(qs)
+    realized_qs, used_fallback = qs, False
+    if paid_fallback and not totals[REALIZED].orders:
+        realized_qs = analysis_queryset(paid_invoice_orders(c.date_from, c.date_to), c.date_from, c.date_to)
+        totals[REALIZED] = bucket_totals(realized_qs)[REALIZED]
+        used_fallback = True
+    opex, dep = period_costs(c.date_from, c.date_to, include_expense=include_expense,
+                             include_depreciation=include_depreciation)
+    return SettlementAnalysis(
+        realized=totals[REALIZED],
+        unrealized=totals[UNREALIZED],
+        realized_rows=list(iter_rows(realized_qs, REALIZED)),
+        unrealized_rows=list(iter_rows(qs, UNREALIZED)),
+        opex_period=opex,
+        depreciation_period=dep,
+        used_paid_fallback=used_fallback,
+    )
@@ -5,19 +5,8 @@ from decimal import Decimal, ROUND_HALF_EVEN
 from typing import Iterable, List, Dict, Any, Optional
 from datetime import date
 
-from django.db import transaction
-from django.db.models import Sum, DecimalField
-
-from billing.services.order_pnl import get_order_pnl
-from core.models import Order, StageWorkLog
-from billing.models import Expense  # هزینه‌های دوره (اجاره/قبوض/پیک/...)
-
-
-# بالای فایل، کنار سایر importها
-try:
-    from billing.models import DigitalLabTransfer
-except Exception:
-    DigitalLabTransfer = None
+from billing.services.profit_engine import Criteria, annotate_pnl, orders_for, period_costs
+from core.models import Order
 
 
 # گردکردن بانکی
@@ -55,6 +44,7 @@ class ProfitSummary:
     net_profit_total: Decimal
     # ریز سفارش‌ها
     orders: List[OrderRow]
+    depreciation_period_total: Decimal = Decimal("0")   # استهلاک تجهیزات در بازه (اختیاری)
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -65,6 +55,7 @@ class ProfitSummary:
                 "wage_cost": _r(self.wage_cost_total),          # 🆕
                 "allocation": _r(self.allocation_total),
                 "opex_period": _r(self.opex_period_total),
+                "depreciation_period": _r(self.depreciation_period_total),
                 "gross_profit": _r(self.gross_profit_total),
                 "net_profit": _r(self.net_profit_total),
             },
@@ -86,13 +77,13 @@ class ProfitSummary:
         }
 
 
-@transaction.atomic
 def profit_summary_for_orders(
     order_ids: Iterable[int],
     *,
     include_period_expense: bool = True,
     expense_date_from=None,
-    expense_date_to=None
+    expense_date_to=None,
+    include_depreciation: bool = False,
 ) -> ProfitSummary:
     """
     گزارش سود و زیان برای یک مجموعه سفارش مشخص.
@@ -115,47 +106,37 @@ def profit_summary_for_orders(
             orders=[]
         )
 
-    # --- دستمزد هر سفارش بر اساس StageWorkLog ---
-    wage_qs = StageWorkLog.objects.filter(
-        order_id__in=ids,
-        status=StageWorkLog.Status.DONE,
-    )
-    # از همان بازهٔ زمانی هزینه‌ها برای فیلتر دستمزد استفاده می‌کنیم
-    if expense_date_from:
-        wage_qs = wage_qs.filter(finished_at__gte=expense_date_from)
-    if expense_date_to:
-        wage_qs = wage_qs.filter(finished_at__lte=expense_date_to)
-
-    wage_agg = wage_qs.values("order_id").annotate(
-        total=Sum('total_wage', output_field=DecimalField(max_digits=18, decimal_places=2))
+    # ستون‌های PnL همهٔ سفارش‌ها در یک کوئری (profit_engine)؛ دستمزد در همان بازهٔ هزینه‌ها
+    qs = annotate_pnl(Order.objects.filter(id__in=ids), expense_date_from, expense_date_to)
+    return _summary(
+        qs,
+        include_period_expense=include_period_expense,
+        expense_date_from=expense_date_from,
+        expense_date_to=expense_date_to,
+        include_depreciation=include_depreciation,
     )
-    wage_map: Dict[int, Decimal] = {
-        row["order_id"]: (row["total"] or Decimal("0"))
-        for row in wage_agg
-    }
 
-    # اطلاعات نمایشی پایه سفارش‌ها
-    orders = Order.objects.filter(id__in=ids)  # عمداً ساده نگه داشته شده
 
+def _summary(qs, *, include_period_expense, expense_date_from, expense_date_to, include_depreciation) -> ProfitSummary:
     rows: List[OrderRow] = []
     rev_sum = mat_sum = dl_sum = wage_sum = alloc_sum = gp_sum = np_sum = Decimal("0")
 
-    for o in orders:
-        pnl = get_order_pnl(o.id)
-
-        wage_cost = wage_map.get(o.id, Decimal("0"))
-
+    for r in qs.order_by("id").values(
+        "id", "doctor", "order_type", "pe_revenue", "pe_material", "pe_digital", "pe_wage", "pe_labor",
+    ).iterator(chunk_size=2000):
+        revenue, material, digital = _r(r["pe_revenue"]), _r(r["pe_material"]), _r(r["pe_digital"])
         row = OrderRow(
-            order_id=o.id,
-            doctor_name=getattr(o, "doctor", None),        # CharField از Order
-            product_code=getattr(o, "order_type", None),   # نوع سفارش از Order
-            revenue=pnl["revenue"],
-            material_cogs=pnl["material_cogs"],
-            digital_lab_cost=pnl["digital_lab_cost"],
-            wage_cost=wage_cost,
-            allocation_share=pnl["allocation_share"],
-            gross_profit=pnl["gross_profit"],
-            net_profit=pnl["net_profit"],
+            order_id=r["id"],
+            doctor_name=r["doctor"],          # CharField از Order
+            product_code=r["order_type"],     # نوع سفارش از Order
+            revenue=revenue,
+            material_cogs=material,
+            digital_lab_cost=digital,
+            wage_cost=r["pe_wage"] or Decimal("0"),
+            allocation_share=Decimal("0.00"),
+            # همان تعریف get_order_pnl: ناخالص = درآمد − مواد؛ خالص = درآمد − (مواد + لاب + کل دستمزد)
+            gross_profit=_r(revenue - material),
+            net_profit=_r(revenue - (material + digital + (r["pe_labor"] or Decimal("0")))),
         )
         rows.append(row)
 
@@ -167,23 +148,18 @@ def profit_summary_for_orders(
         gp_sum += row.gross_profit
         np_sum += row.net_profit
 
-    # هزینه‌های دوره (Expense): اجاره/قبض/پیک/…
-    opex_total = Decimal("0")
-    if include_period_expense:
-        exp_qs = Expense.objects.all()
-        if expense_date_from:
-            exp_qs = exp_qs.filter(date__gte=expense_date_from)
-        if expense_date_to:
-            exp_qs = exp_qs.filter(date__lte=expense_date_to)
-        opex_total = exp_qs.aggregate(
-            total=Sum('amount', output_field=DecimalField(max_digits=18, decimal_places=2))
-        )['total'] or Decimal("0")
+    # هزینه‌های دوره (Expense: اجاره/قبض/پیک/…) و استهلاک تجهیزات در همان بازه، اگر خواسته شود
+    opex_total, dep_total = period_costs(
+        expense_date_from, expense_date_to,
+        include_expense=include_period_expense, include_depreciation=include_depreciation,
+    )
 
     # جمع نهایی:
     # سود ناخالص = درآمد − (مواد + لاب دیجیتال + دستمزد)
     gross_total = rev_sum - (mat_sum + dl_sum + wage_sum)
-    # سود نهایی = سود ناخالص − (allocation + هزینه‌های دوره)
-    net_total = gross_total - (alloc_sum + opex_total)
+
+    # سود نهایی = سود ناخالص − (allocation + هزینه‌های دوره + استهلاک)
+    net_total = gross_total - (alloc_sum + opex_total + dep_total)
 
     return ProfitSummary(
         revenue_total=rev_sum,
@@ -195,6 +171,7 @@ def profit_summary_for_orders(
         gross_profit_total=gross_total,
         net_profit_total=net_total,
         orders=rows,
+        depreciation_period_total=dep_total,
     )
 
 
@@ -204,44 +181,24 @@ def profit_summary_by_criteria(
     date_to: Optional[date] = None,
     doctor_exact: Optional[str] = None,
     order_type_exact: Optional[str] = None,
-    include_period_expense: bool = True
+    include_period_expense: bool = True,
+    include_depreciation: bool = False,
 ) -> ProfitSummary:
     """
     گزارش سود/زیان براساس فیلترهای قطعی:
-      - تاریخ سفارش: order_date (در صورت نبود، created_at)
+      - تاریخ سفارش: order_date
       - نام دکتر: تطابق دقیق روی Order.doctor (CharField)
       - نوع سفارش: تطابق دقیق روی Order.order_type
     خروجی: همان ProfitSummary (جمع کل + ریز سفارش‌ها)
     """
-    qs = Order.objects.all()
-
-    # تاریخ: اگر order_date دارید، روی آن فیلتر می‌کنیم؛ در غیر اینصورت fallback به created_at
-    if date_from:
-        try:
-            qs = qs.filter(order_date__gte=date_from)
-        except Exception:
-            qs = qs.filter(created_at__date__gte=date_from)
-    if date_to:
-        try:
-            qs = qs.filter(order_date__lte=date_to)
-        except Exception:
-            qs = qs.filter(created_at__date__lte=date_to)
-
-    if doctor_exact:
-        qs = qs.filter(doctor=doctor_exact)
-
-    if order_type_exact:
-        qs = qs.filter(order_type=order_type_exact)
-
-    ids = list(qs.values_list('id', flat=True))
+    qs = orders_for(Criteria(date_from=date_from, date_to=date_to,
+                             doctor=doctor_exact, order_type=order_type_exact))
 
     # همان بازه را برای هزینه‌های دوره و دستمزد هم استفاده می‌کنیم
-    expense_from = date_from
-    expense_to   = date_to
-
-    return profit_summary_for_orders(
-        ids,
+    return _summary(
+        annotate_pnl(qs, date_from, date_to),
         include_period_expense=include_period_expense,
-        expense_date_from=expense_from,
-        expense_date_to=expense_to
+        expense_date_from=date_from,
+        expense_date_to=date_to,
+        include_depreciation=include_depreciation,
     )
@@ -0,0 +1,269 @@
+"""
+بهای استاندارد مواد هر محصول از روی BOM (billing.BOMRecipe).
+
+- هزینهٔ استاندارد یک واحد = Σ qty_per_unit × (1 + waste_factor/100) × MaterialItem.avg_unit_cost
+  روی ردیف‌های فعال BOM؛ همهٔ محصولات با یک کوئری join (BOMRecipe ⋈ Product ⋈ MaterialItem).
+- جدول کامل در کش جنگو نگه داشته می‌شود (BOM_STANDARD_COST_TTL، پیش‌فرض یک ساعت) و با تغییر
+  BOM/محصول، یا تغییر واقعی avg_unit_cost یکی از متریال‌های BOM باطل می‌شود (نه با هر حرکت کارتکس).
+  کش پیش‌فرض بین workerها مشترک است (CACHES در settings)، پس باطل‌سازی و مقایسهٔ avg_unit_cost با
+  جدول کش‌شده برای همهٔ workerها یکی است.
+- گزارش انحراف: استاندارد (BOM × unit_count) در برابر مصرف واقعی سفارش (StockIssue و
+  حرکت‌های issue پیوندخورده)، به تفکیک سفارش و در صورت نیاز به تفکیک آیتم.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Func, Sum
+from django.db.models.signals import post_delete, post_save
+
+ZERO = Decimal("0.00")
+HUNDRED = Decimal("100")
+CACHE_KEY = "bom_standard_cost:v1"
+_DEC6 = DecimalField(max_digits=18, decimal_places=6)
+
+
+def _q2(x) -> Decimal:
+    return (x or ZERO).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "BOM_STANDARD_COST_TTL", 3600))
+
+
+@dataclass
+class StandardCostLine:
+    item_id: int
+    item_code: str
+    item_name: str
+    uom: str
+    qty_per_unit: Decimal          # با احتساب تلفات
+    unit_cost: Decimal             # avg_unit_cost فعلی
+    cost: Decimal                  # qty_per_unit × unit_cost
+
+
+@dataclass
+class StandardCost:
+    product_code: str
+    product_name: str
+    unit_cost: Decimal = ZERO
+    lines: List[StandardCostLine] = field(default_factory=list)
+
+
+@dataclass
+class StandardCostTable:
+    products: Dict[str, StandardCost] = field(default_factory=dict)
+    item_costs: Dict[int, Decimal] = field(default_factory=dict)   # برای تشخیص تغییر واقعی avg
+
+
+# ---------- محاسبه ----------
+def compute_table() -> StandardCostTable:
+    """همهٔ محصولات در یک کوئری join."""
+    from billing.models import BOMRecipe
+
+    rows = (
+        BOMRecipe.objects
+        .filter(is_active=True)
+        .order_by("product__code", "item__name")
+        .values("product__code", "product__name", "item_id", "item__code", "item__name", "item__uom",
+                "item__avg_unit_cost", "qty_per_unit", "waste_factor")
+    )
+    table = StandardCostTable()
+    for r in rows:
+        code = r["product__code"]
+        sc = table.products.get(code)
+        if sc is None:
+            sc = table.products[code] = StandardCost(product_code=code, product_name=r["product__name"] or "")
+        qty = (r["qty_per_unit"] or ZERO) * (1 + (r["waste_factor"] or ZERO) / HUNDRED)
+        unit_cost = r["item__avg_unit_cost"] or ZERO
+        cost = qty * unit_cost
+        sc.lines.append(StandardCostLine(
+            item_id=r["item_id"], item_code=r["item__code"], item_name=r["item__name"],
+            uom=r["item__uom"], qty_per_unit=qty, unit_cost=unit_cost, cost=_q2(cost),
+        ))
+        sc.unit_cost += cost
+        table.item_costs[r["item_id"]] = unit_cost
+    for sc in table.products.values():
+        sc.unit_cost = _q2(sc.unit_cost)
+    return table
+
+
+def get_table() -> StandardCostTable:
+    table = None
+    try:
+        table = cache.get(CACHE_KEY)
+    except Exception:
+        pass
+    if table is None:
+        table = compute_table()
+        try:
+            cache.set(CACHE_KEY, table, _ttl())
+        except Exception:
+            pass
+    return table
+
+
+def get_standard_cost(product_code: str) -> Optional[StandardCost]:
+    return get_table().products.get(product_code)
+
+
+def standard_unit_cost(product_code: str) -> Decimal:
+    sc = get_standard_cost(product_code)
+    return sc.unit_cost if sc else ZERO
+
+
+def _delete() -> None:
+    try:
+        cache.delete(CACHE_KEY)
+    except Exception:
+        pass
+
+
+def invalidate() -> None:
+    """
+    حذف فوری + دوباره بعد از commit: کش بین workerها مشترک است و worker دیگری ممکن است وسط
+    تراکنش، جدول را از دادهٔ commit‌شدهٔ قبلی ساخته و دوباره در کش گذاشته باشد.
+    """
+    _delete()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_delete)
+
+
+# ---------- انحراف استاندارد/واقعی ----------
+@dataclass
+class ItemVariance:
+    item_id: int
+    item_name: str
+    uom: str
+    std_qty: Decimal = ZERO
+    actual_qty: Decimal = ZERO
+    std_cost: Decimal = ZERO
+    actual_cost: Decimal = ZERO
+
+    @property
+    def qty_variance(self) -> Decimal:
+        return self.actual_qty - self.std_qty
+
+    @property
+    def cost_variance(self) -> Decimal:
+        return self.actual_cost - self.std_cost
+
+
+@dataclass
+class OrderVariance:
+    order_id: int
+    product_code: str
+    units: int
+    std_cost: Decimal = ZERO
+    actual_cost: Decimal = ZERO
+    has_bom: bool = False
+    items: List[ItemVariance] = field(default_factory=list)
+
+    @property
+    def variance(self) -> Decimal:
+        return self.actual_cost - self.std_cost
+
+    @property
+    def variance_pct(self) -> Optional[Decimal]:
+        if not self.std_cost:
+            return None
+        return (self.variance / self.std_cost * HUNDRED).quantize(Decimal("0.1"))
+
+
+def _actuals(order_ids):
+    """
+    {(order_id, item_id): [qty, cost]} — مقدار از StockIssue.qty_issued و هزینه از حرکت‌های issue
+    پیوندخورده (abs(qty) × unit_cost_effective، مثل هزینهٔ ردیف مصرف در جزئیات سفارش).
+    """
+    from billing.models import StockIssue
+
+    out = defaultdict(lambda: [ZERO, ZERO])
+    for r in (StockIssue.objects.filter(order_id__in=order_ids).order_by()
+              .values("order_id", "item_id").annotate(q=Sum("qty_issued"))):
+        out[(r["order_id"], r["item_id"])][0] = r["q"] or ZERO
+    cost_expr = ExpressionWrapper(
+        Func(F("linked_moves__qty"), function="ABS") * F("linked_moves__unit_cost_effective"),
+        output_field=_DEC6,
+    )
+    for r in (StockIssue.objects.filter(order_id__in=order_ids, linked_moves__movement_type="issue")
+              .order_by().values("order_id", "item_id").annotate(c=Sum(cost_expr, output_field=_DEC6))):
+        out[(r["order_id"], r["item_id"])][1] = r["c"] or ZERO
+    return out
+
+
+def order_variances(orders: Iterable, with_items: bool = False) -> List[OrderVariance]:
+    """
+    orders: کوئری‌ست/لیست Order (فیلدهای id, order_type, unit_count کافی است).
+    سه کوئری در کل (جدول استاندارد از کش + دو GROUP BY مصرف واقعی).
+    """
+    orders = list(orders)
+    table = get_table()
+    actual = _actuals([o.id for o in orders])
+    names = {}
+    if with_items:
+        from billing.models import MaterialItem
+        item_ids = {iid for (_, iid) in actual}
+        names = {m["id"]: m for m in MaterialItem.objects.filter(id__in=item_ids).values("id", "name", "uom")}
+
+    by_order = defaultdict(dict)
+    for (oid, iid), (q, c) in actual.items():
+        by_order[oid][iid] = (q, c)
+
+    out = []
+    for o in orders:
+        units = o.unit_count or 1
+        sc = table.products.get(o.order_type or "")
+        ov = OrderVariance(order_id=o.id, product_code=o.order_type or "", units=units, has_bom=sc is not None)
+        items: Dict[int, ItemVariance] = {}
+        if sc:
+            for ln in sc.lines:
+                items[ln.item_id] = ItemVariance(
+                    item_id=ln.item_id, item_name=ln.item_name, uom=ln.uom,
+                    std_qty=ln.qty_per_unit * units, std_cost=_q2(ln.cost * units),
+                )
+        for iid, (q, c) in by_order.get(o.id, {}).items():
+            iv = items.get(iid)
+            if iv is None:
+                m = names.get(iid, {})
+                iv = items[iid] = ItemVariance(item_id=iid, item_name=m.get("name", ""), uom=m.get("uom", ""))
+            iv.actual_qty = q
+            iv.actual_cost = _q2(c)
+        ov.std_cost = _q2(sum((iv.std_cost for iv in items.values()), ZERO))
+        ov.actual_cost = _q2(sum((iv.actual_cost for iv in items.values()), ZERO))
+        if with_items:
+            ov.items = sorted(items.values(), key=lambda iv: -abs(iv.cost_variance))
+        out.append(ov)
+    return out
+
+
+# ---------- سیگنال‌ها ----------
+def _on_bom_change(sender, instance, **kwargs):
+    invalidate()
+
+
+def _on_item_save(sender, instance, raw=False, **kwargs):
+    """فقط اگر avg_unit_cost متریالی که در جدول کش‌شده هست واقعاً عوض شده باشد."""
+    if raw:
+        return
+    try:
+        table = cache.get(CACHE_KEY)
+    except Exception:
+        return
+    if table is None or instance.pk not in table.item_costs:
+        return
+    if (instance.avg_unit_cost or ZERO) != table.item_costs[instance.pk]:
+        invalidate()
+
+
+def connect_signals():
+    """در BillingConfig.ready صدا زده می‌شود."""
+    for label in ("billing.BOMRecipe", "core.Product"):
+        post_save.connect(_on_bom_change, sender=label, dispatch_uid=f"std_cost_save_{label}")
+        post_delete.connect(_on_bom_change, sender=label, dispatch_uid=f"std_cost_delete_{label}")
+    post_save.connect(_on_item_save, sender="billing.MaterialItem", dispatch_uid="std_cost_item_save")
@@ -0,0 +1,119 @@
+"""
+کنترل آفلاین هم‌خوانی «اسنپ‌شات موجودی» (MaterialItem.stock_qty) با جمع حرکات کارتکس.
+
+- صفحهٔ گزارش موجودی فقط stock_qty را می‌خواند (O(items))؛
+  این سرویس به‌صورت دوره‌ای (management command: reconcile_stock) اختلاف‌ها را پیدا
+  و در StockDriftRecord ثبت می‌کند.
+- stock_qty طبق recompute_snapshot برابر Sum(qty) همهٔ حرکات (با علامت) است.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import List
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from billing.models import MaterialItem, StockDriftRecord, _q3
+
+
+@dataclass
+class DriftRow:
+    item_id: int
+    item_name: str
+    snapshot_qty: Decimal
+    cardex_qty: Decimal
+    movements_count: int
+
+    @property
+    def drift_qty(self) -> Decimal:
+        return _q3(self.cardex_qty - self.snapshot_qty)
+
+
+def find_stock_drift(tolerance: Decimal = Decimal("0.000"), include_inactive: bool = False) -> List[DriftRow]:
+    """
+    یک کوئری گروه‌بندی‌شده: برای هر آیتم، stock_qty و جمع qty کارتکس.
+    فقط آیتم‌هایی که |اختلاف| > tolerance است برگردانده می‌شوند.
+    """
+    dec = DecimalField(max_digits=14, decimal_places=3)
+    qs = MaterialItem.objects.all()
+    if not include_inactive:
+        qs = qs.filter(is_active=True)
+    rows = (
+        qs.annotate(
+            cardex_qty=Coalesce(Sum("movements__qty", output_field=dec), Value(Decimal("0"), output_field=dec)),
+            mv_count=Count("movements"),
+        )
+        .values_list("id", "name", "stock_qty", "cardex_qty", "mv_count")
+        .order_by("id")
+    )
+    out: List[DriftRow] = []
+    for item_id, name, snap, cardex, cnt in rows:
+        r = DriftRow(item_id, name, _q3(snap), _q3(cardex), int(cnt or 0))
+        if abs(r.drift_qty) > tolerance:
+            out.append(r)
+    return out
+
+
+@transaction.atomic
+def record_stock_drift(fix: bool = False, tolerance: Decimal = Decimal("0.000"),
+                       include_inactive: bool = False) -> List[DriftRow]:
+    """
+    اختلاف‌ها را پیدا و در StockDriftRecord ثبت می‌کند.
+    - رکوردهای بازِ آیتم‌هایی که دیگر اختلاف ندارند resolved می‌شوند.
+    - آیتمی که رکورد باز دارد رکورد تازه نمی‌گیرد؛ همان رکورد مقادیر و last_seen_at جدید می‌گیرد.
+    - با fix=True اسنپ‌شات آیتم‌های دارای اختلاف از روی کارتکس بازسازی می‌شود.
+    """
+    drifts = find_stock_drift(tolerance=tolerance, include_inactive=include_inactive)
+    now = timezone.now()
+    drift_ids = [d.item_id for d in drifts]
+
+    StockDriftRecord.objects.filter(is_resolved=False).exclude(item_id__in=drift_ids).update(
+        is_resolved=True, resolved_at=now, note="اختلاف در اجرای بعدی دیده نشد",
+    )
+
+    # هر آیتم یک رکورد باز: رکورد باز قبلی با مقادیر تازه به‌روز می‌شود، فقط برای بقیه ردیف جدید.
+    # رکوردهای باز تکراری (از اجراهای قبل از این قاعده) در جدیدترین ادغام می‌شوند.
+    by_item = {d.item_id: d for d in drifts}
+    open_recs, dup_ids = {}, []
+    for rec in (StockDriftRecord.objects.filter(is_resolved=False, item_id__in=drift_ids)
+                .order_by("item_id", "-checked_at", "-id")):
+        if rec.item_id in open_recs:
+            dup_ids.append(rec.pk)
+            continue
+        d = by_item[rec.item_id]
+        rec.snapshot_qty, rec.cardex_qty = d.snapshot_qty, d.cardex_qty
+        rec.drift_qty, rec.movements_count = d.drift_qty, d.movements_count
+        rec.last_seen_at = now
+        open_recs[rec.item_id] = rec
+    if dup_ids:
+        StockDriftRecord.objects.filter(pk__in=dup_ids).update(
+            is_resolved=True, resolved_at=now, note="رکورد باز تکراری؛ در رکورد جدیدتر ادغام شد",
+        )
+    StockDriftRecord.objects.bulk_update(
+        open_recs.values(),
+        ["snapshot_qty", "cardex_qty", "drift_qty", "movements_count", "last_seen_at"],
+        batch_size=500,
+    )
+    StockDriftRecord.objects.bulk_create([
+        StockDriftRecord(
+            item_id=d.item_id,
+            last_seen_at=now,
+            snapshot_qty=d.snapshot_qty,
+            cardex_qty=d.cardex_qty,
+            drift_qty=d.drift_qty,
+            movements_count=d.movements_count,
+        )
+        for d in drifts if d.item_id not in open_recs
+    ])
+
+    if fix and drift_ids:
+        for item in MaterialItem.objects.filter(pk__in=drift_ids):
+            item.recompute_snapshot()
+        StockDriftRecord.objects.filter(item_id__in=drift_ids, is_resolved=False).update(
+            is_resolved=True, resolved_at=now, note="اسنپ‌شات بازسازی شد (--fix)",
+        )
+    return drifts
@@ -0,0 +1,133 @@
+"""
+تسویهٔ دستمزد تکنسین (پیش‌نمایش + تأیید) روی یک تعریف واحد از «لاگ‌های قابل تسویه».
+
+- unsettled_logs: لاگ‌های DONE، تسویه‌نشده و بدون payout یک تکنسین در بازهٔ finished_at.
+- جمع ناخالص و ریز به تفکیک مرحله و سفارش از یک کوئری گروه‌بندی‌شده (مرحله × سفارش) درمی‌آید.
+- confirm_payout: در یک تراکنش لاگ‌ها را با select_for_update قفل می‌کند، WagePayout می‌سازد و
+  لاگ‌ها را با یک UPDATE شرطی (payout IS NULL) تسویه می‌کند؛ اگر تعداد ردیف‌های به‌روزشده با
+  لاگ‌های قفل‌شده نخواند (تسویهٔ هم‌زمان)، کل تراکنش برمی‌گردد و PayoutConflict بالا می‌رود.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List, Optional
+
+import jdatetime
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from core.models import StageWorkLog, WagePayout
+
+ZERO = Decimal("0.00")
+
+
+class PayoutConflict(Exception):
+    """بخشی از لاگ‌ها هم‌زمان در تسویهٔ دیگری ثبت شده‌اند."""
+
+
+def unsettled_logs(technician, start=None, end=None):
+    qs = (
+        StageWorkLog.objects
+        .filter(technician=technician, status=StageWorkLog.Status.DONE, payout__isnull=True)
+        .filter(Q(is_settled=False) | Q(is_settled__isnull=True))
+    )
+    if start:
+        qs = qs.filter(finished_at__gte=start)
+    if end:
+        qs = qs.filter(finished_at__lte=end)
+    return qs
+
+
+@dataclass
+class PayoutTotals:
+    gross_total: Decimal = ZERO
+    logs_count: int = 0
+    by_stage: List[dict] = field(default_factory=list)   # [{label, total, count}]
+    by_order: List[dict] = field(default_factory=list)   # [{order_id, total, count}]
+
+
+def _totals(qs) -> PayoutTotals:
+    """یک GROUP BY (مرحله × سفارش) و جمع‌بندی بقیه در حافظه."""
+    rows = (
+        qs.order_by()
+        .values("stage_tpl__label", "stage_inst__label", "order_id")
+        .annotate(total=Sum("total_wage"), n=Count("id"))
+    )
+    t = PayoutTotals()
+    by_stage: "OrderedDict[str, dict]" = OrderedDict()
+    by_order: "OrderedDict[int, dict]" = OrderedDict()
+    for r in rows:
+        amount = r["total"] or ZERO
+        label = r["stage_tpl__label"] or r["stage_inst__label"] or "—"
+        t.gross_total += amount
+        t.logs_count += r["n"]
+        s = by_stage.setdefault(label, {"label": label, "total": ZERO, "count": 0})
+        s["total"] += amount
+        s["count"] += r["n"]
+        o = by_order.setdefault(r["order_id"], {"order_id": r["order_id"], "total": ZERO, "count": 0})
+        o["total"] += amount
+        o["count"] += r["n"]
+    t.by_stage = sorted(by_stage.values(), key=lambda x: -x["total"])
+    t.by_order = sorted(by_order.values(), key=lambda x: x["order_id"])
+    return t
+
+
+@dataclass
+class PayoutPreview:
+    technician: object
+    start: Optional[object]
+    end: Optional[object]
+    logs: list
+    totals: PayoutTotals
+
+
+def preview_payout(technician, start=None, end=None) -> PayoutPreview:
+    qs = unsettled_logs(technician, start, end)
+    logs = list(qs.select_related("order__patient", "stage_tpl", "stage_inst").order_by("finished_at", "id"))
+    return PayoutPreview(technician=technician, start=start, end=end, logs=logs, totals=_totals(qs))
+
+
+def confirm_payout(technician, start=None, end=None, *, deductions=ZERO, bonus=ZERO,
+                   note="", payment_ref="") -> Optional[WagePayout]:
+    """
+    ساخت تسویهٔ تأییدشده. اگر لاگی برای تسویه نبود → None.
+    در صورت تداخل با تسویهٔ هم‌زمان → PayoutConflict (و هیچ چیزی ذخیره نمی‌شود).
+    """
+    deductions = deductions or ZERO
+    bonus = bonus or ZERO
+    with transaction.atomic():
+        ids = list(
+            unsettled_logs(technician, start, end)
+            .select_for_update()
+            .order_by("id")
+            .values_list("pk", flat=True)
+        )
+        if not ids:
+            return None
+
+        totals = _totals(StageWorkLog.objects.filter(pk__in=ids))
+        payout = WagePayout.objects.create(
+            technician=technician,
+            period_start_j=start,
+            period_end_j=end,
+            status=WagePayout.Status.CONFIRMED,
+            gross_total=totals.gross_total,
+            deductions_total=deductions,
+            bonus_total=bonus,
+            net_payable=totals.gross_total - deductions + bonus,
+            note=note or "",
+            payment_ref=payment_ref or "",
+        )
+
+        updated = (
+            StageWorkLog.objects
+            .filter(pk__in=ids, payout__isnull=True)
+            .update(payout=payout, is_settled=True, settled_at_j=jdatetime.date.today())
+        )
+        if updated != len(ids):
+            raise PayoutConflict(
+                f"{len(ids) - updated} لاگ هم‌زمان در تسویهٔ دیگری ثبت شد؛ دوباره تلاش کنید."
+            )
+    return payout
@@ -0,0 +1,133 @@
+"""
+موتور گزارش دستمزد تکنسین‌ها (core.views_wages.wages_report).
+
+- فیلتر محصول روی ستون denormalized و ایندکس‌دار StageWorkLog.product_code (بدون OR روی join).
+  برچسب با سیگنال‌های Product/StageTemplate/Order هم‌گام می‌ماند (core/utils/worklog_products.py)؛
+  بعد از UPDATE گروهی: python manage.py rebuild_worklog_products
+- ریز لاگ‌ها با صفحه‌بندی keyset (core/utils/keyset.py) و ستون‌های لازم (values) خوانده می‌شوند.
+- تجمیع‌ها سمت DB: جمع کل، به تفکیک تکنسین/مرحله/محصول، و پیوت تکنسین × مرحله × ماه.
+  ماه جلالی است؛ چون DB ماه جلالی نمی‌شناسد، گروه‌بندی روی روز (finished_at) در SQL انجام
+  و روزها در پایتون به ماه جلالی جمع می‌شوند (تعداد ردیف‌ها حداکثر «روز × تکنسین × مرحله»).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import List, Optional
+
+from django.db.models import CharField, Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import StageWorkLog
+
+ZERO = Decimal("0.00")
+
+DETAIL_FIELDS = (
+    "id", "technician__name", "stage_label", "product_code", "product_name",
+    "quantity", "unit_wage", "total_wage", "finished_at", "order_id",
+)
+
+
+@dataclass
+class WagesFilters:
+    technician: str = ""      # نام تکنسین
+    start: Optional[object] = None
+    end: Optional[object] = None
+    product: str = ""         # کُد محصول
+    stage: str = ""           # برچسب مرحله
+
+
+def _stage_label():
+    return Coalesce(F("stage_tpl__label"), F("stage_inst__label"), Value(""), output_field=CharField())
+
+
+def filtered_logs(f: WagesFilters):
+    qs = StageWorkLog.objects.all()
+    if f.technician:
+        qs = qs.filter(technician__name=f.technician)
+    if f.start:
+        qs = qs.filter(finished_at__gte=f.start)
+    if f.end:
+        qs = qs.filter(finished_at__lte=f.end)
+    if f.product:
+        qs = qs.filter(product_code=f.product)
+    if f.stage:
+        qs = qs.filter(Q(stage_tpl__label=f.stage) | Q(stage_inst__label=f.stage))
+    return qs
+
+
+def detail_rows(qs):
+    """ردیف‌های سبک (dict) برای جدول/خروجی؛ بدون ساخت مدل و بدون select_related زنجیره‌ای."""
+    return qs.annotate(stage_label=_stage_label()).values(*DETAIL_FIELDS)
+
+
+@dataclass
+class WagesSummary:
+    total_wage: Decimal = ZERO
+    logs_count: int = 0
+    by_tech: List[dict] = field(default_factory=list)
+    by_stage: List[dict] = field(default_factory=list)
+    by_product: List[dict] = field(default_factory=list)
+
+
+def summarize(qs) -> WagesSummary:
+    base = qs.order_by()
+    agg = base.aggregate(s=Sum("total_wage"), n=Count("id"))
+    return WagesSummary(
+        total_wage=agg["s"] or ZERO,
+        logs_count=agg["n"] or 0,
+        by_tech=list(base.values("technician__name").annotate(total=Sum("total_wage"), n=Count("id"))
+                     .order_by("technician__name")),
+        by_stage=list(base.annotate(stage_label=_stage_label()).values("stage_label")
+                      .annotate(total=Sum("total_wage"), n=Count("id")).order_by("stage_label")),
+        by_product=list(base.values("product_code", "product_name")
+                        .annotate(total=Sum("total_wage"), n=Count("id")).order_by("product_name")),
+    )
+
+
+@dataclass
+class WagesPivot:
+    months: List[str] = field(default_factory=list)          # «1404/07» ...
+    rows: List[dict] = field(default_factory=list)           # [{technician, stage, cells: [Decimal..], total}]
+    month_totals: List[Decimal] = field(default_factory=list)
+    grand_total: Decimal = ZERO
+
+
+def _jmonth(d) -> str:
+    if d is None:
+        return "—"
+    try:
+        return d.strftime("%Y/%m")
+    except Exception:
+        return str(d)[:7].replace("-", "/")
+
+
+def pivot_tech_stage_month(qs) -> WagesPivot:
+    """پیوت تکنسین × مرحله × ماه جلالی؛ یک GROUP BY روی (تکنسین، مرحله، روز)."""
+    grouped = (
+        qs.order_by()
+        .annotate(stage_label=_stage_label())
+        .values("technician__name", "stage_label", "finished_at")
+        .annotate(total=Sum("total_wage"))
+    )
+    cells = OrderedDict()
+    months = set()
+    for r in grouped:
+        m = _jmonth(r["finished_at"])
+        months.add(m)
+        key = (r["technician__name"] or "—", r["stage_label"] or "—")
+        bucket = cells.setdefault(key, {})
+        bucket[m] = bucket.get(m, ZERO) + (r["total"] or ZERO)
+
+    p = WagesPivot(months=sorted(months))
+    p.month_totals = [ZERO for _ in p.months]
+    for (tech, stage) in sorted(cells):
+        bucket = cells[(tech, stage)]
+        row_cells = [bucket.get(m, ZERO) for m in p.months]
+        for i, v in enumerate(row_cells):
+            p.month_totals[i] += v
+        total = sum(row_cells, ZERO)
+        p.rows.append({"technician": tech, "stage": stage, "cells": row_cells, "total": total})
+        p.grand_total += total
+    return p
@@ -1,3 +1,63 @@
+from decimal import Decimal
+
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from billing.services import product_cost_cube as cube
+from core.models import Order, Patient
+
+
+class CostCubeInvalidationTests(TestCase):
+    def setUp(self):
+        patient = Patient.objects.create(name="بیمار آزمایشی")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(patient=patient, order_type="crown_zirconia",
+                                              unit_count=1, price=Decimal("1000.00"))
+
+    def _revenue(self):
+        cube.ensure_product("crown_zirconia")
+        return cube.totals(cube.cube_rows("crown_zirconia", include_open=True)).revenue
+
+    def test_save_after_rollback_still_refreshes_cube(self):
+        self.assertEqual(self._revenue(), Decimal("1000.00"))
+
+        # rollback کردن تراکنش، callback on_commit آن را دور می‌ریزد
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.order.price = Decimal("5000.00")
+                    self.order.save()
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.order.refresh_from_db()
+
+        # ذخیرهٔ بعدی باید دوباره بازسازی را زمان‌بندی کند
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.price += Decimal("1000.00")
+            self.order.save()
+        self.assertEqual(self._revenue(), Decimal("2000.00"))
+
+    def test_incremental_updates_match_full_rebuild(self):
+        def snapshot():
+            from billing.models import ProductMonthlyCost
+            return sorted(ProductMonthlyCost.objects.filter(product_code="crown_zirconia").values_list(
+                "product_code", "period", "is_closed", "orders_count", "units", "revenue"))
+
+        self._revenue()
+        patient = self.order.patient
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Order.objects.create(patient=patient, order_type="crown_zirconia",
+                                         unit_count=2, price=Decimal("300.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = "delivered"
+            self.order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            other.order_type = "crown_pfm"
+            other.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.delete()
+        incremental = snapshot()
+        cube.rebuild()
+        self.assertEqual(incremental, snapshot())
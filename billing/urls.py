@@ -1,6 +1,6 @@
 from django.urls import path
 from django.views.generic import TemplateView  # برای برخی صفحات ساده مثل هاب گزارش‌ها
-from .views_reports import report_profit_summary_api, report_profit_summary_page
+from .views_reports import report_profit_summary_api, report_profit_summary_page, report_bom_variance_page
 from .views_pricing import pricing_advisor_page, api_pricing_summary, api_pricing_compute
 from .views import (
     # فاکتورها
@@ -9,6 +9,7 @@ from .views import (
     InvoiceIssueView,
     InvoiceDeleteDraftView,
     InvoicePrintView,
+    InvoicePdfView,
 
     # حساب دکتر
     DoctorAccountView,
@@ -67,6 +68,9 @@ urlpatterns = [
     # نمای چاپ (Print-friendly)
     path("invoices/<int:pk>/print/", InvoicePrintView.as_view(), name="invoice_print"),
 
+    # PDF ذخیره‌شدهٔ فاکتور (رندر یک‌باره با WeasyPrint)
+    path("invoices/<int:pk>/pdf/", InvoicePdfView.as_view(), name="invoice_pdf"),
+
     # ✅ لیست پزشک‌ها (برای رفتن به حساب دکتر)
     path("doctors/", DoctorListView.as_view(), name="doctor_list"),
 
@@ -87,6 +91,7 @@ urlpatterns = [
 
     path("api/profit-summary/", report_profit_summary_api, name="report_profit_summary_api"),
     path("reports/profit-summary/", report_profit_summary_page, name="report_profit_summary_page"),
+    path("reports/bom-variance/", report_bom_variance_page, name="report_bom_variance"),
 
     # حساب دکتر
     path("doctor/<int:doctor_id>/account/", DoctorAccountView.as_view(), name="doctor_account"),  # مسیر اصلی
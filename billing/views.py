@@ -459,12 +459,8 @@ class InvoiceDetailView(View):
 
 
         # ✅ فقط اضافه: پاس دادن پروفایل لابراتوار برای لوگو/اطلاعات بانکی
-        LAB_PROFILE = None
-        try:
-            from .models import LabProfile
-            LAB_PROFILE = LabProfile.objects.first()
-        except Exception:
-            LAB_PROFILE = None
+        from core.utils.lab_singletons import get_lab_profile
+        LAB_PROFILE = get_lab_profile()
 
         # خروجی به قالب
         ctx = {
@@ -629,6 +625,12 @@ class InvoiceIssueView(View):
             else:
                 return HttpResponse(_("خطا در تولید کد یکتای فاکتور."), status=500)
 
+        # ساخت PDF نهایی همان لحظهٔ صدور؛ خطای رندر نباید جلوی صدور را بگیرد (در اولین چاپ دوباره تلاش می‌شود)
+        try:
+            _render_invoice_artifact(request, invoice)
+        except Exception as ex:
+            print("invoice pdf render error on issue:", ex)
+
         return redirect("billing:invoice_detail", pk=invoice.id)
 
 
@@ -648,57 +650,108 @@ class InvoiceDeleteDraftView(View):
         return redirect("billing:invoice_create_draft")
 
 
-@method_decorator(login_required, name='dispatch')
-class InvoicePrintView(View):
+def _invoice_print_context(invoice):
     """
-    نمای چاپی فاکتور (برای پرینت/ذخیره به PDF با Print مرورگر)
+    کانتکست قالب چاپ فاکتور (مشترک بین نمای چاپی HTML و PDF).
+    - فقط برای Draft جمع‌ها تازه‌سازی می‌شوند؛ فاکتور صادرشده تغییرناپذیر است و نوشتن لازم ندارد.
     """
-    def get(self, request: HttpRequest, pk: int) -> HttpResponse:
-        from billing.models import Invoice
-        from .models import LabProfile
-        invoice = get_object_or_404(Invoice, pk=pk)
+    from core.utils.lab_singletons import get_lab_profile
 
-        # تازه‌سازی جمع‌ها
+    if invoice.status == getattr(Invoice.Status, 'DRAFT', 'draft'):
         try:
             invoice.recompute_totals()
         except Exception as ex:
             print("recompute_totals error on print:", ex)
 
-        # جمع تخفیف خطوط برای نمایش
-        discount_total_ctx = invoice.lines.aggregate(
-            s=Coalesce(Sum('discount_amount'), Decimal('0'))
-        )['s']
+    # جمع تخفیف خطوط برای نمایش
+    discount_total_ctx = invoice.lines.aggregate(
+        s=Coalesce(Sum('discount_amount'), Decimal('0'))
+    )['s']
 
-        # جمع‌های نمایشی (بدون پرداخت)
-        totals = _compute_display_totals(invoice)
+    # جمع‌های نمایشی (بدون پرداخت)
+    totals = _compute_display_totals(invoice)
 
-        # پرداخت‌های قبلی این فاکتور
-        paid_total_ctx = _paid_total_for_invoice(invoice)
+    # پرداخت‌های قبلی این فاکتور
+    paid_total_ctx = _paid_total_for_invoice(invoice)
 
-        # مانده نهایی پس از پرداخت‌ها
-        amount_due_after_payments_ctx = totals['amount_due'] - paid_total_ctx
-        if amount_due_after_payments_ctx < 0:
-            amount_due_after_payments_ctx = Decimal('0')
+    # مانده نهایی پس از پرداخت‌ها
+    amount_due_after_payments_ctx = totals['amount_due'] - paid_total_ctx
+    if amount_due_after_payments_ctx < 0:
+        amount_due_after_payments_ctx = Decimal('0')
 
-        # === اضافه‌شده: پاس دادن پروفایل به قالب (اگر باشد) ===
-        LAB_PROFILE = None
-        try:
-            from .models import LabProfile
-            LAB_PROFILE = LabProfile.objects.first()
-        except Exception:
-            LAB_PROFILE = None
-        # ========================================================
+    # پروفایل لابراتوار (اگر باشد) — از کش سراسری
+    LAB_PROFILE = get_lab_profile()
 
-        ctx = {
-            "invoice": invoice,
-            "discount_total_ctx": discount_total_ctx,
-            "paid_total_ctx": paid_total_ctx,
-            "amount_due_after_payments_ctx": amount_due_after_payments_ctx,
-            "LAB_PROFILE": LAB_PROFILE,  # اضافه شد
-        }
+    return {
+        "invoice": invoice,
+        "discount_total_ctx": discount_total_ctx,
+        "paid_total_ctx": paid_total_ctx,
+        "amount_due_after_payments_ctx": amount_due_after_payments_ctx,
+        "LAB_PROFILE": LAB_PROFILE,
+    }
 
-        # ⬅️ فقط این خط عوض شد تا ctx (که LAB_PROFILE داخلشه) به قالب برسد
-        return render(request, "billing/invoice_print.html", ctx)
+
+def _render_invoice_artifact(request, invoice):
+    """
+    رندر قالب چاپ به PDF و ذخیره به‌عنوان آرتیفکت (فقط برای فاکتور صادرشده).
+    خروجی: (pdf_bytes, artifact|None)
+    """
+    from django.template.loader import render_to_string
+    from billing.services.invoice_pdf import html_to_pdf, is_cacheable, store_artifact
+
+    ctx = _invoice_print_context(invoice)
+    html = render_to_string("billing/invoice_print.html", ctx, request=request)
+    pdf_bytes = html_to_pdf(html, base_url=request.build_absolute_uri('/'))
+    if not is_cacheable(invoice):
+        return pdf_bytes, None
+    return pdf_bytes, store_artifact(invoice, pdf_bytes, paid_total=ctx["paid_total_ctx"])
+
+
+@method_decorator(login_required, name='dispatch')
+class InvoicePrintView(View):
+    """
+    نمای چاپی فاکتور (برای پرینت/ذخیره به PDF با Print مرورگر)
+    """
+    def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        from billing.models import Invoice
+        invoice = get_object_or_404(Invoice, pk=pk)
+        return render(request, "billing/invoice_print.html", _invoice_print_context(invoice))
+
+
+@method_decorator(login_required, name='dispatch')
+class InvoicePdfView(View):
+    """
+    PDF فاکتور:
+      - صادرشده: اگر آرتیفکت معتبر هست مستقیماً سرو می‌شود؛ وگرنه یک‌بار رندر و ذخیره می‌شود.
+      - Draft: هر بار رندر می‌شود و ذخیره نمی‌شود.
+    ETag = SHA-256 محتوای PDF
+    """
+    def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        from django.http import FileResponse
+        from billing.models import Invoice
+        from billing.services.invoice_pdf import get_fresh_artifact
+
+        invoice = get_object_or_404(Invoice, pk=pk)
+        filename = f"{invoice.code or f'invoice-{invoice.pk}'}.pdf"
+
+        art = get_fresh_artifact(invoice)
+        if art is not None:
+            etag = f'"{art.content_hash}"'
+            if etag in (request.headers.get("If-None-Match") or ""):
+                resp = HttpResponse(status=304)
+                resp["ETag"] = etag
+                return resp
+            resp = FileResponse(art.pdf_file.open("rb"), content_type="application/pdf", filename=filename)
+            resp["Content-Disposition"] = f'inline; filename="{filename}"'
+            resp["ETag"] = etag
+            return resp
+
+        pdf_bytes, art = _render_invoice_artifact(request, invoice)
+        resp = HttpResponse(pdf_bytes, content_type="application/pdf")
+        resp["Content-Disposition"] = f'inline; filename="{filename}"'
+        if art is not None:
+            resp["ETag"] = f'"{art.content_hash}"'
+        return resp
 
 
 
@@ -1142,7 +1195,7 @@ class MonthlySalesReportView(View):
         from decimal import Decimal
         from django.http import HttpResponse
         from billing.models import Invoice
-        from jalali_date import datetime2jalali  # تبدیل میلادی به جلالی
+        from core.utils.jalali import jalali_ym  # تبدیل میلادی به جلالی (با کش روزها)
 
         issued_val = getattr(Invoice.Status, 'ISSUED', 'issued')
 
@@ -1179,8 +1232,7 @@ class MonthlySalesReportView(View):
             if amt < 0:
                 amt = Decimal('0')
 
-            jdt = datetime2jalali(issued_at)
-            jy, jm = jdt.year, jdt.month
+            jy, jm = jalali_ym(issued_at)
 
             key = (jy, jm)
             if key not in buckets:
@@ -1245,7 +1297,7 @@ class DiscountsReportView(View):
         from billing.models import Invoice
         from django.db.models import Sum
         from django.db.models.functions import Coalesce
-        from jalali_date import datetime2jalali
+        from core.utils.jalali import jalali_ym
         from django.db.models import Q
         import csv
 
@@ -1293,8 +1345,7 @@ class DiscountsReportView(View):
             if total_disc < 0:
                 total_disc = Decimal('0')
 
-            jdt = datetime2jalali(issued_at)
-            jy, jm = jdt.year, jdt.month
+            jy, jm = jalali_ym(issued_at)
             key = (jy, jm)
             if key not in buckets:
                 buckets[key] = {"count": 0, "discount_sum": Decimal('0')}
@@ -1354,9 +1405,11 @@ from django.contrib.auth.decorators import login_required
 from django.views import View
 from django.shortcuts import render
 from django.db.models import Q
+from core.utils.reporting_db import reporting_db
 
 # ========== NEW: AgingReportView (سازگار با قالب report_aging.html) ==========
 @method_decorator(login_required, name='dispatch')
+@method_decorator(reporting_db, name='dispatch')
 class AgingReportView(View):
     """
     گزارش Aging بدهی‌ها برای فاکتورهای 'ISSUED' که هنوز تسویه کامل نشده‌اند.
@@ -1513,6 +1566,7 @@ from django.db.models import Sum, F, DecimalField
 from django.urls import reverse
 from django.db.models import Q
 
+@method_decorator(reporting_db, name='dispatch')
 class FinancialHomeView(View):  # ← فقط همین تغییر: حذف @method_decorator(login_required, ...)
     """
     داده‌های صفحه‌ی billing/financial_home.html را فراهم می‌کند:
@@ -1848,7 +1902,8 @@ def _parse_date_iso_or_jalali(s):
                 if y >= 1600:
                     return date(y, m, d)  # میلادی
                 # ⬇️ سال کوچک‌تر از 1600 → جلالی
-                return jdatetime.date(y, m, d).togregorian()
+                from core.utils.jalali import to_gregorian
+                return to_gregorian((y, m, d))
     except Exception:
         pass
 
@@ -1869,213 +1924,100 @@ def _to_decimal(s, default=None):
         return default
 
 
-def _parse_any_date(raw):
-    """
-    ورودی: رشته‌ی تاریخ (ISO با خط تیره، یا میلادی/شمسی با اسلش)
-    خروجی: (date|None, raw_text|None)
-      - اگر میلادی قابل‌تبدیل باشد: (تاریخ پایتونی, None)
-      - اگر ظاهراً شمسی باشد: (None, متن شمسی نرمال‌شده 'YYYY/MM/DD')
-      - اگر نشد: (None, متن خام)
-    """
-    if not raw:
-        return (None, None)
-    s = str(raw).strip()
-    # ارقام فارسی/عربی → لاتین + یکنواخت‌سازی جداکننده
-    trans = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "0123456789"*2)
-    s_en = s.translate(trans).replace('.', '/')
-
-    # 1) ISO: YYYY-MM-DD
-    try:
-        if len(s_en) == 10 and s_en[4] == '-' and s_en[7] == '-':
-            return (datetime.strptime(s_en, "%Y-%m-%d").date(), None)
-    except Exception:
-        pass
-
-    # 2) الگوی اسلشی: YYYY/MM/DD  → اگر سال بزرگ بود (≥1600) میلادی می‌گیریم
-    m = None
-    import re
-    m = re.match(r'^(\d{4})/(\d{1,2})/(\d{1,2})$', s_en)
-    if m:
-        y, mth, dd = map(int, m.groups())
-        if y >= 1600:
-            try:
-                return (date(y, mth, dd), None)   # میلادی معتبر
-            except Exception:
-                return (None, s_en)               # متن را برگردان برای نمایش
-        else:
-            # به احتمال زیاد شمسی است → همان متن نرمال‌شده را بدهیم
-            return (None, f"{y:04d}/{mth:02d}/{dd:02d}")
-
-    # 3) هر چیز دیگر: متن خام
-    return (None, s)
-
-
-
-def _pack_note(title, vendor, note, extra_meta=None):
-    parts = []
-    if title:
-        parts.append(f"عنوان: {title}")
-    if vendor:
-        parts.append(f"فروشنده: {vendor}")
-    if extra_meta:
-        for k, v in extra_meta.items():
-            if v:
-                parts.append(f"{k}: {v}")
-    if note:
-        parts.append(note)
-    return " | ".join(parts)[:255]
-
-
-def _unpack_note(note):
-    out = {
-        "title": "",
-        "vendor": "",
-        "exp_type": "",
-        "occurred": "",
-        "paid": "",
-        "payment_method": ""
+def _expense_filters(request):
+    """فیلترهای لیست هزینه (همه روی ستون‌های واقعی و سمت DB)."""
+    g = request.GET
+    return {
+        "q":      (g.get('q') or '').strip(),
+        "cat":    (g.get('cat') or '').strip(),
+        "vendor": (g.get('vendor') or '').strip(),
+        "etype":  (g.get('etype') or '').strip(),
+        "d1":     (g.get('d1') or '').strip(),
+        "d2":     (g.get('d2') or '').strip(),
     }
-    if not note:
-        return out
-    try:
-        tokens = [t.strip() for t in str(note).split('|')]
-        kv = {}
-        for t in tokens:
-            if ':' in t:
-                k, v = t.split(':', 1)
-                kv[k.strip()] = v.strip()
-        out["title"] = kv.get("عنوان", "")
-        out["vendor"] = kv.get("فروشنده", "")
-        out["exp_type"] = kv.get("ماهیت", "")
-        out["occurred"] = kv.get("وقوع", "")
-        out["paid"] = kv.get("پرداخت", "")
-        if not out["paid"]:
-            out["paid"] = kv.get("تاریخ‌پرداخت", "")
-
-        out["payment_method"] = kv.get("روش‌پرداخت", "")
-        return out
-    except Exception:
-        return out
-
-
-def _fa_digits(s):
-    return str(s).replace('0','۰').replace('1','۱').replace('2','۲').replace('3','۳').replace('4','۴')\
-                 .replace('5','۵').replace('6','۶').replace('7','۷').replace('8','۸').replace('9','۹')
 
 
-def _pretty_date_for_badge(raw):
-    """
-    نمایش دوستانه برای برچسب‌ها:
-    - اگر 'YYYY-MM-DD' باشد → همان را با اسلش و ارقام فارسی نشان می‌دهیم (فعلاً).
-    - اگر 'YYYY/MM/DD' باشد → با ارقام فارسی نشان می‌دهیم.
-    - در غیر این‌صورت همان متن با ارقام فارسی.
-    """
-    if not raw:
-        return ""
-    s = str(raw).strip()
-    # ISO → YYYY/MM/DD
-    if len(s) == 10 and s[4] == '-' and s[7] == '-':
-        show = s.replace('-', '/')
-        return _fa_digits(show)
-    # شمسی با اسلش
-    if len(s) >= 8 and '/' in s:
-        return _fa_digits(s)
-    return _fa_digits(s)
+def _filtered_expenses(f):
+    qs = Expense.objects.all()
+    if f["q"]:
+        qs = qs.filter(Q(title__icontains=f["q"]) | Q(vendor__icontains=f["q"]) | Q(note__icontains=f["q"]))
+    if f["cat"]:
+        qs = qs.filter(category=f["cat"])
+    if f["vendor"]:
+        qs = qs.filter(vendor=f["vendor"])
+    if f["etype"]:
+        qs = qs.filter(expense_type=f["etype"])
+    if f["d1"]:
+        qs = qs.filter(date__gte=f["d1"])
+    if f["d2"]:
+        qs = qs.filter(date__lte=f["d2"])
+    return qs
 
 
 @method_decorator(login_required, name='dispatch')
 class ExpenseListView(View):
     def get(self, request: HttpRequest) -> HttpResponse:
-        qs = Expense.objects.all().order_by('-date', '-id')
-
-        q   = (request.GET.get('q') or '').strip()
-        cat = (request.GET.get('cat') or '').strip()
-        d1  = (request.GET.get('d1') or '').strip()
-        d2  = (request.GET.get('d2') or '').strip()
-
-        if q:
-            qs = qs.filter(Q(note__icontains=q))
-        if cat:
-            qs = qs.filter(category=cat)
-        if d1:
-            qs = qs.filter(date__gte=d1)
-        if d2:
-            qs = qs.filter(date__lte=d2)
-
-        expenses = list(qs)
-
-        # استخراج title/vendor + متادیتا و ست‌کردن نام‌های بدون زیرخط
-        # نگاشت برچسب‌ها
-        type_map = {
-            "opex": "جاری",
-            "recurring": "تکرارشونده",
-            "unexpected": "نامنظم/تعمیرات",
-            "capex": "سرمایه‌ای",
-            "tools": "ابزار مصرفی",
-            "": ""
-        }
-        pay_map = {
-            "cash": "نقد",
-            "card": "کارت",
-            "transfer": "حواله/کارت‌به‌کارت",
-            "other": "سایر",
-            "": ""
-        }
-
-        for e in expenses:
-            meta = _unpack_note(e.note)
-            # عنوان/فروشنده برای نمایش
-            e.title  = meta["title"]
-            e.vendor = meta["vendor"]
-
-            # برچسب‌های ماهیت/روش
-            e.exp_type_label   = type_map.get(meta["exp_type"], meta["exp_type"])
-            e.pay_method_label = pay_map.get(meta["payment_method"], meta["payment_method"])
-
-            # وقوع/پرداخت: یا date پایتونی (برای to_jalali) یا متن شمسی آماده
-            occur_date, occur_text = _parse_any_date(meta["occurred"])
-            paid_date,  paid_text  = _parse_any_date(meta["paid"])
-            e.occur_date = occur_date
-            e.paid_date  = paid_date
-            e.occur_text = occur_text
-            e.paid_text  = paid_text
-
-
-        total = sum([e.amount or Decimal('0') for e in expenses], start=Decimal('0'))
-
-        # CSV
+        from urllib.parse import urlencode
+        from django.db.models import Count, Sum
+
+        f = _expense_filters(request)
+        qs = _filtered_expenses(f)
+
+        base = qs.order_by()
+        total = base.aggregate(s=Sum('amount'))['s'] or Decimal('0')
+        type_labels = dict(Expense.ExpenseType.choices)
+        by_type = [
+            {"expense_type": r["expense_type"], "label": type_labels.get(r["expense_type"], r["expense_type"]) or "—",
+             "total": r["total"] or Decimal('0'), "n": r["n"]}
+            for r in base.values('expense_type').annotate(total=Sum('amount'), n=Count('id')).order_by('-total')
+        ]
+
+        # CSV: همهٔ ردیف‌های فیلترشده، بدون ساخت یکجای لیست
         if (request.GET.get('format') or '').lower() == 'csv':
             import csv
+            cat_labels = dict(Expense.Category.choices)
+            pay_labels = dict(Expense.PaymentMethod.choices)
             resp = HttpResponse(content_type='text/csv; charset=utf-8')
             resp['Content-Disposition'] = 'attachment; filename="expenses.csv"'
             resp.write('\ufeff')
             w = csv.writer(resp)
             w.writerow(['تاریخ', 'دسته', 'عنوان', 'مبلغ (ریال)', 'فروشنده', 'ماهیت', 'وقوع', 'پرداخت', 'روش', 'یادداشت'])
-            for e in expenses:
+            for e in qs.order_by('-date', '-id').values_list(
+                'date', 'category', 'title', 'amount', 'vendor', 'expense_type',
+                'occurred_date', 'paid_date', 'payment_method', 'note',
+            ).iterator(chunk_size=1000):
+                (d, cat_v, title, amount, vendor, etype, occurred, paid, pay, note) = e
                 w.writerow([
-                    e.date.isoformat(),
-                    dict(Expense.Category.choices).get(e.category, e.category),
-                    getattr(e, 'title', ''),
-                    str(e.amount or 0),
-                    getattr(e, 'vendor', ''),
-                    getattr(e, 'exp_type_label', ''),
-                    _pretty_date_for_badge(_unpack_note(e.note).get("occurred")),
-                    _pretty_date_for_badge(_unpack_note(e.note).get("paid")),
-                    getattr(e, 'pay_method_label', ''),
-                    (e.note or '')
+                    d.isoformat(),
+                    cat_labels.get(cat_v, cat_v),
+                    title,
+                    str(amount or 0),
+                    vendor,
+                    type_labels.get(etype, etype),
+                    occurred.isoformat() if occurred else '',
+                    paid.isoformat() if paid else '',
+                    pay_labels.get(pay, pay),
+                    note or '',
                 ])
             w.writerow([])
             w.writerow(['', '', 'جمع', str(total), '', '', '', '', '', ''])
             return resp
 
+        from core.utils.keyset import KeysetPaginator
+        page = KeysetPaginator(qs, ordering=('-date', '-id'), per_page=100).page(request.GET)
+
         ctx = {
-            "rows": expenses,
+            "rows": page.object_list,
+            "page": page,
             "total": total,
-            "q": q,
-            "cat": cat,
-            "d1": d1,
-            "d2": d2,
+            "by_type": by_type,
+            **f,
+            "filter_query": urlencode({k: v for k, v in f.items() if v}),
             "cat_choices": Expense.Category.choices,
+            "type_choices": Expense.ExpenseType.choices,
+            "vendor_choices": list(
+                Expense.objects.exclude(vendor='').order_by('vendor').values_list('vendor', flat=True).distinct()
+            ),
         }
         return render(request, "billing/expense_list.html", ctx)
 
@@ -2099,7 +2041,6 @@ class ExpenseCreateView(View):
 
         exp_type = (request.POST.get('expense_type') or '').strip()
         occurred = (request.POST.get('occurred_date') or '').strip()
-        paid     = (request.POST.get('paid_date') or '').strip()
         pay_mtd  = (request.POST.get('payment_method') or '').strip()
 
         if not title and not note_in:
@@ -2116,17 +2057,10 @@ class ExpenseCreateView(View):
         paid_raw = (request.POST.get('paid_date') or '').strip()
         paid_date_val = _parse_date_iso_or_jalali(paid_raw) or date_val
 
-        # روش پرداخت
-        pay_mtd = (request.POST.get('payment_method') or '').strip()
-
-
-        extra_meta = {
-            "ماهیت": "opex",
-            "روش‌پرداخت": pay_mtd,
-            "پرداخت": paid_date_val.isoformat(),
-        }
-
-        collected_note = _pack_note(title=title, vendor=vendor, note=note_in, extra_meta=extra_meta)
+        if exp_type not in Expense.ExpenseType.values:
+            exp_type = Expense.ExpenseType.OPEX
+        if pay_mtd not in Expense.PaymentMethod.values:
+            pay_mtd = ''
 
         attach_file = request.FILES.get('attachment')
 
@@ -2134,7 +2068,13 @@ class ExpenseCreateView(View):
             date=date_val,
             category=category,
             amount=amt,
-            note=collected_note,
+            title=title[:160],
+            vendor=vendor[:160],
+            expense_type=exp_type,
+            occurred_date=_parse_date_iso_or_jalali(occurred),
+            paid_date=paid_date_val,
+            payment_method=pay_mtd,
+            note=note_in[:255],
             attachment=attach_file if attach_file else None,
         )
         messages.success(request, "هزینه با موفقیت ثبت شد.")
@@ -2296,79 +2236,79 @@ import csv
 from billing.models import StockMovement, MaterialItem
 from core.models import Order, Product
 
+@method_decorator(reporting_db, name='dispatch')
 class MaterialConsumptionReportView(TemplateView):
+    """تحلیل مصرف متریال؛ محاسبات و گروه‌بندی در billing/services/material_consumption.py"""
     template_name = "billing/report_material_consumption.html"
 
-    def get_queryset(self):
-        qs = StockMovement.objects.filter(movement_type="issue").select_related("item", "order")
-        d1 = self.request.GET.get("d1")
-        d2 = self.request.GET.get("d2")
-        if d1:
-            qs = qs.filter(happened_at__gte=d1)
-        if d2:
-            qs = qs.filter(happened_at__lte=d2)
-        doctor = self.request.GET.get("doctor")
-        if doctor:
-            qs = qs.filter(order__doctor__icontains=doctor)
-        item = self.request.GET.get("item")
-        if item:
-            qs = qs.filter(item_id=item)
-        product = self.request.GET.get("product")
-        if product:
-            qs = qs.filter(product_code=product)
-        order_id = self.request.GET.get("order")
-        if order_id:
-            qs = qs.filter(order_id=order_id)
-        return qs
+    def get_filters(self):
+        from billing.services.material_consumption import ConsumptionFilters
+        g = self.request.GET
 
-    def get(self, request, *args, **kwargs):
-        qs = self.get_queryset()
-        group = request.GET.get("group", "row")
-        values, annotations = None, {}
-
-        if group == "item":
-            values = ["item__id", "item__name", "item__uom"]
-        elif group == "product":
-            values = ["product_code"]
-        elif group == "doctor":
-            values = ["order__doctor"]
-        elif group == "order":
-            values = ["order_id"]
-        else:
-            values = None
+        def _date(*names):
+            for n in names:
+                d = _parse_date_iso_or_jalali((g.get(n) or '').strip())
+                if d:
+                    return d
+            return None
 
-        if values:
-            qs = qs.values(*values)
+        def _int(name):
+            try:
+                return int(g.get(name) or 0) or None
+            except (TypeError, ValueError):
+                return None
+
+        return ConsumptionFilters(
+            start=_date("d1", "from_date_gregorian", "from_date"),
+            end=_date("d2", "to_date_gregorian", "to_date"),
+            item_id=_int("item_id") or _int("item"),
+            product=(g.get("product") or "").strip(),
+            doctor=(g.get("doctor") or "").strip(),
+            order_id=_int("order"),
+        )
 
-        annotations["qty_sum"] = Sum(F("qty") * Value(-1), output_field=DecimalField())
-        annotations["cost_sum"] = Sum(F("unit_cost_effective") * (F("qty") * Value(-1)), output_field=DecimalField())
-        qs = qs.annotate(**annotations)
+    def get(self, request, *args, **kwargs):
+        from django.http import StreamingHttpResponse
+        from billing.services import material_consumption as mc
+        from core.utils.reporting_db import active_alias
+        from core.utils.keyset import KeysetPaginator
+
+        f = self.get_filters()
+        qs = mc.filtered_moves(f)
+        group = request.GET.get("group", "row")
+        if group not in mc.GROUPINGS:
+            group = "row"
+        report = mc.grouped(qs, group) if group != "row" else None
 
         if request.GET.get("format") == "csv":
-            response = HttpResponse(content_type="text/csv; charset=utf-8-sig")
+            # جریان CSV بعد از خروج از view خوانده می‌شود؛ alias را صریح نگه می‌داریم
+            rows = mc.iter_grouped_csv(report) if report else mc.iter_detail_csv(qs.using(active_alias()))
+            response = StreamingHttpResponse(rows, content_type="text/csv; charset=utf-8")
             response["Content-Disposition"] = 'attachment; filename="material_consumption.csv"'
-            writer = csv.writer(response)
-            writer.writerow(["تاریخ", "آیتم", "مقدار", "واحد", "هزینه واحد", "جمع هزینه", "دکتر", "کد محصول", "سفارش"])
-            for mv in self.get_queryset():
-                writer.writerow([
-                    mv.happened_at.strftime("%Y-%m-%d"),
-                    mv.item.name,
-                    abs(mv.qty),
-                    mv.item.uom,
-                    mv.unit_cost_effective,
-                    abs(mv.qty) * mv.unit_cost_effective,
-                    mv.order.doctor if mv.order else "",
-                    mv.product_code,
-                    mv.order_id
-                ])
             return response
 
         ctx = self.get_context_data(**kwargs)
-        ctx["rows"] = qs
-        ctx["group"] = group
-        ctx["items"] = MaterialItem.objects.all().order_by("name")
-        ctx["products"] = Product.objects.all().order_by("name")
-        ctx["orders"] = Order.objects.all().order_by("-id")[:100]
+        if report is None:
+            page = KeysetPaginator(mc.detail_rows(qs), ordering=("-happened_at", "-id"), per_page=100).page(request.GET)
+            ctx.update({"rows": page.object_list, "page": page})
+        else:
+            ctx["report"] = report
+        dims = mc.dimension_choices()
+        query = request.GET.copy()
+        for k in ("format", "cursor"):
+            query.pop(k, None)
+        ctx.update({
+            "group": group,
+            "groupings": [(k, v[0]) for k, v in mc.GROUPINGS.items()],
+            "totals": mc.totals(qs),
+            "filters": f,
+            "materials": dims["items"],
+            "products": dims["products"],
+            "doctors": dims["doctors"],
+            "from_date": request.GET.get("from_date", ""),
+            "to_date": request.GET.get("to_date", ""),
+            "csv_query": query.urlencode(),
+        })
         return self.render_to_response(ctx)
 
 @method_decorator(login_required, name='dispatch')
@@ -2423,14 +2363,20 @@ class EquipmentListView(View):
         if d2:
             qs = qs.filter(purchase_date__lte=d2)
 
+        # ارزش دفتری/استهلاک از جدول استهلاک ذخیره‌شده (Subquery)، در تاریخ as_of (پیش‌فرض امروز)
+        from billing.services.depreciation import annotate_position, register_totals
+        as_of = _parse_date_iso_or_jalali((request.GET.get('as_of') or '').strip()) or timezone.localdate()
+
         # جمع‌ها (برای نمایش بالا)
         total_estimated = qs.aggregate(s=Sum('estimated_value'))['s'] or 0
-        # ارزش دفتری را در قالب از طریق متد هر آبجکت نمایش می‌دهیم
+        register = register_totals(qs, as_of)
 
         return render(request, self.template_name, {
-            "rows": qs,
+            "rows": annotate_position(qs, as_of),
             "q": q, "d1": d1, "d2": d2,
+            "as_of": as_of,
             "total_estimated": total_estimated,
+            "register": register,
         })
 
 
@@ -2493,8 +2439,13 @@ class RepairsListView(View):
                 ])
             return resp
 
+        # صفحه‌بندی Keyset روی (occurred_date, id)
+        from core.utils.keyset import KeysetPaginator
+        page = KeysetPaginator(qs, ordering=('-occurred_date', '-id'), per_page=50).page(request.GET)
+
         return render(request, self.template_name, {
-            "rows": qs,
+            "rows": page.object_list,
+            "page": page,
             "equipments": Equipment.objects.filter(is_active=True).order_by('name'),
             "q": q, "eq": eq, "d1": d1, "d2": d2
         })
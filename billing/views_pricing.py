@@ -2,8 +2,6 @@
 from __future__ import annotations
 from decimal import Decimal
 from typing import Optional
-import re
-import jdatetime
 
 from django.shortcuts import render
 from django.http import JsonResponse, HttpRequest
@@ -11,27 +9,12 @@ from django.views.decorators.http import require_GET
 from django.urls import reverse, NoReverseMatch
 
 from core.models import Product
+from core.utils.jalali import parse_jalali
 from billing.services.pricing_advisor import compute_product_pricing_summary
 
 # ـــــــــــ ابزارهای کوچک جلالی ـــــــــــ
-_PERSIAN_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹", "0123456789")
-_ARABIC_DIGITS  = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
-
-def _to_ascii_digits(s: str) -> str:
-    return s.translate(_PERSIAN_DIGITS).translate(_ARABIC_DIGITS)
-
 def _parse_jalali_date(raw: Optional[str]):
-    if not raw:
-        return None
-    s = _to_ascii_digits(raw.strip()).replace("-", "/")
-    m = re.match(r"^(\d{4})/(\d{1,2})/(\d{1,2})$", s)
-    if not m:
-        return None
-    jy, jm, jd = map(int, m.groups())
-    try:
-        return jdatetime.date(jy, jm, jd).togregorian()
-    except Exception:
-        return None
+    return parse_jalali(raw)
 
 # ـــــــــــ API تست قبلی (برای سلامت مسیر) ـــــــــــ
 @require_GET
@@ -18,14 +18,12 @@ from django.urls import path, reverse
 from django.utils.html import format_html
 from django.template.response import TemplateResponse
 from jalali_date.admin import ModelAdminJalaliMixin
-from jalali_date import date2jalali, datetime2jalali
-import jdatetime
 from django.contrib import messages
 from django.utils import timezone
 from .models import Accounting
 from django.db import models as dj_models
 from django.db.models.fields import DateTimeField
-from django.db.models import Sum, F, DecimalField, ExpressionWrapper, Value
+from django.db.models import Sum, F, DecimalField, ExpressionWrapper, Value, OuterRef, Subquery
 from django.db.models.functions import Coalesce, Cast
 from django.forms.models import BaseInlineFormSet
 from jalali_date.fields import JalaliDateField
@@ -38,19 +36,13 @@ from .forms import PatientForm, OrderForm, MaterialForm, AccountingForm
 from .models import OrderEvent
 from .models import Product, StageTemplate
 
-# کمکی: تبدیل رقم‌های فارسی/عربی به انگلیسی + فرمت «فارسی با جداکننده»
-FA_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+# کمکی: فرمت «فارسی با جداکننده» (مشترک با فیلتر money_fa؛ core/utils/fa_numbers.py)
+from core.utils.fa_numbers import FA_DIGITS, format_money_fa, format_money_fa_many
+from core.utils.jalali import jalali_str, jalali_str_many, parse_jalali
 
 def money_fa_py(value):
     """برمی‌گرداند مثل: ۱٬۲۳۴٬۵۶۷ (جداکنندهٔ فارسی + رقم‌های فارسی)"""
-    if value is None or value == "":
-        return ""
-    try:
-        n = int(float(value))
-        s = f"{n:,}"  # جداکننده انگلیسی
-        return s.replace(",", "٬").translate(FA_DIGITS)  # کامای فارسی + ارقام فارسی
-    except Exception:
-        return str(value)
+    return format_money_fa(value)
 
 
 # -----------------------------
@@ -66,6 +58,29 @@ class PatientAdmin(admin.ModelAdmin):
 # -----------------------------
 # Filter: وضعیت تسویه (بدهکار/تسویه‌شده)
 # -----------------------------
+def annotate_order_money(queryset):
+    """
+    total / paid / balance برای لیست سفارش‌ها.
+    paid با Subquery همبسته روی Accounting (ایندکس order_id) حساب می‌شود، نه با JOIN + GROUP BY روی
+    همهٔ ستون‌های سفارش؛ پس صفحه‌بندی و COUNT لیست ادمین روی جدول‌های بزرگ سبک می‌ماند.
+    """
+    if 'balance' in queryset.query.annotations:
+        return queryset
+    dec = DecimalField(max_digits=14, decimal_places=2)
+    zero_dec  = Value(0, output_field=dec)
+    unit_dec  = Coalesce(Cast(F('unit_count'), dec), zero_dec)
+    price_dec = Coalesce(Cast(F('price'),      dec), zero_dec)
+    paid_sq = (
+        Accounting.objects.filter(order=OuterRef('pk'))
+        .order_by().values('order').annotate(s=Sum('amount')).values('s')[:1]
+    )
+    return queryset.annotate(
+        total   = ExpressionWrapper(unit_dec * price_dec, output_field=dec),
+        paid    = Coalesce(Subquery(paid_sq, output_field=dec), zero_dec),
+        balance = ExpressionWrapper(F('total') - F('paid'), output_field=dec),
+    )
+
+
 class BalanceStatusFilter(admin.SimpleListFilter):
     title = 'وضعیت تسویه'
     parameter_name = 'balance_status'
@@ -77,24 +92,13 @@ class BalanceStatusFilter(admin.SimpleListFilter):
         ]
 
     def queryset(self, request, queryset):
-        # Annotate برای محاسبه‌ی مانده (تمیز و سریع)
-        zero_dec  = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
-        unit_dec  = Coalesce(Cast(F('unit_count'), DecimalField(max_digits=14, decimal_places=2)), zero_dec)
-        price_dec = Coalesce(Cast(F('price'),      DecimalField(max_digits=14, decimal_places=2)), zero_dec)
-
-        total_expr = ExpressionWrapper(unit_dec * price_dec, output_field=DecimalField(max_digits=14, decimal_places=2))
-        qs = queryset.annotate(
-            total   = total_expr,
-            paid    = Coalesce(Sum('accounting__amount'), zero_dec),
-            balance = ExpressionWrapper(F('total') - F('paid'), output_field=DecimalField(max_digits=14, decimal_places=2)),
-        )
-
         val = self.value()
+        if val not in ('debt', 'settled'):
+            return queryset
+        qs = annotate_order_money(queryset)
         if val == 'debt':
             return qs.filter(balance__gt=0)
-        if val == 'settled':
-            return qs.filter(balance__lte=0)
-        return qs
+        return qs.filter(balance__lte=0)
 
 
 # -----------------------------
@@ -275,10 +279,14 @@ class OrderAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
     actions = ['settle_balance_action', 'init_stages_from_template_action']
 
     # ناوبری و نظم
-    date_hierarchy = 'created_at'
+    # date_hierarchy روی هر بار نمایش، DISTINCT روی trunc(created_at) کل جدول می‌زد (کند روی ده‌ها هزار
+    # سفارش)؛ به‌جایش فیلتر بازهٔ تاریخ ثبت (امروز/۷ روز/این ماه/امسال) که از ایندکس created_at استفاده می‌کند
     list_per_page = 30
     ordering = ('-created_at',)
     list_select_related = ('patient',)
+    # شمارش کل جدول (بدون فیلتر) در هر صفحهٔ فیلترشده حذف می‌شود؛ «نمایش همه» هم سقف دارد
+    show_full_result_count = False
+    list_max_show_all = 500
     empty_value_display = '—'
     search_help_text = 'جستجو بر اساس نام بیمار، پزشک، نوع سفارش، سریال یا ID'
 
@@ -302,7 +310,7 @@ class OrderAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
         'undo_button',
     ]
     list_display_links = ('id', 'patient_name_display')
-    list_filter = ['status', 'due_date', BalanceStatusFilter]
+    list_filter = ['status', 'due_date', 'created_at', BalanceStatusFilter]
     search_fields = ['doctor', 'order_type', 'shade', 'serial_number', 'patient__name', 'id']
     readonly_fields = ['total_price_display']
 
@@ -352,20 +360,7 @@ class OrderAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
     # ---------- get_queryset واحد و تمیز (لطفاً فقط همین یکی را نگه دار!) ----------
     def get_queryset(self, request):
         qs = super().get_queryset(request).select_related('patient')
-
-        zero_dec = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
-        unit_dec  = Coalesce(Cast(F('unit_count'), DecimalField(max_digits=14, decimal_places=2)), zero_dec)
-        price_dec = Coalesce(Cast(F('price'),      DecimalField(max_digits=14, decimal_places=2)), zero_dec)
-
-        total_expr = ExpressionWrapper(unit_dec * price_dec, output_field=DecimalField(max_digits=14, decimal_places=2))
-        paid_expr  = Coalesce(Sum('accounting__amount'), zero_dec)
-
-        qs = qs.annotate(
-            total=total_expr,
-            paid=paid_expr,
-            balance=ExpressionWrapper(F('total') - F('paid'), output_field=DecimalField(max_digits=14, decimal_places=2))
-        )
-        return qs
+        return annotate_order_money(qs)
 
     # ---------- Helperها ----------
     def _total_raw(self, obj):
@@ -427,13 +422,8 @@ class OrderAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
         if not d:
             return '—'
         try:
-            # اگر فیلد از نوع jmodels.jDateField باشد، d از نوع jdatetime.date است و خودش جلالی است
-            if isinstance(d, jdatetime.date):
-                s = d.strftime('%Y/%m/%d')
-            else:
-                # در غیر اینصورت (date میلادی)، به جلالی تبدیل کن
-                s = date2jalali(d).strftime('%Y/%m/%d')
-            return s.translate(FA_DIGITS)
+            # jDateField → خودش جلالی است؛ date میلادی از کش تبدیل روزها
+            return jalali_str(d, fa_digits=True)
         except Exception:
             return str(d)
 
@@ -444,13 +434,7 @@ class OrderAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
             return '—'
         try:
             # اگر jDateField است، خودش جلالی است
-            import jdatetime
-            if isinstance(d, jdatetime.date):
-                s = d.strftime('%Y/%m/%d')
-            else:
-                from jalali_date import date2jalali
-                s = date2jalali(d).strftime('%Y/%m/%d')
-            return s.translate(FA_DIGITS)
+            return jalali_str(d, fa_digits=True)
         except Exception:
             return str(d)
 
@@ -678,20 +662,10 @@ class AccountingAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
         end_date_str   = data.get('end_date', '').strip()
 
         # تبدیل قطعی جلالی به میلادی
-        import jdatetime
         from django.db.models import DateTimeField as _DTF
 
-        def jalali_to_gregorian(jalali_str):
-            if not jalali_str:
-                return None
-            try:
-                y, m, d = [int(p) for p in jalali_str.split('/')]
-                return jdatetime.date(y, m, d).togregorian()  # -> datetime.date
-            except Exception:
-                return None
-
-        start_date = jalali_to_gregorian(start_date_str)
-        end_date   = jalali_to_gregorian(end_date_str)
+        start_date = parse_jalali(start_date_str)
+        end_date   = parse_jalali(end_date_str)
 
         orders = Order.objects.all()
 
@@ -740,7 +714,6 @@ class AccountingAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
             import io
             import xlsxwriter
             from django.http import HttpResponse
-            from jalali_date import date2jalali, datetime2jalali
 
             output = io.BytesIO()
             workbook = xlsxwriter.Workbook(output, {'in_memory': True})
@@ -766,33 +739,25 @@ class AccountingAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
             ws.set_column(5, 6, 18)
             ws.set_column(7, 8, 16)
 
+            # ستون‌های مبلغ یک‌جا قالب‌بندی می‌شوند (قیمت‌های تکراری از کش)
+            price_fa = format_money_fa_many(order.price or 0 for order in orders)
+            total_fa = format_money_fa_many(getattr(order, 'total_price', 0) or 0 for order in orders)
+            due_fa = jalali_str_many(getattr(order, 'due_date', None) for order in orders)
+            created_fa = jalali_str_many(getattr(order, 'created_at', None) for order in orders)
+
             row = 1
-            for order in orders:
+            for order, price_s, total_s, due_s, created_s in zip(orders, price_fa, total_fa, due_fa, created_fa):
                 ws.write(row, 0, order.id, fmt_cell)
                 ws.write(row, 1, getattr(order, 'patient_name', '') or "", fmt_cell_rtl)
                 ws.write(row, 2, order.doctor or "", fmt_cell_rtl)
                 ws.write(row, 3, order.get_order_type_display(), fmt_cell)
                 ws.write(row, 4, order.unit_count or 0, fmt_cell)
 
-                ws.write(row, 5, money_fa_py(order.price or 0), fmt_cell_rtl)
-                ws.write(row, 6, money_fa_py(getattr(order, 'total_price', 0) or 0), fmt_cell_rtl)
-
-                due = ""
-                if getattr(order, 'due_date', None):
-                    try:
-                        due = date2jalali(order.due_date).strftime("%Y/%m/%d")
-                    except Exception:
-                        due = str(order.due_date)
-
-                created = ""
-                if getattr(order, 'created_at', None):
-                    try:
-                        created = datetime2jalali(order.created_at).strftime("%Y/%m/%d")
-                    except Exception:
-                        created = order.created_at.strftime("%Y/%m/%d")
-
-                ws.write(row, 7, due, fmt_cell)
-                ws.write(row, 8, created, fmt_cell)
+                ws.write(row, 5, price_s, fmt_cell_rtl)
+                ws.write(row, 6, total_s, fmt_cell_rtl)
+
+                ws.write(row, 7, due_s, fmt_cell)
+                ws.write(row, 8, created_s, fmt_cell)
                 row += 1
 
             ws.write(row, 0, 'جمع کل', fmt_header)
@@ -1125,17 +1090,13 @@ class DigitalLabTransferAdmin(ModelAdminJalaliMixin, admin.ModelAdmin):
     def sent_date_fa(self, obj):
         if not obj.sent_date:
             return '—'
-        from jalali_date import date2jalali
-        s = date2jalali(obj.sent_date).strftime('%Y/%m/%d')
-        return s.translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹"))
+        return jalali_str(obj.sent_date, fa_digits=True)
 
     @admin.display(description='دریافت')
     def received_date_fa(self, obj):
         if not obj.received_date:
             return '—'
-        from jalali_date import date2jalali
-        s = date2jalali(obj.received_date).strftime('%Y/%m/%d')
-        return s.translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹"))
+        return jalali_str(obj.received_date, fa_digits=True)
 
     @admin.display(description='هزینه (تومان)')
     def cost_toman_fa(self, obj):
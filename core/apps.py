@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # کش LabProfile/LabSettings با ذخیره/حذف همین مدل‌ها خالی می‌شود
+        from core.utils.lab_singletons import connect_signals
+        connect_signals()
+        # کش پلن مراحل محصول با ذخیره/حذف StageTemplate/Product خالی می‌شود
+        from core.utils.stage_seeding import connect_signals as connect_stage_signals
+        connect_stage_signals()
+        # PRAGMAهای SQLite (WAL، busy_timeout، ...) روی هر اتصال تازه
+        from core.utils.sqlite_tuning import connect_signals as connect_sqlite_signals
+        connect_sqlite_signals()
@@ -0,0 +1,15 @@
+from core.utils.lab_singletons import get_lab_profile, get_lab_settings, get_lab_logo_url
+
+
+def lab_singletons(request):
+    """
+    پروفایل و تنظیمات لابراتوار برای همهٔ قالب‌ها (هدر، لوگو، اطلاعات بانکی).
+    مقادیر از کش سراسری خوانده می‌شوند؛ در حالت عادی هیچ کوئری‌ای اجرا نمی‌شود.
+    """
+    profile = get_lab_profile()
+    return {
+        "lab_profile": profile,
+        "LAB_PROFILE": profile,
+        "lab_settings": get_lab_settings(),
+        "lab_logo_url": get_lab_logo_url(),
+    }
@@ -0,0 +1,59 @@
+"""
+ساخت مراحل (StageInstance) برای سفارش‌هایی که هیچ‌وقت seed نشده‌اند
+(مثلاً سفارش‌های ایمپورت‌شده یا قدیمی‌تر از تعریف StageTemplateها).
+
+مثال:
+    python manage.py backfill_order_stages
+    python manage.py backfill_order_stages --product crown_zirconia --dry-run
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Order
+from core.utils.stage_seeding import get_plans, seed_many
+
+
+class Command(BaseCommand):
+    help = "ساخت مراحل برای سفارش‌های بدون StageInstance"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", action="append", default=[],
+                            help="فقط سفارش‌های این نوع/کد محصول (قابل تکرار)")
+        parser.add_argument("--include-closed", action="store_true",
+                            help="سفارش‌های delivered/cancelled هم seed شوند")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true", help="فقط گزارش؛ بدون نوشتن در DB")
+
+    def handle(self, *args, **opts):
+        qs = (
+            Order.objects
+            .filter(stages__isnull=True)
+            .exclude(order_type__isnull=True).exclude(order_type="")
+            .only("id", "order_type", "order_date")
+            .order_by("id")
+        )
+        if opts["product"]:
+            qs = qs.filter(order_type__in=opts["product"])
+        if not opts["include_closed"]:
+            qs = qs.exclude(status__in=["delivered", "cancelled"])
+
+        batch = max(1, opts["batch_size"])
+        orders = list(qs)
+        plans = get_plans(o.order_type for o in orders)
+        eligible = [o for o in orders if plans.get(o.order_type.strip())]
+        stages = sum(len(plans[o.order_type.strip()]) for o in eligible)
+
+        if opts["dry_run"]:
+            self.stdout.write(self.style.NOTICE(
+                f"{len(eligible)} سفارش ({stages} مرحله) قابل seed؛ "
+                f"{len(orders) - len(eligible)} سفارش بدون پلن مرحله."
+            ))
+            return
+
+        created = 0
+        for i in range(0, len(eligible), batch):
+            with transaction.atomic():
+                created += seed_many(eligible[i:i + batch], batch_size=batch)
+        self.stdout.write(self.style.SUCCESS(
+            f"{created} مرحله برای {len(eligible)} سفارش ساخته شد."
+        ))
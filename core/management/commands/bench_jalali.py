@@ -0,0 +1,112 @@
+"""
+بنچمارک تبدیل تاریخ: مسیر قبلی (jdatetime برای هر ردیف + strftime / پارس با regex)
+در برابر core/utils/jalali.py (کش روزها + نسخه‌های دسته‌ای).
+
+ورودی شبیه یک حلقهٔ گزارش: n ردیف روی چند صد روز متمایز (datetime aware و date).
+خروجی هر روش با مسیر قبلی مقایسه می‌شود؛ با --verify-years کل روزهای چند سال هم
+رفت‌وبرگشت چک می‌شوند.
+
+مثال:
+    python manage.py bench_jalali
+    python manage.py bench_jalali --n 200000 --days 900 --verify-years 60
+"""
+import datetime
+import random
+import re
+import time
+
+import jdatetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.utils import jalali
+
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+
+def _legacy_str(d):
+    if isinstance(d, datetime.datetime):
+        if timezone.is_aware(d):
+            d = timezone.localtime(d)
+        return jdatetime.datetime.fromgregorian(datetime=d).strftime("%Y/%m/%d")
+    return jdatetime.date.fromgregorian(date=d).strftime("%Y/%m/%d")
+
+
+def _legacy_parse(raw):
+    s = raw.strip().translate(_DIGITS).replace("-", "/")
+    m = re.match(r"^(\d{4})/(\d{1,2})/(\d{1,2})$", s)
+    if not m:
+        return None
+    try:
+        return jdatetime.date(*map(int, m.groups())).togregorian()
+    except Exception:
+        return None
+
+
+def _timed(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+class Command(BaseCommand):
+    help = "بنچمارک تبدیل جلالی (مسیر قبلی در برابر core/utils/jalali.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--n", type=int, default=50_000, help="تعداد ردیف‌ها")
+        parser.add_argument("--days", type=int, default=365, help="تعداد روزهای متمایز")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--verify-years", type=int, default=0,
+                            help="رفت‌وبرگشت همهٔ روزهای این تعداد سال از ۱۹۹۰")
+
+    def handle(self, *args, **opts):
+        rnd = random.Random(1404)
+        base = datetime.date(2024, 3, 20)
+        days = [base + datetime.timedelta(days=i) for i in range(opts["days"])]
+        tz = timezone.get_current_timezone()
+        values = []
+        for _ in range(opts["n"]):
+            d = rnd.choice(days)
+            if rnd.random() < 0.5:
+                values.append(d)
+            else:
+                values.append(timezone.make_aware(datetime.datetime(d.year, d.month, d.day, rnd.randrange(24)), tz))
+        raw = [_legacy_str(d).translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")) for d in days]
+        strings = [rnd.choice(raw) for _ in range(opts["n"])]
+
+        cases = [
+            ("g2j str", lambda: [_legacy_str(v) for v in values],
+             lambda: [jalali.jalali_str(v) for v in values], lambda: jalali.jalali_str_many(values)),
+            ("parse j2g", lambda: [_legacy_parse(s) for s in strings],
+             lambda: [jalali.parse_jalali(s) for s in strings], lambda: jalali.parse_jalali_many(strings)),
+        ]
+        for label, legacy, single, many in cases:
+            jalali.cache_clear()
+            t_legacy, expected = _timed(legacy, opts["repeat"])
+            t_single, out_single = _timed(single, opts["repeat"])
+            t_many, out_many = _timed(many, opts["repeat"])
+            ok = out_single == expected and out_many == expected
+            self.stdout.write(
+                f"{label:10s} legacy={t_legacy * 1000:7.1f}ms  cached={t_single * 1000:7.1f}ms  "
+                f"many={t_many * 1000:7.1f}ms  ×{t_legacy / t_many:.1f}  {'OK' if ok else 'MISMATCH'}"
+            )
+            if not ok:
+                self.stderr.write(self.style.ERROR(f"{label}: خروجی با مسیر قبلی یکسان نیست"))
+
+        years = opts["verify_years"]
+        if years:
+            start = datetime.date(1990, 1, 1)
+            bad = 0
+            for i in range((datetime.date(1990 + years, 1, 1) - start).days):
+                g = start + datetime.timedelta(days=i)
+                j = jalali.to_jalali(g)
+                ref = jdatetime.date.fromgregorian(date=g)
+                if (j.year, j.month, j.day) != (ref.year, ref.month, ref.day) or jalali.to_gregorian(j) != g:
+                    bad += 1
+            style = self.style.SUCCESS if not bad else self.style.ERROR
+            self.stdout.write(style(f"رفت‌وبرگشت {i + 1} روز: {bad} خطا"))
+        self.stdout.write(str(jalali.cache_info()))
@@ -0,0 +1,94 @@
+"""
+میکروبنچمارک قالب‌بندی مبلغ: مسیر قدیمی فیلتر money_fa (commas → commas_fa → digits_fa)
+در برابر core/utils/fa_numbers.py (تک‌گذر + کش) و نسخهٔ دسته‌ای format_money_fa_many.
+
+ورودی شبیه ستون‌های گزارش: ترکیب Decimal / int / رشته با تکرار زیاد مقادیر
+(قیمت‌های واحد محدود، صفرها، جمع‌ها). خروجی هر روش با مسیر قدیمی مقایسه هم می‌شود.
+
+مثال:
+    python manage.py bench_money_fa
+    python manage.py bench_money_fa --n 200000 --distinct 500
+"""
+import random
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+
+from core.utils.fa_numbers import FA_DIGITS, TO_ASCII, cache_clear, format_money_fa, format_money_fa_many
+
+
+def _legacy_money_fa(value):
+    """کپی رفتار فیلتر money_fa پیش از fa_numbers (برای مقایسه)."""
+    s = "" if value is None else str(value).strip().translate(TO_ASCII)
+    if s == "":
+        res = ""
+    else:
+        try:
+            res = f"{int(Decimal(s)):,}"
+        except (InvalidOperation, ValueError, TypeError):
+            res = value
+    return str(res).replace(",", "٬").translate(FA_DIGITS)
+
+
+def _sample(n, distinct, seed=1404):
+    rnd = random.Random(seed)
+    pool = []
+    for _ in range(distinct):
+        amount = rnd.randrange(0, 500_000_000, 1000)
+        kind = rnd.random()
+        if kind < 0.5:
+            pool.append(Decimal(amount) + Decimal("0.00"))
+        elif kind < 0.8:
+            pool.append(amount)
+        else:
+            pool.append(f"{amount:,}")
+    pool += [0, Decimal("0.00"), None, ""]
+    return [rnd.choice(pool) for _ in range(n)]
+
+
+class Command(BaseCommand):
+    help = "میکروبنچمارک money_fa (مسیر قدیمی در برابر fa_numbers)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--n", type=int, default=100_000, help="تعداد سلول‌ها")
+        parser.add_argument("--distinct", type=int, default=2000, help="تعداد مقادیر متمایز")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        values = _sample(opts["n"], opts["distinct"])
+        expected = [_legacy_money_fa(v) for v in values]
+
+        def _single():
+            return [format_money_fa(v) for v in values]
+
+        def _many():
+            return format_money_fa_many(values)
+
+        def _single_cold():
+            cache_clear()
+            return _single()
+
+        modes = [
+            ("legacy", lambda: [_legacy_money_fa(v) for v in values]),
+            ("fast_cold", _single_cold),
+            ("fast", _single),
+            ("many", _many),
+        ]
+        best = {}
+        for name, fn in modes:
+            times = []
+            for _ in range(opts["repeat"]):
+                t0 = time.perf_counter()
+                out = fn()
+                times.append(time.perf_counter() - t0)
+            if out != expected:
+                bad = next(i for i, (a, b) in enumerate(zip(out, expected)) if a != b)
+                self.stderr.write(f"{name}: خروجی متفاوت برای {values[bad]!r}: {out[bad]!r} != {expected[bad]!r}")
+            best[name] = min(times)
+            rate = len(values) / best[name] if best[name] else 0
+            self.stdout.write(f"{name:10s} {best[name] * 1000:8.1f} ms   {rate:,.0f} cells/s")
+
+        for name in ("fast_cold", "fast", "many"):
+            if best[name]:
+                self.stdout.write(self.style.SUCCESS(f"{name}: ×{best['legacy'] / best[name]:.1f} نسبت به legacy"))
@@ -0,0 +1,122 @@
+"""
+بنچمارک نوشتن هم‌زمان روی SQLite: تنظیمات پیش‌فرض در برابر PRAGMAهای core/utils/sqlite_tuning.py.
+
+روی یک فایل موقت (نه DB اصلی) چند نویسنده و چند خواننده به‌طور هم‌زمان کار می‌کنند؛
+هر نویسنده تراکنش‌های کوچک شبیه ثبت لاگ مرحله (INSERT + UPDATE شمارنده) می‌زند.
+خروجی: تراکنش در ثانیه، کل خواندن‌ها و تعداد خطاهای «database is locked».
+
+مثال:
+    python manage.py bench_sqlite_writes
+    python manage.py bench_sqlite_writes --writers 8 --readers 4 --tx 300
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.utils.sqlite_tuning import apply_pragmas, get_pragmas
+
+SCHEMA = """
+CREATE TABLE worklog (id INTEGER PRIMARY KEY, station INTEGER, qty INTEGER, note TEXT);
+CREATE TABLE counter (station INTEGER PRIMARY KEY, total INTEGER);
+"""
+
+
+def _run(path, pragmas, writers, readers, tx, timeout):
+    setup = sqlite3.connect(path)
+    setup.executescript(SCHEMA)
+    setup.executemany("INSERT INTO counter VALUES (?, 0)", [(i,) for i in range(writers)])
+    setup.commit()
+    if pragmas:
+        apply_pragmas(setup.cursor(), pragmas)
+    setup.close()
+
+    stats = {"done": 0, "locked": 0, "reads": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def _connect():
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        if pragmas:
+            apply_pragmas(conn.cursor(), pragmas)
+        return conn
+
+    def writer(station):
+        conn = _connect()
+        done = locked = 0
+        for i in range(tx):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT INTO worklog (station, qty, note) VALUES (?, ?, ?)", (station, i, "x" * 64))
+                conn.execute("UPDATE counter SET total = total + 1 WHERE station = ?", (station,))
+                conn.execute("COMMIT")
+                done += 1
+            except sqlite3.OperationalError:
+                locked += 1
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    pass
+        conn.close()
+        with lock:
+            stats["done"] += done
+            stats["locked"] += locked
+
+    def reader():
+        conn = _connect()
+        n = 0
+        while not stop.is_set():
+            try:
+                conn.execute("SELECT station, COUNT(*), SUM(qty) FROM worklog GROUP BY station").fetchall()
+                n += 1
+            except sqlite3.OperationalError:
+                pass
+        conn.close()
+        with lock:
+            stats["reads"] += n
+
+    w_threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    r_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    t0 = time.perf_counter()
+    for t in r_threads + w_threads:
+        t.start()
+    for t in w_threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in r_threads:
+        t.join()
+    stats["elapsed"] = elapsed
+    return stats
+
+
+class Command(BaseCommand):
+    help = "بنچمارک نوشتن هم‌زمان SQLite (پیش‌فرض در برابر WAL/PRAGMAهای پروژه)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=6)
+        parser.add_argument("--readers", type=int, default=2)
+        parser.add_argument("--tx", type=int, default=200, help="تعداد تراکنش هر نویسنده")
+        parser.add_argument("--timeout", type=float, default=5.0,
+                            help="timeout ماژول sqlite3 (ثانیه) برای هر دو حالت")
+
+    def handle(self, *args, **opts):
+        modes = [("default", {}), ("tuned", get_pragmas())]
+        results = {}
+        for name, pragmas in modes:
+            with tempfile.TemporaryDirectory() as tmp:
+                results[name] = _run(os.path.join(tmp, "bench.sqlite3"), pragmas,
+                                     opts["writers"], opts["readers"], opts["tx"], opts["timeout"])
+            r = results[name]
+            tps = r["done"] / r["elapsed"] if r["elapsed"] else 0
+            self.stdout.write(
+                f"{name:8s} tx={r['done']:6d}  locked={r['locked']:4d}  reads={r['reads']:7d}  "
+                f"time={r['elapsed']:.2f}s  tx/s={tps:,.0f}"
+            )
+        base, tuned = results["default"], results["tuned"]
+        if base["done"] and tuned["elapsed"]:
+            gain = (tuned["done"] / tuned["elapsed"]) / (base["done"] / base["elapsed"])
+            self.stdout.write(self.style.SUCCESS(f"ضریب بهبود تراکنش در ثانیه: ×{gain:.1f}"))
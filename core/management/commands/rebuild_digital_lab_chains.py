@@ -0,0 +1,25 @@
+"""
+بازسازی ریشه/عمق زنجیره‌های ری‌ورک لاب دیجیتال (chain_root / chain_depth) با یک CTE بازگشتی.
+برای ترمیم بعد از ویرایش‌های مستقیم در DB یا UPDATEهای گروهی روی related_to.
+
+مثال:
+    python manage.py rebuild_digital_lab_chains
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import DigitalLabTransfer
+from core.utils.dl_chains import rebuild_all_chains
+
+
+class Command(BaseCommand):
+    help = "بازسازی chain_root/chain_depth همهٔ ارسال‌های لاب دیجیتال"
+
+    def handle(self, *args, **opts):
+        updated = rebuild_all_chains()
+        if updated is None:
+            updated = DigitalLabTransfer.objects.filter(chain_root__isnull=False).count()
+        orphans = DigitalLabTransfer.objects.filter(chain_root__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(f"زنجیرهٔ {updated} ردیف بازسازی شد."))
+        if orphans:
+            # ردیف‌هایی که به هیچ ریشه‌ای نمی‌رسند (related_to دوری)
+            self.stdout.write(self.style.WARNING(f"{orphans} ردیف بدون ریشه (زنجیرهٔ دوری؟)"))
@@ -0,0 +1,21 @@
+"""
+بازسازی برچسب محصول لاگ‌های دستمزد (StageWorkLog.product_code / product_name) با سه UPDATE.
+سیگنال‌ها تغییر Product / StageTemplate.product / Order.order_type را خودشان پوشش می‌دهند؛
+این دستور برای بعد از UPDATEهای گروهی (queryset.update) یا ویرایش مستقیم DB است.
+
+مثال:
+    python manage.py rebuild_worklog_products
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import StageWorkLog
+from core.utils.worklog_products import refresh_worklog_products
+
+
+class Command(BaseCommand):
+    help = "بازسازی برچسب محصول همهٔ لاگ‌های دستمزد"
+
+    def handle(self, *args, **opts):
+        refresh_worklog_products()
+        total = StageWorkLog.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"برچسب محصول {total} لاگ بازسازی شد."))
@@ -0,0 +1,33 @@
+"""
+تازه‌سازی snapshot گزارش‌گیری (DATABASES['reporting']) از DB اصلی با API پشتیبان‌گیری آنلاین SQLite.
+
+برای اجرای دوره‌ای (cron / Task Scheduler)، مثلاً هر ۱۰ دقیقه؛ نوشتن ایستگاه‌ها در حین کپی متوقف نمی‌شود.
+
+مثال:
+    python manage.py refresh_reporting_db
+    python manage.py refresh_reporting_db --if-older-than 300
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils.reporting_db import refresh_snapshot, snapshot_age
+
+
+class Command(BaseCommand):
+    help = "تازه‌سازی کپی گزارش‌گیری DB (SQLite backup API)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--if-older-than", type=int, default=0,
+                            help="فقط اگر snapshot از این تعداد ثانیه کهنه‌تر است")
+
+    def handle(self, *args, **opts):
+        age = snapshot_age()
+        if opts["if_older_than"] and age is not None and age < opts["if_older_than"]:
+            self.stdout.write(f"snapshot تازه است ({age:.0f} ثانیه)؛ کاری انجام نشد.")
+            return
+        try:
+            info = refresh_snapshot()
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"snapshot در {info['seconds']:.2f} ثانیه نوشته شد ({info['bytes'] / 1048576:.1f}MB): {info['path']}"
+        ))
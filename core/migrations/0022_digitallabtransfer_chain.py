@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_chains(apps, schema_editor):
+    """ریشه/عمق همهٔ نوبت‌های موجود با یک CTE بازگشتی (هم‌ارز rebuild_all_chains)."""
+    Transfer = apps.get_model('core', 'DigitalLabTransfer')
+    qn = schema_editor.connection.ops.quote_name
+    t = qn(Transfer._meta.db_table)
+    sql = f"""
+        WITH RECURSIVE chain(id, root_id, depth) AS (
+            SELECT id, id, 0 FROM {t} WHERE related_to_id IS NULL
+            UNION ALL
+            SELECT t.id, c.root_id, c.depth + 1
+              FROM {t} t JOIN chain c ON t.related_to_id = c.id
+             WHERE c.depth < 500
+        )
+        UPDATE {t}
+           SET chain_root_id = (SELECT c.root_id FROM chain c WHERE c.id = {t}.id),
+               chain_depth   = (SELECT c.depth   FROM chain c WHERE c.id = {t}.id)
+         WHERE id IN (SELECT id FROM chain)
+    """
+    with schema_editor.connection.cursor() as cur:
+        cur.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digitallabtransfer',
+            name='chain_depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='عمق در زنجیره'),
+        ),
+        migrations.AddField(
+            model_name='digitallabtransfer',
+            name='chain_root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chain_members', to='core.digitallabtransfer', verbose_name='ریشهٔ زنجیرهٔ ری\u200cورک'),
+        ),
+        migrations.AddIndex(
+            model_name='digitallabtransfer',
+            index=models.Index(fields=['chain_root', 'chain_depth'], name='core_digita_chain_r_49e0ea_idx'),
+        ),
+        migrations.RunPython(backfill_chains, migrations.RunPython.noop),
+    ]
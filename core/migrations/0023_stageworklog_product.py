@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_product(apps, schema_editor):
+    """برچسب محصول لاگ‌های موجود با دو UPDATE (مرحلهٔ مرجع‌دار / بدون مرحلهٔ مرجع)."""
+    StageWorkLog = apps.get_model('core', 'StageWorkLog')
+    StageTemplate = apps.get_model('core', 'StageTemplate')
+    Order = apps.get_model('core', 'Order')
+    Product = apps.get_model('core', 'Product')
+
+    tpl = StageTemplate.objects.filter(pk=OuterRef('stage_tpl_id'))
+    StageWorkLog.objects.filter(stage_tpl__isnull=False).update(
+        product_code=Subquery(tpl.values('product__code')[:1]),
+        product_name=Subquery(tpl.values('product__name')[:1]),
+    )
+
+    order_type = Order.objects.filter(pk=OuterRef('order_id')).values('order_type')[:1]
+    StageWorkLog.objects.filter(stage_tpl__isnull=True).update(
+        product_code=Coalesce(Subquery(order_type), models.Value('')),
+    )
+    prod_name = Product.objects.filter(code=OuterRef('product_code')).values('name')[:1]
+    StageWorkLog.objects.filter(stage_tpl__isnull=True).exclude(product_code='').update(
+        product_name=Coalesce(Subquery(prod_name), 'product_code'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_digitallabtransfer_chain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stageworklog',
+            name='product_code',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=60, verbose_name='کد محصول'),
+        ),
+        migrations.AddField(
+            model_name='stageworklog',
+            name='product_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=120, verbose_name='نام محصول'),
+        ),
+        migrations.AddIndex(
+            model_name='stageworklog',
+            index=models.Index(fields=['product_code', 'finished_at'], name='core_stagew_product_1200ef_idx'),
+        ),
+        migrations.RunPython(backfill_product, migrations.RunPython.noop),
+    ]
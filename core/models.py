@@ -66,9 +66,12 @@ class Order(models.Model):
     due_date      = jmodels.jDateField(null=True, blank=True)
     notes         = models.TextField(blank=True, null=True)
     teeth_fdi = models.CharField("کدهای FDI", max_length=128, blank=True, default="")
-    created_at    = models.DateTimeField(auto_now_add=True)
+    # ایندکس برای مرتب‌سازی پیش‌فرض لیست ادمین (-created_at) با LIMIT، بدون sort کل جدول
+    created_at    = models.DateTimeField(auto_now_add=True, db_index=True)
     # داخل مدل Order:
     shipped_date = jmodels.jDateField(null=True, blank=True, verbose_name="تاریخ ارسال (واقعی)")
+    # نسخهٔ ردیف برای ETag/Last-Modified در APIهای lookup (UPDATEهای گروهی باید خودشان ست کنند)
+    updated_at   = models.DateTimeField(auto_now=True, db_index=True)
 
 
     # 🆕 فیلد محاسبه‌ای برای قیمت کل سفارش
@@ -531,6 +534,12 @@ class StageWorkLog(models.Model):
         verbose_name="تاریخ تسویه"
     )
     note   = models.CharField(max_length=200, blank=True, default="", verbose_name="توضیح")
+    # محصول (denormalized هنگام ذخیره) برای فیلتر/گروه‌بندی گزارش دستمزد روی یک ستون ایندکس‌دار:
+    # کُد محصول مرحلهٔ مرجع، وگرنه order.order_type
+    product_code = models.CharField(max_length=60, blank=True, default="", db_index=True, editable=False,
+                                    verbose_name="کد محصول")
+    product_name = models.CharField(max_length=120, blank=True, default="", editable=False,
+                                    verbose_name="نام محصول")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -541,6 +550,7 @@ class StageWorkLog(models.Model):
             models.Index(fields=['order']),
             models.Index(fields=['stage_tpl']),
             models.Index(fields=['technician']),
+            models.Index(fields=['product_code', 'finished_at']),
         ]
 
     def __str__(self):
@@ -607,8 +617,32 @@ class StageWorkLog(models.Model):
         u = Decimal(str(self.unit_wage or 0))
         self.total_wage = (q * u)
 
+        # برچسب محصول برای گزارش‌ها
+        self.product_code, self.product_name = self._resolve_product()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'product_code', 'product_name'}
+
         super().save(*args, **kwargs)
 
+    def _resolve_product(self):
+        """(کد، نام) محصول: از stage_tpl.product؛ وگرنه order_type سفارش (و نام Product هم‌کُد اگر بود)."""
+        try:
+            if self.stage_tpl_id and self.stage_tpl.product_id:
+                p = self.stage_tpl.product
+                return p.code or "", p.name or ""
+        except Exception:
+            pass
+        code = ""
+        try:
+            code = (self.order.order_type or "").strip() if self.order_id else ""
+        except Exception:
+            code = ""
+        if not code:
+            return "", ""
+        name = Product.objects.filter(code=code).values_list('name', flat=True).first()
+        return code, (name or code)
+
 # =====================[ Digital Lab Transfers ]=====================
 class DigitalLabTransfer(models.Model):
     """
@@ -644,6 +678,13 @@ class DigitalLabTransfer(models.Model):
         'self', null=True, blank=True, on_delete=models.SET_NULL,
         related_name='redo_children', verbose_name="مرتبط با نوبت قبلی"
     )
+    # زنجیرهٔ ری‌ورک (مادی‌شده): ریشهٔ زنجیره و عمق این نوبت در آن (ریشه = 0)
+    # در save نگه داشته می‌شود؛ بازسازی کامل: python manage.py rebuild_digital_lab_chains
+    chain_root = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL, editable=False,
+        related_name='chain_members', verbose_name="ریشهٔ زنجیرهٔ ری‌ورک"
+    )
+    chain_depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="عمق در زنجیره")
 
     # --- مبالغ این نوبت ---
     # توجه: فعلاً cost را نگه می‌داریم تا Data Migration انجام شود (بعداً حذف می‌شود)
@@ -661,6 +702,7 @@ class DigitalLabTransfer(models.Model):
             models.Index(fields=['sent_date']),
             models.Index(fields=['status']),
             models.Index(fields=['attempt_no']),
+            models.Index(fields=['chain_root', 'chain_depth']),
         ]
         ordering = ['-sent_date', '-id']
         verbose_name = "ارسال به لاب دیجیتال"
@@ -701,8 +743,34 @@ class DigitalLabTransfer(models.Model):
             if not self.is_redo:
                 self.is_redo = True
 
+        # --- زنجیره: ریشه/عمق از روی والد ---
+        prev = None
+        if self.pk:
+            prev = (DigitalLabTransfer.objects.filter(pk=self.pk)
+                    .values('related_to_id', 'chain_root_id', 'chain_depth').first())
+        if self.related_to_id and self.related_to_id != self.pk:
+            parent = self.related_to
+            self.chain_root_id = parent.chain_root_id or parent.pk
+            self.chain_depth = int(parent.chain_depth or 0) + 1
+        else:
+            self.chain_root_id = self.pk  # برای رکورد جدید بعد از insert ست می‌شود
+            self.chain_depth = 0
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'attempt_no', 'is_redo', 'chain_root', 'chain_depth'}
+
         super().save(*args, **kwargs)
 
+        if self.chain_root_id is None:
+            self.chain_root_id = self.pk
+            DigitalLabTransfer.objects.filter(pk=self.pk).update(chain_root_id=self.pk)
+
+        # اگر جای این نوبت در زنجیره عوض شد، نوادگانش هم باید جابه‌جا شوند (CTE بازگشتی)
+        if prev and (prev['chain_root_id'], prev['chain_depth']) != (self.chain_root_id, self.chain_depth):
+            from core.utils.dl_chains import rebuild_subtree
+            rebuild_subtree(self.pk, self.chain_root_id, self.chain_depth)
+
     
     def __str__(self):
         return f"{self.order_id} • {self.lab_name} • {self.stage_name} • Attempt#{self.attempt_no} • {self.sent_date}"
@@ -713,3 +781,87 @@ class DigitalLabTransfer(models.Model):
 
 
 
+
+
+# ===== NEW: نگه‌داشت زنجیرهٔ ری‌ورک هنگام حذف یک نوبت =====
+from django.db.models.signals import pre_delete, pre_save, post_delete, post_save
+from django.dispatch import receiver
+
+
+@receiver(pre_delete, sender=DigitalLabTransfer)
+def _dl_remember_children(sender, instance, **kwargs):
+    # بعد از حذف، related_to فرزندان با SET_NULL پاک می‌شود؛ پس فهرستشان را از قبل نگه می‌داریم
+    instance._chain_children = list(instance.redo_children.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=DigitalLabTransfer)
+def _dl_rebuild_orphaned_chains(sender, instance, **kwargs):
+    from core.utils.dl_chains import rebuild_subtree
+    for child_id in getattr(instance, '_chain_children', ()):
+        # هر فرزند حالا ریشهٔ زنجیرهٔ خودش است
+        rebuild_subtree(child_id, child_id, 0)
+
+
+# ===== NEW: هم‌گام‌سازی برچسب محصول denormalized در لاگ‌های دستمزد =====
+# منبع برچسب (core/utils/worklog_products.py): محصول مرحلهٔ مرجع، وگرنه order_type سفارش.
+# pre_save مقدار قبلی را نگه می‌دارد و post_save فقط اگر واقعاً عوض شده بود لاگ‌های درگیر را بازسازی می‌کند.
+
+
+def _previous(sender, instance, *fields):
+    if not instance.pk:
+        return None
+    return sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(pre_save, sender=Product)
+def _product_remember_label(sender, instance, raw=False, **kwargs):
+    instance._wl_prev = None if raw else _previous(sender, instance, 'code', 'name')
+
+
+@receiver(post_save, sender=Product)
+def _sync_worklog_product_on_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    prev = getattr(instance, '_wl_prev', None)
+    if prev and (prev['code'], prev['name']) == (instance.code, instance.name):
+        return
+    from core.utils.worklog_products import refresh_worklog_products
+    # لاگ‌های مراحل این محصول + لاگ‌هایی که برچسبشان از order_type (کُد قدیم/جدید) آمده
+    codes = {instance.code} | ({prev['code']} if prev else set())
+    refresh_worklog_products(StageWorkLog.objects.filter(
+        models.Q(stage_tpl__product=instance) | models.Q(product_code__in=codes)))
+
+
+@receiver(post_delete, sender=Product)
+def _sync_worklog_product_on_product_delete(sender, instance, **kwargs):
+    # لاگ‌های بدون مرحلهٔ مرجع با این کُد: نام به خود کُد برمی‌گردد
+    from core.utils.worklog_products import refresh_worklog_products
+    refresh_worklog_products(StageWorkLog.objects.filter(product_code=instance.code))
+
+
+@receiver(pre_save, sender=StageTemplate)
+def _stage_tpl_remember_product(sender, instance, raw=False, **kwargs):
+    instance._wl_prev = None if raw else _previous(sender, instance, 'product_id')
+
+
+@receiver(post_save, sender=StageTemplate)
+def _sync_worklog_product_on_stage_tpl(sender, instance, created, raw=False, **kwargs):
+    prev = getattr(instance, '_wl_prev', None)
+    if raw or created or not prev or prev['product_id'] == instance.product_id:
+        return
+    from core.utils.worklog_products import refresh_worklog_products
+    refresh_worklog_products(StageWorkLog.objects.filter(stage_tpl=instance))
+
+
+@receiver(pre_save, sender=Order)
+def _order_remember_type(sender, instance, raw=False, **kwargs):
+    instance._wl_prev = None if raw else _previous(sender, instance, 'order_type')
+
+
+@receiver(post_save, sender=Order)
+def _sync_worklog_product_on_order(sender, instance, created, raw=False, **kwargs):
+    prev = getattr(instance, '_wl_prev', None)
+    if raw or created or not prev or prev['order_type'] == instance.order_type:
+        return
+    from core.utils.worklog_products import refresh_worklog_products
+    refresh_worklog_products(StageWorkLog.objects.filter(order_id=instance.pk))
@@ -1,17 +1,9 @@
 # core/templatetags/num_extras.py
 from django import template
-from decimal import Decimal, InvalidOperation
 
-register = template.Library()
-
-# نگاشت ارقام فارسی/عربی به انگلیسی + حذف جداکننده‌های قبلی
-TRANS = str.maketrans({
-    "۰":"0","۱":"1","۲":"2","۳":"3","۴":"4","۵":"5","۶":"6","۷":"7","۸":"8","۹":"9",
-    "٠":"0","١":"1","٢":"2","٣":"3","٤":"4","٥":"5","٦":"6","٧":"7","٨":"8","٩":"9",
-    ",":"", "٬":"", " " : ""
-})
+from core.utils.fa_numbers import FA_DIGITS, TO_ASCII as TRANS, format_money_fa, to_int
 
-FA_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+register = template.Library()
 
 def _normalize_num(value) -> str:
     if value is None:
@@ -20,14 +12,10 @@ def _normalize_num(value) -> str:
 
 @register.filter(name="commas")
 def commas(value):
-    s = _normalize_num(value)
-    if s == "":
-        return ""
-    try:
-        n_int = int(Decimal(s))
-        return f"{n_int:,}"
-    except (InvalidOperation, ValueError, TypeError):
-        return value
+    n = to_int(value)
+    if n is None:
+        return "" if _normalize_num(value) == "" else value
+    return f"{n:,}"
 
 @register.filter(name="commas_fa")
 def commas_fa(value):
@@ -49,8 +37,9 @@ def money_fa(value):
     """
     قالب نهاییِ نمایشی: جداکننده فارسی + رقم‌های فارسی.
     مثال: 1234567 -> ۱٬۲۳۴٬۵۶۷
+    (یک گذر + کش؛ core/utils/fa_numbers.py — هم‌ارز digits_fa(commas_fa(value)))
     """
-    return digits_fa(commas_fa(value))
+    return format_money_fa(value)
 @register.filter(name="dash_to_slash")
 def dash_to_slash(value):
     """همه '-' ها را به '/' تبدیل می‌کند (برای تاریخ‌هایی مثل 1404-07-04)."""
@@ -58,31 +47,23 @@ def dash_to_slash(value):
         return ""
     return str(value).replace("-", "/")
 
-# --- Jalali helpers (نمایش تاریخ‌ها به شمسی با اسلش و ارقام فارسی) ---
-try:
-    import jdatetime
-except ImportError:
-    jdatetime = None
-
+# --- Jalali helpers (نمایش تاریخ‌ها به شمسی با اسلش و ارقام فارسی؛ کش روزها در core/utils/jalali.py) ---
+import jdatetime
 from datetime import datetime, date as _date
 
+from core.utils.jalali import jalali_str, to_jalali_datetime
+
 def _to_jdatetime(val):
     """datetime/date میلادی → jdatetime (برای نمایش شمسی)."""
-    if val is None or jdatetime is None:
-        return None
-    if isinstance(val, datetime):
-        return jdatetime.datetime.fromgregorian(datetime=val)
-    if isinstance(val, _date):
-        return jdatetime.date.fromgregorian(date=val)
+    if isinstance(val, (_date, jdatetime.date)):
+        return to_jalali_datetime(val)
     return None
 
 @register.filter(name="jalali_date")
 def jalali_date(value):
-    """YYYY/MM/DD با ارقام فارسی (در نبود jdatetime هم خروجی می‌دهد)"""
-    jd = _to_jdatetime(value)
-    if jd:
-        s = jd.strftime("%Y/%m/%d")
-        return s.translate(FA_DIGITS)
+    """YYYY/MM/DD با ارقام فارسی"""
+    if isinstance(value, (_date, jdatetime.date)):
+        return jalali_str(value, fa_digits=True)
     # fallback: اگر مقدار رشته/تاریخ خام بود
     if value is None:
         return ""
@@ -107,12 +88,10 @@ def jalali_datetime(value):
 @register.filter(name="int_fa")
 def int_fa(value):
     """عدد صحیح با جداکنندهٔ هزار فارسی و ارقام فارسی"""
-    try:
-        n = int(Decimal(_normalize_num(value)))
-        # جداکنندهٔ هزار فارسی (٬) + ارقام فارسی
-        return f"{n:,}".replace(",", "٬").translate(FA_DIGITS)
-    except Exception:
+    if to_int(value) is None:
         return digits_fa(value)
+    # جداکنندهٔ هزار فارسی (٬) + ارقام فارسی
+    return format_money_fa(value)
 
 
 
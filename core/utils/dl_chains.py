@@ -0,0 +1,114 @@
+# core/utils/dl_chains.py
+# زنجیره‌های ری‌ورک لاب دیجیتال (DigitalLabTransfer.related_to → chain_root / chain_depth)
+#
+# - chain_root / chain_depth در DigitalLabTransfer.save نگه داشته می‌شوند؛ این ماژول فقط
+#   بازسازی گروهی (CTE بازگشتی، یک UPDATE) و گزارش‌های گروه‌بندی‌شده روی همین ستون‌ها را دارد.
+# - WITH RECURSIVE هم در SQLite و هم در PostgreSQL پشتیبانی می‌شود.
+# - سقف عمق (MAX_DEPTH) جلوی حلقه‌های خراب (related_to دوری) را می‌گیرد.
+
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+MAX_DEPTH = 500
+_DEC = DecimalField(max_digits=18, decimal_places=2)
+
+
+def _table():
+    from core.models import DigitalLabTransfer
+    return connection.ops.quote_name(DigitalLabTransfer._meta.db_table)
+
+
+def _run_cte(seed_sql, seed_params):
+    """
+    seed_sql باید ستون‌های (id, root_id, depth) بدهد؛ کل زیردرخت زیر seedها با یک UPDATE اصلاح می‌شود.
+    خروجی: تعداد ردیف‌های به‌روزشده (یا None اگر درایور تعداد را برای WITH ... UPDATE ندهد؛ مثل SQLite).
+    """
+    t = _table()
+    sql = f"""
+        WITH RECURSIVE chain(id, root_id, depth) AS (
+            {seed_sql}
+            UNION ALL
+            SELECT t.id, c.root_id, c.depth + 1
+              FROM {t} t JOIN chain c ON t.related_to_id = c.id
+             WHERE c.depth < {MAX_DEPTH}
+        )
+        UPDATE {t}
+           SET chain_root_id = (SELECT c.root_id FROM chain c WHERE c.id = {t}.id),
+               chain_depth   = (SELECT c.depth   FROM chain c WHERE c.id = {t}.id)
+         WHERE id IN (SELECT id FROM chain)
+    """
+    with connection.cursor() as cur:
+        cur.execute(sql, seed_params)
+        return cur.rowcount if cur.rowcount >= 0 else None
+
+
+def rebuild_subtree(node_id, root_id, depth) -> int:
+    """node و همهٔ نوادگانش را زیر root_id با عمق شروع depth قرار می‌دهد."""
+    return _run_cte("SELECT %s, %s, %s", [node_id, root_id, depth])
+
+
+@transaction.atomic
+def rebuild_all_chains() -> int:
+    """بک‌فیل/ترمیم کامل: از همهٔ ریشه‌ها (related_to خالی) شروع می‌کند."""
+    t = _table()
+    return _run_cte(f"SELECT id, id, 0 FROM {t} WHERE related_to_id IS NULL", [])
+
+
+# ---------- گزارش‌های گروه‌بندی‌شده (بدون پیمایش پایتونی) ----------
+def chain_costs(qs):
+    """به ازای هر زنجیره: تعداد نوبت، عمق، جمع charge/credit/net (نوبت اول و ری‌ورک‌ها جدا)."""
+    zero = Value(Decimal("0.00"), output_field=_DEC)
+    return (
+        qs.order_by()
+        .values("chain_root_id")
+        .annotate(
+            attempts=Count("id"),
+            depth=Max("chain_depth"),
+            order_id=Min("order_id"),
+            charge=Coalesce(Sum("charge_amount"), zero, output_field=_DEC),
+            credit=Coalesce(Sum("credit_amount"), zero, output_field=_DEC),
+            rework_charge=Coalesce(Sum("charge_amount", filter=Q(chain_depth__gt=0)), zero, output_field=_DEC),
+        )
+        .order_by("-depth", "-charge")
+    )
+
+
+def redo_counts(qs, by=("lab_name", "stage_name")):
+    """تعداد زنجیره‌ها، ری‌ورک‌ها و بیشینهٔ عمق به تفکیک by (پیش‌فرض: لاب × مرحله)."""
+    return (
+        qs.order_by()
+        .values(*by)
+        .annotate(
+            chains=Count("id", filter=Q(chain_depth=0)),
+            redos=Count("id", filter=Q(chain_depth__gt=0)),
+            max_depth=Max("chain_depth"),
+        )
+        .order_by("-redos", *by)
+    )
+
+
+def first_pass_yield(qs, by=("lab_name",)):
+    """
+    بازده بار اول = زنجیره‌هایی که ری‌ورک نداشتند / کل زنجیره‌ها.
+    خروجی: لیست dict با chains، clean_chains و fpy (درصد).
+    """
+    from core.models import DigitalLabTransfer
+
+    roots = qs.order_by().filter(chain_depth=0)
+    redone = DigitalLabTransfer.objects.filter(chain_depth__gt=0).values("chain_root_id")
+    rows = (
+        roots.values(*by)
+        .annotate(
+            chains=Count("id"),
+            clean_chains=Count("id", filter=~Q(id__in=redone)),
+        )
+        .order_by(*by)
+    )
+    out = []
+    for r in rows:
+        r["fpy"] = (Decimal(r["clean_chains"]) * 100 / r["chains"]).quantize(Decimal("0.1")) if r["chains"] else None
+        out.append(r)
+    return out
@@ -0,0 +1,100 @@
+# core/utils/fa_numbers.py
+# قالب‌بندی مبلغ برای نمایش: جداکنندهٔ هزار فارسی (٬) + ارقام فارسی — یک مسیر برای فیلترهای
+# قالب (num_extras)، ستون‌های ادمین و خروجی‌های Excel/PDF.
+#
+# - int/Decimal/float بدون تبدیل به رشته و parse دوباره به عدد صحیح می‌رسند (مسیر سریع)؛
+#   فقط ورودی رشته‌ای (با رقم فارسی/عربی یا جداکنندهٔ قبلی) نرمال و parse می‌شود.
+# - قالب نهایی با یک f-string و یک translate ساخته می‌شود و برای عددهای تکراری (قیمت‌های
+#   واحد، صفرها، جمع‌های ماهانه) در lru_cache می‌ماند.
+# - رفتار همان فیلترهای قبلی است: اعشار بریده می‌شود (نه گرد)، None → ""، ورودی نامعتبر
+#   همان متن با ارقام فارسی.
+
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+CACHE_SIZE = 4096
+
+# نگاشت ارقام فارسی/عربی به انگلیسی + حذف جداکننده‌های قبلی
+TO_ASCII = str.maketrans({
+    "۰": "0", "۱": "1", "۲": "2", "۳": "3", "۴": "4", "۵": "5", "۶": "6", "۷": "7", "۸": "8", "۹": "9",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4", "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+    ",": "", "٬": "", " ": "",
+})
+FA_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+# ارقام + کاما در یک گذر
+FA_MONEY = str.maketrans("0123456789,", "۰۱۲۳۴۵۶۷۸۹٬")
+
+_NUMERIC = (int, Decimal, float)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _int_from_str(s: str):
+    """رشتهٔ عددی (هر رقمی) → int؛ None اگر عدد نبود."""
+    s = s.strip().translate(TO_ASCII)
+    if not s:
+        return None
+    try:
+        return int(Decimal(s))
+    except (InvalidOperation, ValueError, OverflowError):
+        return None
+
+
+def to_int(value):
+    """عدد صحیح (بریده) یا None برای خالی/نامعتبر."""
+    if value is None:
+        return None
+    if isinstance(value, _NUMERIC):
+        try:
+            return int(value)
+        except (ValueError, OverflowError):   # NaN / Infinity
+            return None
+    return _int_from_str(str(value))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _money_fa_int(n: int) -> str:
+    return f"{n:,}".translate(FA_MONEY)
+
+
+def _fallback(value) -> str:
+    if value is None:
+        return ""
+    s = str(value)
+    return s.translate(FA_MONEY) if s.strip() else ""
+
+
+def format_money_fa(value) -> str:
+    """1234567 / Decimal('1234567.80') / '1,234,567' → ۱٬۲۳۴٬۵۶۷"""
+    n = to_int(value)
+    if n is not None:
+        return _money_fa_int(n)
+    return _fallback(value)
+
+
+def format_money_fa_many(values) -> list:
+    """
+    قالب‌بندی یک ستون کامل (خروجی Excel/PDF)؛ ترتیب حفظ می‌شود.
+    مقادیر مساوی (مثلاً Decimal('5.00') و 5) خروجی یکسان دارند، پس یک dict محلی جلوی
+    تکرار کار روی ستون را می‌گیرد.
+    """
+    memo = {}
+    out = []
+    append = out.append
+    for v in values:
+        try:
+            s = memo[v]
+        except KeyError:
+            s = memo[v] = format_money_fa(v)
+        except TypeError:           # مقدار hash‌ناپذیر
+            s = format_money_fa(v)
+        append(s)
+    return out
+
+
+def cache_info() -> dict:
+    return {"int": _money_fa_int.cache_info(), "str": _int_from_str.cache_info()}
+
+
+def cache_clear() -> None:
+    _money_fa_int.cache_clear()
+    _int_from_str.cache_clear()
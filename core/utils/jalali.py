@@ -0,0 +1,178 @@
+# core/utils/jalali.py
+# تبدیل تاریخ میلادی ↔ جلالی با کش — یک مسیر برای پارسرهای ورودی فرم/کوئری‌استرینگ، فیلترهای قالب
+# و حلقه‌های گزارش (core و billing).
+#
+# - کلید کش «شمارهٔ روز» (date.toordinal) است: هر روز فقط یک بار از jdatetime رد می‌شود و بعد
+#   از lru_cache خوانده می‌شود؛ در گزارش‌ها هزاران ردیف معمولاً روی چند ده روز/ماه تکرار می‌شوند.
+# - نگاشت دوطرفه است: ordinal → jdatetime.date و (سال، ماه، روز) جلالی → ordinal.
+# - نسخه‌های دسته‌ای (*_many) برای ستون‌ها و خروجی‌ها؛ ترتیب و None ها حفظ می‌شوند.
+# - datetime های aware مثل jalali_date.datetime2jalali اول به وقت محلی برده می‌شوند.
+# - اشیای jdatetime.date برگشتی از کش مشترک‌اند؛ تغییرناپذیر فرضشان کنید (replace نسخهٔ جدید می‌دهد).
+
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+import jdatetime
+from django.utils import timezone
+
+CACHE_SIZE = 8192
+
+# ارقام فارسی/عربی → انگلیسی
+DIGIT_MAP = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+FA_DIGITS = str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")
+_JALALI_RE = re.compile(r"^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$")
+
+
+# ---------- نگاشت روز ----------
+@lru_cache(maxsize=CACHE_SIZE)
+def _jdate_of_ordinal(ordinal: int):
+    return jdatetime.date.fromgregorian(date=date.fromordinal(ordinal))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _ordinal_of_jalali(jy: int, jm: int, jd: int) -> int:
+    """ValueError برای تاریخ نامعتبر (خطاها کش نمی‌شوند)."""
+    return jdatetime.date(jy, jm, jd).togregorian().toordinal()
+
+
+def _local_date(d, tz=None):
+    """datetime (aware → وقت محلی) یا date → date میلادی."""
+    if isinstance(d, datetime):
+        if d.tzinfo is not None:
+            d = d.astimezone(tz or timezone.get_current_timezone())
+        return d.date()
+    return d
+
+
+# ---------- میلادی → جلالی ----------
+def to_jalali(d):
+    """date/datetime میلادی → jdatetime.date (None → None؛ ورودی جلالی بی‌تغییر)."""
+    if d is None or isinstance(d, jdatetime.date):
+        return d
+    return _jdate_of_ordinal(_local_date(d).toordinal())
+
+
+def to_jalali_datetime(dt):
+    """datetime میلادی → jdatetime.datetime (معادل datetime2jalali، با روز از کش)."""
+    if dt is None:
+        return None
+    if not isinstance(dt, datetime):
+        return to_jalali(dt)
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    j = _jdate_of_ordinal(dt.toordinal())
+    return jdatetime.datetime(j.year, j.month, j.day, dt.hour, dt.minute, dt.second, dt.microsecond,
+                              tzinfo=dt.tzinfo)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _jalali_str(ordinal: int, sep: str) -> str:
+    j = _jdate_of_ordinal(ordinal)
+    return f"{j.year:04d}{sep}{j.month:02d}{sep}{j.day:02d}"
+
+
+def jalali_str(d, sep: str = "/", fa_digits: bool = False) -> str:
+    """date/datetime میلادی → '1404/07/05' ('' برای None)."""
+    if d is None:
+        return ""
+    if isinstance(d, jdatetime.date):
+        s = f"{d.year:04d}{sep}{d.month:02d}{sep}{d.day:02d}"
+    else:
+        s = _jalali_str(_local_date(d).toordinal(), sep)
+    return s.translate(FA_DIGITS) if fa_digits else s
+
+
+def period_of(d) -> int:
+    """date/datetime میلادی → YYYYMM جلالی (کلید ماه در مکعب هزینه و جدول استهلاک)."""
+    j = to_jalali(d)
+    return j.year * 100 + j.month
+
+
+def jalali_ym(d):
+    """(سال، ماه) جلالی برای جمع ماهانه در حلقه‌های گزارش."""
+    j = to_jalali(d)
+    return j.year, j.month
+
+
+# ---------- جلالی → میلادی ----------
+def to_gregorian(j):
+    """jdatetime.date یا (jy, jm, jd) → datetime.date؛ ValueError برای تاریخ نامعتبر."""
+    if j is None:
+        return None
+    if isinstance(j, jdatetime.date):
+        return date.fromordinal(_ordinal_of_jalali(j.year, j.month, j.day))
+    jy, jm, jd = j
+    return date.fromordinal(_ordinal_of_jalali(int(jy), int(jm), int(jd)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_parts(raw: str):
+    s = raw.strip().translate(DIGIT_MAP)
+    m = _JALALI_RE.match(s)
+    if not m:
+        return None
+    parts = tuple(map(int, m.groups()))
+    try:
+        _ordinal_of_jalali(*parts)
+    except ValueError:
+        return None
+    return parts
+
+
+def parse_jalali(raw):
+    """'۱۴۰۴/۰۶/۱۹' / '1404-06-19' → datetime.date میلادی؛ None برای خالی/نامعتبر."""
+    if not raw:
+        return None
+    parts = _parse_parts(str(raw))
+    return date.fromordinal(_ordinal_of_jalali(*parts)) if parts else None
+
+
+def parse_jdate(raw):
+    """مثل parse_jalali ولی خروجی jdatetime.date (برای فیلتر روی jDateField)."""
+    if not raw:
+        return None
+    parts = _parse_parts(str(raw))
+    return _jdate_of_ordinal(_ordinal_of_jalali(*parts)) if parts else None
+
+
+# ---------- دسته‌ای ----------
+def to_jalali_many(dates) -> list:
+    tz = timezone.get_current_timezone()
+    return [d if d is None or isinstance(d, jdatetime.date) else _jdate_of_ordinal(_local_date(d, tz).toordinal())
+            for d in dates]
+
+
+def to_gregorian_many(jdates) -> list:
+    return [to_gregorian(j) for j in jdates]
+
+
+def jalali_str_many(dates, sep: str = "/", fa_digits: bool = False) -> list:
+    tz = timezone.get_current_timezone()
+    out = []
+    append = out.append
+    for d in dates:
+        if d is None or isinstance(d, jdatetime.date):
+            append(jalali_str(d, sep, fa_digits))
+            continue
+        s = _jalali_str(_local_date(d, tz).toordinal(), sep)
+        append(s.translate(FA_DIGITS) if fa_digits else s)
+    return out
+
+
+def parse_jalali_many(values) -> list:
+    return [parse_jalali(v) for v in values]
+
+
+def cache_info() -> dict:
+    return {
+        "g2j": _jdate_of_ordinal.cache_info(),
+        "j2g": _ordinal_of_jalali.cache_info(),
+        "str": _jalali_str.cache_info(),
+        "parse": _parse_parts.cache_info(),
+    }
+
+
+def cache_clear() -> None:
+    for fn in (_jdate_of_ordinal, _ordinal_of_jalali, _jalali_str, _parse_parts):
+        fn.cache_clear()
@@ -0,0 +1,245 @@
+# core/utils/keyset.py
+# صفحه‌بندی Keyset (Seek) برای لیست‌های بلند (کارتکس، لاب دیجیتال، سفارش‌ها، تعمیرات)
+#
+# به‌جای OFFSET/LIMIT و COUNT(*) روی کل نتیجه، مقدار کلیدهای مرتب‌سازیِ آخرین/اولین ردیف
+# صفحه در یک cursor کدگذاری می‌شود و صفحهٔ بعد/قبل با WHERE روی همان کلیدها خوانده می‌شود؛
+# پس صفحهٔ صدم همان هزینهٔ صفحهٔ اول را دارد.
+#
+# استفاده:
+#     page = KeysetPaginator(qs, ordering=("-happened_at", "-id"), per_page=50).page(request.GET)
+#     page.object_list / page.has_next / page.next_query / page.count ...
+#
+# نکته‌ها:
+#   - آخرین کلید ordering باید یکتا باشد (معمولاً id)؛ اگر نباشد خودکار اضافه می‌شود.
+#   - ستون‌های null‌پذیر باید در null_defaults مقدار جایگزین داشته باشند (Coalesce)،
+#     وگرنه مقایسهٔ WHERE روی NULL ردیف‌ها را جا می‌اندازد.
+#   - شمارش: count_mode="none" (بدون COUNT) | "capped" (COUNT تا سقف count_cap) | "exact"
+
+import base64
+import datetime
+import json
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+
+try:
+    import jdatetime
+except ImportError:  # pragma: no cover
+    jdatetime = None
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# ---------- کدگذاری مقادیر کلید ----------
+def _enc_value(v):
+    if v is None:
+        return ["z", None]
+    if jdatetime is not None and isinstance(v, jdatetime.datetime):
+        return ["jt", v.togregorian().isoformat()]
+    if jdatetime is not None and isinstance(v, jdatetime.date):
+        return ["jd", v.togregorian().isoformat()]
+    if isinstance(v, datetime.datetime):
+        return ["dt", v.isoformat()]
+    if isinstance(v, datetime.date):
+        return ["d", v.isoformat()]
+    if isinstance(v, Decimal):
+        return ["n", str(v)]
+    if isinstance(v, bool):
+        return ["b", v]
+    if isinstance(v, int):
+        return ["i", v]
+    if isinstance(v, float):
+        return ["f", v]
+    return ["s", str(v)]
+
+
+def _dec_value(pair):
+    t, v = pair
+    if t == "z":
+        return None
+    if t == "jt":
+        return jdatetime.datetime.fromgregorian(datetime=datetime.datetime.fromisoformat(v))
+    if t == "jd":
+        return jdatetime.date.fromgregorian(date=datetime.date.fromisoformat(v))
+    if t == "dt":
+        return datetime.datetime.fromisoformat(v)
+    if t == "d":
+        return datetime.date.fromisoformat(v)
+    if t == "n":
+        return Decimal(v)
+    if t in ("i", "b", "f", "s"):
+        return v
+    raise InvalidCursor(t)
+
+
+def encode_cursor(direction: str, values) -> str:
+    raw = json.dumps([direction, [_enc_value(v) for v in values]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str):
+    try:
+        pad = "=" * (-len(token) % 4)
+        direction, vals = json.loads(base64.urlsafe_b64decode(token + pad).decode("utf-8"))
+        if direction not in ("n", "p"):
+            raise InvalidCursor(direction)
+        return direction, [_dec_value(p) for p in vals]
+    except InvalidCursor:
+        raise
+    except Exception as ex:
+        raise InvalidCursor(str(ex))
+
+
+# ---------- صفحه ----------
+class KeysetPage:
+    def __init__(self, object_list, *, has_next, has_previous, next_cursor, previous_cursor,
+                 count=None, count_is_capped=False, per_page=50, params=None, cursor_param="cursor"):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_capped = count_is_capped  # True یعنی «بیش از count»
+        self.per_page = per_page
+        self._params = params
+        self._cursor_param = cursor_param
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query(self, cursor):
+        items = []
+        if self._params is not None:
+            for k in self._params.keys():
+                if k in (self._cursor_param, "page"):
+                    continue
+                for v in self._params.getlist(k) if hasattr(self._params, "getlist") else [self._params[k]]:
+                    items.append((k, v))
+        if cursor:
+            items.append((self._cursor_param, cursor))
+        return urlencode(items)
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self.has_next else ""
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self.has_previous else ""
+
+    @property
+    def first_query(self):
+        return self._query(None)
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page=50, *, cursor_param="cursor",
+                 count_mode="none", count_cap=1000, null_defaults=None):
+        ordering = list(ordering)
+        if not any(o.lstrip("-") in ("id", "pk") for o in ordering):
+            last_desc = ordering[-1].startswith("-") if ordering else True
+            ordering.append("-id" if last_desc else "id")
+        self.ordering = ordering
+        self.per_page = max(1, int(per_page))
+        self.cursor_param = cursor_param
+        self.count_mode = count_mode
+        self.count_cap = int(count_cap)
+        self.null_defaults = dict(null_defaults or {})
+
+        # کلیدهای null‌پذیر با Coalesce به یک annotation غیر null تبدیل می‌شوند
+        self._keys = []  # [(annot_name_or_field, desc)]
+        annotations = {}
+        for o in ordering:
+            desc = o.startswith("-")
+            name = o.lstrip("-")
+            if name in self.null_defaults:
+                alias = f"_ks_{name}"
+                default = self.null_defaults[name]
+                if not hasattr(default, "resolve_expression"):
+                    default = Value(default)
+                annotations[alias] = Coalesce(F(name), default)
+                name = alias
+            self._keys.append((name, desc))
+        self._base = queryset.annotate(**annotations) if annotations else queryset
+
+    def _order(self, reverse=False):
+        out = []
+        for name, desc in self._keys:
+            d = (not desc) if reverse else desc
+            out.append(("-" + name) if d else name)
+        return out
+
+    def _seek_q(self, values, forward=True):
+        """شرط لغت‌نامه‌ای: (k1 > v1) OR (k1 = v1 AND k2 > v2) ..."""
+        q = Q()
+        eq = {}
+        for (name, desc), v in zip(self._keys, values):
+            after_is_lt = desc if forward else (not desc)
+            op = "lt" if after_is_lt else "gt"
+            q |= Q(**eq, **{f"{name}__{op}": v})
+            eq[name] = v
+        return q
+
+    def _row_key(self, obj):
+        return [getattr(obj, name) for name, _ in self._keys]
+
+    def _count(self):
+        if self.count_mode == "exact":
+            return self._base.count(), False
+        if self.count_mode == "capped":
+            n = self._base.order_by()[: self.count_cap + 1].count()
+            return min(n, self.count_cap), n > self.count_cap
+        return None, False
+
+    def page(self, params=None) -> KeysetPage:
+        token = (params.get(self.cursor_param) if params is not None else None) or ""
+        direction, values = "n", None
+        if token:
+            try:
+                direction, values = decode_cursor(token)
+                if len(values) != len(self._keys):
+                    values = None
+            except InvalidCursor:
+                values = None
+        if values is None:
+            direction = "n"
+
+        n = self.per_page
+        if direction == "p":
+            qs = self._base.filter(self._seek_q(values, forward=False)).order_by(*self._order(reverse=True))
+            rows = list(qs[: n + 1])
+            has_previous = len(rows) > n
+            rows = list(reversed(rows[:n]))
+            has_next = True
+        else:
+            qs = self._base
+            if values is not None:
+                qs = qs.filter(self._seek_q(values, forward=True))
+            rows = list(qs.order_by(*self._order())[: n + 1])
+            has_next = len(rows) > n
+            rows = rows[:n]
+            has_previous = values is not None
+
+        next_cursor = encode_cursor("n", self._row_key(rows[-1])) if (rows and has_next) else None
+        prev_cursor = encode_cursor("p", self._row_key(rows[0])) if (rows and has_previous) else None
+        if not rows:
+            has_next = has_previous = False
+
+        count, capped = self._count()
+        return KeysetPage(
+            rows, has_next=has_next, has_previous=has_previous,
+            next_cursor=next_cursor, previous_cursor=prev_cursor,
+            count=count, count_is_capped=capped, per_page=n,
+            params=params, cursor_param=self.cursor_param,
+        )
@@ -0,0 +1,110 @@
+# core/utils/lab_singletons.py
+# کش سراسری (در سطح پروسه) برای رکوردهای تک‌نمونه: billing.LabProfile و core.LabSettings
+#
+# - این رکوردها تقریباً هیچ‌وقت عوض نمی‌شوند؛ پس به‌جای کوئری در هر رندر، یک‌بار خوانده و نگه داشته می‌شوند.
+# - با post_save/post_delete هر کدام از دو مدل، کش همان پروسه خالی می‌شود.
+# - چون چند worker کش جدا دارند، یک TTL کوتاه (LAB_SINGLETON_TTL، پیش‌فرض ۳۰۰ ثانیه) هم گذاشته‌ایم
+#   تا تغییرات در پروسه‌های دیگر هم دیر یا زود دیده شود.
+# - اشیای برگشتی فقط برای خواندن هستند؛ برای ویرایش (فرم‌ها) رکورد را مستقیم از DB بخوانید.
+
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+_MISSING = object()
+_lock = threading.Lock()
+_cache = {}  # key -> (expires_at, value)
+
+
+def _ttl() -> float:
+    try:
+        return float(getattr(settings, "LAB_SINGLETON_TTL", 300))
+    except Exception:
+        return 300.0
+
+
+def _cached(key, loader):
+    now = time.monotonic()
+    hit = _cache.get(key, _MISSING)
+    if hit is not _MISSING and hit[0] > now:
+        return hit[1]
+    value = loader()
+    with _lock:
+        _cache[key] = (now + _ttl(), value)
+    return value
+
+
+def invalidate_lab_singletons(*args, **kwargs):
+    """خالی‌کردن کش (به‌عنوان receiver سیگنال هم استفاده می‌شود)."""
+    with _lock:
+        _cache.clear()
+
+
+def _load_lab_profile():
+    try:
+        LabProfile = apps.get_model("billing", "LabProfile")
+        return LabProfile.objects.first()
+    except Exception:
+        return None
+
+
+def _load_lab_settings():
+    try:
+        LabSettings = apps.get_model("core", "LabSettings")
+        obj = LabSettings.objects.filter(pk=1).first()
+        # فقط اگر واقعاً وجود نداشت، همان مسیر get_or_create قبلی
+        return obj if obj is not None else LabSettings.get_solo()
+    except Exception:
+        return None
+
+
+def _load_logo_url():
+    """
+    آدرس لوگو با همان اولویت قالب‌ها:
+      ۱) فایل آپلودی LabProfile  ۲) مسیر استاتیک LabProfile  ۳) لوگوی LabSettings
+    """
+    prof = get_lab_profile()
+    if prof is not None:
+        url = prof.get_logo_url()
+        if url:
+            return url
+        if prof.logo_static_path:
+            try:
+                from django.templatetags.static import static
+                return static(prof.logo_static_path)
+            except Exception:
+                pass
+    ls = get_lab_settings()
+    if ls is not None and getattr(ls, "logo", None):
+        try:
+            return ls.logo.url
+        except Exception:
+            pass
+    return None
+
+
+def get_lab_profile():
+    """billing.LabProfile (یا None) — از کش."""
+    return _cached("lab_profile", _load_lab_profile)
+
+
+def get_lab_settings():
+    """core.LabSettings (رکورد pk=1) — از کش."""
+    return _cached("lab_settings", _load_lab_settings)
+
+
+def get_lab_logo_url():
+    """URL نهایی لوگو (یا None) — از کش."""
+    return _cached("lab_logo_url", _load_logo_url)
+
+
+def connect_signals():
+    """در CoreConfig.ready صدا زده می‌شود."""
+    for label in ("billing.LabProfile", "core.LabSettings"):
+        post_save.connect(invalidate_lab_singletons, sender=label,
+                          dispatch_uid=f"lab_singletons_save_{label}")
+        post_delete.connect(invalidate_lab_singletons, sender=label,
+                            dispatch_uid=f"lab_singletons_delete_{label}")
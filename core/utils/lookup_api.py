@@ -0,0 +1,76 @@
+# core/utils/lookup_api.py
+# لایهٔ نسخه‌دار برای APIهای lookup پنل ورود/خروج سریع (دکترها، سفارش‌های دکتر، محصولات، مراحل سفارش)
+#
+# - برای هر منبع یک «مهر نسخه» ارزان (یک aggregate: Max(updated_at) + Count + Max(id)) ساخته می‌شود.
+# - ETag = هش (منبع + مهر نسخه + پارامترهای درخواست)؛ Last-Modified = Max(updated_at).
+# - اگر If-None-Match/If-Modified-Since با نسخهٔ فعلی بخواند → 304 بدون اجرای کوئری اصلی و سریال‌سازی.
+# - پارامتر fields=id,name,... خروجی را به فیلدهای خواسته‌شده محدود می‌کند.
+# - Cache-Control: private, no-cache → مرورگر پاسخ را نگه می‌دارد ولی هر بار با ETag اعتبارسنجی می‌کند.
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+API_VERSION = "1"
+
+
+def version_stamp(qs, updated_field="updated_at"):
+    """(last_modified یا None, رشتهٔ مهر نسخه) با یک aggregate روی qs."""
+    aggs = {"n": Count("id"), "mid": Max("id")}
+    if updated_field:
+        aggs["mu"] = Max(updated_field)
+    row = qs.order_by().aggregate(**aggs)
+    mu = row.get("mu")
+    stamp = f"{row['n']}:{row['mid'] or 0}:{mu.isoformat() if mu else ''}"
+    return mu, stamp
+
+
+def parse_fields(request, allowed, default=None):
+    """fields=a,b → فقط کلیدهای مجاز؛ اگر خالی یا نامعتبر بود، default (یا همهٔ allowed)."""
+    raw = (request.GET.get("fields") or "").strip()
+    base = list(default or allowed)
+    if not raw:
+        return base
+    picked = [f.strip() for f in raw.split(",") if f.strip() in allowed]
+    return picked or base
+
+
+def project(rows, fields):
+    return [{k: r.get(k) for k in fields} for r in rows]
+
+
+def make_etag(resource, *parts, request=None):
+    h = hashlib.md5(usedforsecurity=False)
+    h.update(f"{API_VERSION}|{resource}".encode("utf-8"))
+    for p in parts:
+        h.update(b"|" + str(p).encode("utf-8"))
+    if request is not None:
+        h.update(b"|" + request.GET.urlencode().encode("utf-8"))
+    return quote_etag(h.hexdigest())
+
+
+def conditional_json(request, resource, stamps, build):
+    """
+    stamps: لیست (last_modified, stamp) از version_stamp برای منابع درگیر
+    build: تابعی که dict پاسخ را می‌سازد (فقط وقتی 304 نباشد صدا زده می‌شود)
+    """
+    last_modified = None
+    for lm, _ in stamps:
+        if lm is not None and (last_modified is None or lm > last_modified):
+            last_modified = lm
+    etag = make_etag(resource, *[s for _, s in stamps], request=request)
+    lm_ts = int(last_modified.timestamp()) if last_modified else None
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=lm_ts)
+    if not_modified is None:
+        resp = JsonResponse(build(), json_dumps_params={"ensure_ascii": False, "separators": (",", ":")})
+    else:
+        resp = not_modified
+    resp["ETag"] = etag
+    if lm_ts is not None:
+        resp["Last-Modified"] = http_date(lm_ts)
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
@@ -0,0 +1,133 @@
+# core/utils/reporting_db.py
+# اتصال «گزارش‌گیری»: خواندن گزارش‌های سنگین از یک کپی لحظه‌ای (snapshot) از DB اصلی
+#
+# - alias «reporting» در DATABASES به یک فایل SQLite جدا اشاره می‌کند که با API پشتیبان‌گیری
+#   آنلاین SQLite (sqlite3.Connection.backup) از DB اصلی پر می‌شود؛ دستور refresh_reporting_db
+#   را دوره‌ای (cron / Task Scheduler) اجرا کنید.
+# - مسیریابی صریح است: فقط کدی که داخل use_reporting_db() یا دکوراتور reporting_db اجرا شود
+#   خواندن‌هایش را از snapshot می‌گیرد. نوشتن‌ها همیشه روی default می‌روند (حتی برای اشیایی که
+#   از snapshot خوانده شده‌اند).
+# - اگر snapshot وجود نداشته باشد یا از REPORTING_DB_MAX_AGE (ثانیه، پیش‌فرض ۳۶۰۰) کهنه‌تر باشد،
+#   گزارش بی‌صدا از همان default خوانده می‌شود (درستی بر جداسازی مقدم است).
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPORTING_ALIAS = "reporting"
+_state = threading.local()
+
+
+def _max_age() -> float:
+    try:
+        return float(getattr(settings, "REPORTING_DB_MAX_AGE", 3600))
+    except Exception:
+        return 3600.0
+
+
+def _db_path(alias):
+    return str(settings.DATABASES.get(alias, {}).get("NAME") or "")
+
+
+def is_configured() -> bool:
+    cfg = settings.DATABASES.get(REPORTING_ALIAS)
+    if not cfg or "sqlite" not in cfg.get("ENGINE", ""):
+        return False
+    # در تست‌ها (MIRROR) یا اگر اشتباهاً به همان فایل اشاره کند، snapshot معنا ندارد
+    return _db_path(REPORTING_ALIAS) not in ("", ":memory:", _db_path(DEFAULT_DB_ALIAS))
+
+
+def snapshot_age():
+    """عمر snapshot به ثانیه (None اگر وجود ندارد)."""
+    path = _db_path(REPORTING_ALIAS)
+    try:
+        return max(0.0, time.time() - os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def is_fresh() -> bool:
+    if not is_configured():
+        return False
+    age = snapshot_age()
+    return age is not None and age <= _max_age()
+
+
+def active_alias() -> str:
+    """alias خواندنی که کد فعلی روی آن است (برای .using() در خروجی‌های جریانی که بعد از view اجرا می‌شوند)."""
+    return REPORTING_ALIAS if getattr(_state, "depth", 0) and getattr(_state, "fresh", False) else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_reporting_db():
+    """خواندن‌های داخل این بلوک از snapshot (در صورت تازه بودن)."""
+    depth = getattr(_state, "depth", 0)
+    if depth == 0:
+        _state.fresh = is_fresh()
+    _state.depth = depth + 1
+    try:
+        yield active_alias()
+    finally:
+        _state.depth = depth
+
+
+def reporting_db(view_func):
+    """دکوراتور view (برای CBV: method_decorator(reporting_db, name='dispatch'))."""
+    @wraps(view_func)
+    def _wrapped(*args, **kwargs):
+        with use_reporting_db():
+            return view_func(*args, **kwargs)
+    return _wrapped
+
+
+class ReportingRouter:
+    """DATABASE_ROUTERS: خواندن داخل use_reporting_db → reporting؛ نوشتن همیشه default."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, "depth", 0) and getattr(_state, "fresh", False):
+            return REPORTING_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # snapshot کپی همان DB است؛ رابطه بین اشیای دو alias مجاز است
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # schema با خود snapshot می‌آید
+        if db == REPORTING_ALIAS:
+            return False
+        return None
+
+
+def refresh_snapshot(pages: int = -1) -> dict:
+    """
+    کپی آنلاین DB اصلی در فایل reporting با API پشتیبان‌گیری SQLite.
+    pages=-1 یعنی یک مرحله (در WAL فقط قفل خواندن روی منبع؛ نویسنده‌ها منتظر نمی‌مانند).
+    """
+    if not is_configured():
+        raise RuntimeError("DATABASES['reporting'] (SQLite و جدا از default) تعریف نشده است.")
+    src_path, dst_path = _db_path(DEFAULT_DB_ALIAS), _db_path(REPORTING_ALIAS)
+    t0 = time.perf_counter()
+    src = sqlite3.connect(src_path, timeout=30)
+    dst = sqlite3.connect(dst_path, timeout=30)
+    try:
+        src.backup(dst, pages=pages)
+    finally:
+        dst.close()
+        src.close()
+    # اتصال‌های ماندگار همین پروسه روی snapshot قبلی را ببندیم تا از وضعیت تازه بخوانند
+    try:
+        connections[REPORTING_ALIAS].close()
+    except Exception:
+        pass
+    os.utime(dst_path, None)
+    return {"path": dst_path, "bytes": os.path.getsize(dst_path), "seconds": time.perf_counter() - t0}
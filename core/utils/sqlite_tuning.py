@@ -0,0 +1,59 @@
+# core/utils/sqlite_tuning.py
+# تنظیمات PRAGMA برای SQLite در محیط چندکاربره (چند ایستگاه هم‌زمان روی یک فایل DB)
+#
+# - journal_mode=WAL: خواننده‌ها نویسنده را قفل نمی‌کنند و برعکس (فقط یک نویسنده در لحظه).
+# - synchronous=NORMAL: در WAL امن است (فقط آخرین تراکنش‌ها در قطع برق ممکن است برگردند) و fsync کمتر.
+# - busy_timeout: به‌جای خطای فوری «database is locked»، تا این مدت منتظر آزاد شدن قفل می‌ماند.
+# - mmap_size / cache_size / temp_store: خواندن از حافظه و مرتب‌سازی‌های موقت در RAM.
+# با سیگنال connection_created روی هر اتصال جدید اعمال می‌شود (CONN_MAX_AGE اتصال‌ها را نگه می‌دارد،
+# پس این هزینه برای هر درخواست تکرار نمی‌شود). با SQLITE_PRAGMAS در settings قابل تغییر است.
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 20000,          # میلی‌ثانیه
+    "mmap_size": 268435456,         # 256MB
+    "cache_size": -64000,           # منفی = کیلوبایت (≈ 64MB)
+    "temp_store": "MEMORY",
+}
+
+
+def get_pragmas(alias=None) -> dict:
+    """PRAGMAهای مؤثر: پیش‌فرض‌ها + SQLITE_PRAGMAS + SQLITE_PRAGMAS_BY_ALIAS[alias]؛ مقدار None یعنی حذف."""
+    pragmas = dict(DEFAULT_PRAGMAS)
+    pragmas.update(getattr(settings, "SQLITE_PRAGMAS", None) or {})
+    if alias:
+        pragmas.update((getattr(settings, "SQLITE_PRAGMAS_BY_ALIAS", None) or {}).get(alias, {}))
+    return {k: v for k, v in pragmas.items() if v is not None}
+
+
+def apply_pragmas(cursor, pragmas) -> None:
+    """روی هر cursor سازگار با DB-API (هم اتصال جنگو و هم sqlite3 خام، مثلاً در بنچمارک)."""
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = get_pragmas(connection.alias)
+    if connection.settings_dict.get("NAME") in (":memory:", "") or "mode=memory" in str(
+        connection.settings_dict.get("NAME", "")
+    ):
+        # DB حافظه‌ای (تست‌ها): WAL/mmap معنا ندارد
+        pragmas.pop("journal_mode", None)
+        pragmas.pop("mmap_size", None)
+    try:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
+    except Exception:
+        # مثلاً فایل فقط‌خواندنی؛ اتصال بدون تنظیمات ادامه می‌دهد
+        pass
+
+
+def connect_signals():
+    """در CoreConfig.ready صدا زده می‌شود."""
+    connection_created.connect(_on_connection_created, dispatch_uid="core_sqlite_pragmas")
@@ -0,0 +1,137 @@
+# core/utils/stage_seeding.py
+# ساخت StageInstanceهای سفارش از روی StageTemplateهای محصول (Product.code == Order.order_type)
+#
+# - «پلن» هر محصول (لیست مرتب templateها + فاصلهٔ تجمعی روزها) یک‌بار خوانده و در حافظهٔ پروسه
+#   نگه داشته می‌شود؛ با post_save/post_delete روی StageTemplate و Product خالی می‌شود.
+# - seed_many(orders): برای صدها سفارش (ایمپورت/بک‌فیل) همهٔ مراحل را با یک bulk_create می‌سازد؛
+#   سفارش‌هایی که از قبل مرحله دارند با یک کوئری کنار گذاشته می‌شوند.
+# - تاریخ برنامه = مبنا (order_date یا امروز جلالی) + روزهای تجمعی؛ مستقیم روی jdatetime.date
+#   (بدون رفت‌وبرگشت میلادی برای هر مرحله).
+
+import datetime
+import threading
+from collections import namedtuple
+
+from django.db.models.signals import post_save, post_delete
+
+try:
+    import jdatetime
+except ImportError:  # pragma: no cover
+    jdatetime = None
+
+PlanStep = namedtuple("PlanStep", "template_id key label order_index offset_days")
+
+_lock = threading.Lock()
+_plans = {}  # product_code -> tuple[PlanStep, ...] (خالی یعنی محصول/مرحله‌ای ندارد)
+
+
+def invalidate_stage_plans(*args, **kwargs):
+    """خالی‌کردن کش پلن‌ها (به‌عنوان receiver سیگنال هم استفاده می‌شود)."""
+    with _lock:
+        _plans.clear()
+
+
+def _load_plans(codes):
+    from core.models import StageTemplate
+
+    found = {c: [] for c in codes}
+    qs = (
+        StageTemplate.objects
+        .filter(product__code__in=codes, product__is_active=True, is_active=True)
+        .order_by("product__code", "order_index")
+        .values_list("product__code", "id", "key", "label", "order_index", "default_duration_days")
+    )
+    acc = {}
+    for code, tid, key, label, idx, dur in qs:
+        acc[code] = acc.get(code, 0) + int(dur or 0)
+        found[code].append(PlanStep(tid, key, label, idx, acc[code]))
+    return {c: tuple(steps) for c, steps in found.items()}
+
+
+def get_plans(codes):
+    """{product_code: (PlanStep, ...)} برای کدهای خواسته‌شده — از کش، کمبودها با یک کوئری."""
+    codes = {(c or "").strip() for c in codes} - {""}
+    missing = [c for c in codes if c not in _plans]
+    if missing:
+        loaded = _load_plans(missing)
+        with _lock:
+            _plans.update(loaded)
+    return {c: _plans.get(c, ()) for c in codes}
+
+
+def get_plan(code):
+    return get_plans([code]).get((code or "").strip(), ())
+
+
+def _base_date(order):
+    if jdatetime is None:
+        return None
+    base = order.order_date
+    if isinstance(base, jdatetime.date):
+        return base
+    return jdatetime.date.today()
+
+
+def build_instances(order, plan):
+    """StageInstanceهای ذخیره‌نشدهٔ یک سفارش از روی پلن."""
+    from core.models import StageInstance
+
+    base = _base_date(order)
+    out = []
+    for step in plan:
+        planned = (base + datetime.timedelta(days=step.offset_days)) if base is not None else None
+        out.append(StageInstance(
+            order=order,
+            template_id=step.template_id,
+            key=step.key,
+            label=step.label,
+            order_index=step.order_index,
+            planned_date=planned,
+            status=StageInstance.Status.PENDING,
+        ))
+    return out
+
+
+def seed_many(orders, batch_size=500) -> int:
+    """
+    برای سفارش‌هایی که هنوز StageInstance ندارند، مراحل را می‌سازد.
+    خروجی: تعداد StageInstanceهای ساخته‌شده.
+    """
+    from core.models import StageInstance
+
+    orders = [o for o in orders if o.pk and (o.order_type or "").strip()]
+    if not orders:
+        return 0
+
+    seeded = set(
+        StageInstance.objects
+        .filter(order_id__in=[o.pk for o in orders])
+        .values_list("order_id", flat=True)
+        .distinct()
+    )
+    todo = [o for o in orders if o.pk not in seeded]
+    if not todo:
+        return 0
+
+    plans = get_plans(o.order_type for o in todo)
+    instances = []
+    for o in todo:
+        plan = plans.get(o.order_type.strip())
+        if plan:
+            instances.extend(build_instances(o, plan))
+    if instances:
+        StageInstance.objects.bulk_create(instances, batch_size=batch_size)
+    return len(instances)
+
+
+def seed_order(order) -> int:
+    return seed_many([order])
+
+
+def connect_signals():
+    """در CoreConfig.ready صدا زده می‌شود."""
+    for label in ("core.StageTemplate", "core.Product"):
+        post_save.connect(invalidate_stage_plans, sender=label,
+                          dispatch_uid=f"stage_plans_save_{label}")
+        post_delete.connect(invalidate_stage_plans, sender=label,
+                            dispatch_uid=f"stage_plans_delete_{label}")
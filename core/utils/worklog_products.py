@@ -0,0 +1,33 @@
+# core/utils/worklog_products.py
+# برچسب محصول denormalized لاگ‌های دستمزد (StageWorkLog.product_code / product_name)
+#
+# - منبع برچسب همان StageWorkLog._resolve_product است: محصول مرحلهٔ مرجع، وگرنه order.order_type
+#   سفارش (و نام Product هم‌کُد؛ اگر نبود خود کُد).
+# - save هر لاگ برچسب خودش را می‌سازد؛ این ماژول بازسازی گروهی (سه UPDATE با Subquery، بدون
+#   بارگذاری لاگ‌ها) را برای وقتی دارد که منبع عوض می‌شود: کُد/نام Product، محصول StageTemplate،
+#   order_type سفارش. سیگنال‌های core/models.py آن را با محدودهٔ درگیر صدا می‌زنند؛ برای UPDATE های
+#   گروهی یا ویرایش مستقیم DB: python manage.py rebuild_worklog_products
+
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def refresh_worklog_products(logs=None) -> None:
+    """logs: QuerySet از StageWorkLog (پیش‌فرض همه)."""
+    from core.models import Order, Product, StageTemplate, StageWorkLog
+
+    if logs is None:
+        logs = StageWorkLog.objects.all()
+    logs = logs.order_by()
+
+    tpl = StageTemplate.objects.filter(pk=OuterRef("stage_tpl_id"))
+    logs.filter(stage_tpl__product__isnull=False).update(
+        product_code=Subquery(tpl.values("product__code")[:1]),
+        product_name=Subquery(tpl.values("product__name")[:1]),
+    )
+
+    no_tpl = logs.filter(stage_tpl__product__isnull=True)
+    order_type = Order.objects.filter(pk=OuterRef("order_id")).values("order_type")[:1]
+    no_tpl.update(product_code=Coalesce(Subquery(order_type), Value(""), output_field=CharField()))
+    prod_name = Product.objects.filter(code=OuterRef("product_code")).values("name")[:1]
+    no_tpl.update(product_name=Coalesce(Subquery(prod_name), "product_code", output_field=CharField()))
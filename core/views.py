@@ -2,7 +2,7 @@ from datetime import date
 import io
 
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.views.decorators.http import require_POST
@@ -32,78 +32,14 @@ from django.views.decorators.clickjacking import xframe_options_exempt
 from .models import StageWorkLog
 
 # --- Helpers for seeding stages ---------------------------------------------
-def _jalali_add_days(jdate, days: int):
-    """
-    به تاریخ جلالی days روز اضافه می‌کند.
-    اگر jdatetime در دسترس نباشد، None برمی‌گرداند (برای جلوگیری از خطا).
-    """
-    # اگر jdatetime موجود نباشد، فعلاً از seeding صرف‌نظر می‌کنیم
-    try:
-        import jdatetime as _jd
-    except Exception:
-        return None
-
-    if isinstance(jdate, _jd.date):
-        g = jdate.togregorian()
-    else:
-        # اگر جلالی نبود (یا None)، امروزِ جلالی را مبنا بگیر
-        base = _jd.date.today()
-        g = base.togregorian()
-
-    g2 = g + datetime.timedelta(days=days)
-    return _jd.date.fromgregorian(date=g2)
-
-
 def seed_order_stages(order):
     """
     اگر برای سفارش StageInstance وجود ندارد، از روی StageTemplateهای محصول مرتبط می‌سازد.
     نگاشت: Product.code == order.order_type
+    (پلن مراحل هر محصول در core/utils/stage_seeding.py کش می‌شود.)
     """
-    code = (order.order_type or "").strip()
-    if not code:
-        return
-
-    # جلوگیری از تکرار
-    if StageInstance.objects.filter(order=order).exists():
-        return
-
-    try:
-        product = Product.objects.get(code=code, is_active=True)
-    except Product.DoesNotExist:
-        return
-
-    templates = (
-        StageTemplate.objects
-        .filter(product=product, is_active=True)
-        .order_by('order_index')
-    )
-    if not templates.exists():
-        return
-
-    # مبنا: تاریخ سفارش، وگرنه امروزِ جلالی
-    try:
-        import jdatetime as _jd
-        base = order.order_date or _jd.date.today()
-    except Exception:
-        base = None  # اگر jdatetime نبود، seeding را بی‌خطر رد می‌کنیم
-
-    day_acc = 0
-    instances = []
-    for t in templates:
-        dur = int(t.default_duration_days or 0)
-        planned = _jalali_add_days(base, day_acc + dur)
-        instances.append(StageInstance(
-            order=order,
-            template=t,
-            key=t.key,
-            label=t.label,
-            order_index=t.order_index,
-            planned_date=planned,  # ممکن است None شود اگر jdatetime نباشد
-            status=StageInstance.Status.PENDING,
-        ))
-        day_acc += dur
-
-    StageInstance.objects.bulk_create(instances)
+    from core.utils.stage_seeding import seed_order
+    seed_order(order)
 # ---------------------------------------------------------------------------
 
 
@@ -126,17 +62,8 @@ def _jalali_to_gregorian_date(s: str):
     '۱۴۰۴/۰۶/۱۹' یا '1404/06/19' → datetime.date (میلادی)
     اگر خالی/نامعتبر بود: None
     """
-    if not s:
-        return None
-    s = _normalize_digits(s).replace("-", "/")
-    if not jdatetime:
-        return None
-    try:
-        jy, jm, jd = [int(x) for x in s.split("/")]
-        g = jdatetime.date(jy, jm, jd).togregorian()
-        return date(g.year, g.month, g.day)
-    except Exception:
-        return None
+    from core.utils.jalali import parse_jalali
+    return parse_jalali(s)
 
 # ——— Today in Jalali (fallback به میلادی اگر jdatetime نبود) ———
 def _today_jdate():
@@ -213,10 +140,17 @@ def home(request):
         # پیش‌فرض
         orders_qs = orders_qs.order_by('-id')
 
-    # صفحه‌بندی
-    paginator = Paginator(orders_qs, 25)
-    page_number = request.GET.get('page')
-    orders_page = paginator.get_page(page_number)
+    # صفحه‌بندی Keyset (بدون COUNT(*) روی join فیلترشده و بدون OFFSET)
+    from core.utils.keyset import KeysetPaginator
+    from django_jalali.db import models as jmodels
+    key_field = order_field if sort in valid_sorts else 'id'
+    key_desc = not (sort in valid_sorts and direction == 'asc')
+    orders_page = KeysetPaginator(
+        orders_qs,
+        ordering=(('-' if key_desc else '') + key_field,),
+        per_page=25,
+        null_defaults={'due_date': Value(jdatetime.date(1, 1, 1), output_field=jmodels.jDateField())} if jdatetime else None,
+    ).page(request.GET)
 
     # لیست پزشک‌ها برای فیلتر
     doctors = (Order._base_manager
@@ -356,57 +290,18 @@ def accounting_report(request):
 # Order detail + timeline
 # ============================
 def order_detail(request, order_id):
-    from decimal import Decimal  # برای محاسبهٔ مبلغ مصرف خودکار
-    from billing.services.order_pnl import get_order_pnl  # محاسبهٔ درآمد/COGS/سود سفارش
+    # همهٔ ردیف‌ها با prefetch و همهٔ جمع‌ها در حافظه (billing/services/order_detail.py)
+    from billing.services.order_detail import build_order_detail
 
-    order = get_object_or_404(Order, pk=order_id)
-    events = order.events.all().order_by('happened_at', 'id')
+    try:
+        bundle = build_order_detail(order_id)
+    except Order.DoesNotExist:
+        raise Http404("سفارش یافت نشد.")
+    order = bundle.order
+    summary = bundle.summary
+    pnl = summary.pnl()
     form = OrderEventForm(order=order)
 
-    # --- محاسبهٔ مصرف خودکار: مبلغ هر ردیف و جمع کل ---
-    stock_issues_qs = (
-        order.stock_issues
-        .select_related('item')
-        .prefetch_related('linked_moves')
-        .order_by('happened_at')
-    )
-
-    issue_costs_total = Decimal('0.00')
-    for si in stock_issues_qs:
-        row_cost = Decimal('0.00')
-        for mv in si.linked_moves.all():
-            if mv.movement_type == 'issue':
-                qty_abs = (-mv.qty) if mv.qty < 0 else mv.qty  # خروج = منفی → قدر مطلق
-                row_cost += Decimal(qty_abs) * Decimal(mv.unit_cost_effective)
-        # ضمیمه‌کردن مبلغ هر ردیف روی آبجکت برای استفاده در قالب
-        si.row_cost = row_cost.quantize(Decimal('0.01'))
-        issue_costs_total += si.row_cost
-
-    issue_costs_total = issue_costs_total.quantize(Decimal('0.01'))
-
-    # --- محاسبهٔ درآمد/هزینه/سود سفارش (سرویس گام ۱) ---
-    pnl = get_order_pnl(order.id)
-
-    # --- دستمزد مراحل همین سفارش ---
-    wage_logs = (
-        StageWorkLog.objects
-        .filter(order=order)
-        .select_related("stage_tpl", "technician")
-        .order_by("-created_at", "-id")
-    )
-    wage_total = wage_logs.aggregate(s=Sum("total_wage"))["s"] or 0
-
-    wages_by_stage = (
-        wage_logs.values("stage_tpl__label")
-        .annotate(total=Sum("total_wage"))
-        .order_by()
-    )
-    wages_by_tech = (
-        wage_logs.values("technician__name")
-        .annotate(total=Sum("total_wage"))
-        .order_by()
-    )
-
     from django.urls import reverse
     try:
         workbench_url = reverse("core:core_workbench_order", args=[order.id])
@@ -417,12 +312,12 @@ def order_detail(request, order_id):
 
     context = {
         'order': order,
-        'events': events,
+        'events': bundle.events,
         'event_form': form,
-        'stock_issues': stock_issues_qs,
-        'issue_costs_total': issue_costs_total,
-        'digital_lab_cost': order.digital_lab_cost,
-        'digital_lab_transfers': order.digital_lab_transfers.order_by('-sent_date', '-id'),
+        'stock_issues': bundle.stock_issues,
+        'issue_costs_total': summary.issue_costs_total,
+        'digital_lab_cost': summary.digital_lab_net,
+        'digital_lab_transfers': bundle.digital_lab_transfers,
         'order_pnl': pnl,
         'order_revenue': pnl['revenue'],
         'order_material_cogs': pnl['material_cogs'],
@@ -430,10 +325,10 @@ def order_detail(request, order_id):
         'order_allocation_share': pnl['allocation_share'],
         'order_gross_profit': pnl['gross_profit'],
         'order_net_profit': pnl['net_profit'],
-        'wage_logs': wage_logs,
-        'wage_total': wage_total,
-        'wages_by_stage': wages_by_stage,
-        'wages_by_tech': wages_by_tech,
+        'wage_logs': bundle.wage_logs,
+        'wage_total': summary.wage_total,
+        'wages_by_stage': summary.wages_by_stage,
+        'wages_by_tech': summary.wages_by_tech,
         'workbench_url': workbench_url,
     }
     return render(request, 'core/order_detail.html', context)
@@ -637,52 +532,21 @@ def add_order_event_bulk(request):
         }
         data["direction"] = dir_map.get(ev_type, OrderEvent.Direction.INTERNAL)
 
-    # ---- اجرا برای هر سفارش
-    orders = Order.objects.filter(id__in=order_ids).select_related('patient')
-    ok, fail = 0, 0
-
-    # فایل پیوست را (اگر هست) یکسان برای همه استفاده می‌کنیم
-    files = request.FILES
-
-    for order in orders:
-        try:
-            # برای هر سفارش، فرم مستقل می‌سازیم تا ولیدیشن جدا انجام شود
-            form = OrderEventForm(data, files, order=order)
-            if form.is_valid():
-                ev = form.save(commit=False)
-                ev.order = order
-
-                # اگر stage خالی است ولی علت از مراحل سفارش انتخاب شده بود (در آینده)، اینجا می‌شد پر کرد.
-                # فعلاً همان stage متنی استفاده می‌شود.
+    # ---- اجرا: یک‌بار اعتبارسنجی، یک‌بار ذخیرهٔ پیوست، bulk_create و UPDATE گروهی وضعیت
+    from billing.services.order_events import create_events_bulk
 
-                ev.save()
+    try:
+        res = create_events_bulk(order_ids, data, request.FILES)
+    except Exception as ex:
+        messages.error(request, f"ثبت گروهی ناموفق بود — {ex}")
+        return redirect(next_url)
 
-                # --- همگام‌سازی وضعیت سفارش برای رویدادهای کلیدی (مثل روالش در add_order_event) ---
-                try:
-                    if ev.event_type == OrderEvent.EventType.FINAL_SHIPMENT:
-                        order.shipped_date = ev.happened_at
-                        order.status = 'delivered'
-                        order.save(update_fields=['shipped_date', 'status'])
-                    elif ev.event_type in (
-                        OrderEvent.EventType.RECEIVED_IN_LAB,
-                        OrderEvent.EventType.RECEIVED_FROM_DIGITAL,
-                        OrderEvent.EventType.ADJUSTMENT,
-                    ):
-                        if order.status == 'delivered' and order.shipped_date and ev.happened_at and ev.happened_at >= order.shipped_date:
-                            order.status = 'in_progress'
-                            order.save(update_fields=['status'])
-                            if not (ev.notes or '').strip():
-                                ev.notes = "بازگشت پس از ارسال نهایی (اصلاح)"
-                                ev.save(update_fields=['notes'])
-                except Exception:
-                    pass
-                # -----------------------------------------------------------------------
+    if not res.is_valid:
+        err = "; ".join([f"{k}: {', '.join(v)}" for k, v in res.errors.items()])
+        messages.error(request, f"ثبت گروهی ناموفق بود — {err}")
+        return redirect(next_url)
 
-                ok += 1
-            else:
-                fail += 1
-        except Exception:
-            fail += 1
+    ok, fail = res.ok, res.fail
 
     if ok and not fail:
         messages.success(request, f"رویداد برای {ok} سفارش ثبت شد.")
@@ -915,12 +779,9 @@ def dashboard(request):
     except Exception:
         pass
     
-        # --- Lab profile برای هدر ---
-    try:
-        LabProfile = apps.get_model('billing', 'LabProfile')
-        lab_profile = LabProfile.objects.first()
-    except Exception:
-        lab_profile = None
+    # --- Lab profile برای هدر (از کش سراسری) ---
+    from core.utils.lab_singletons import get_lab_profile
+    lab_profile = get_lab_profile()
 
     return render(request, 'core/dashboard.html', {
         'kpis': kpis,
@@ -943,18 +804,29 @@ def dashboard(request):
 def api_doctors(request):
     """
     لیست دکترها برای دراپ‌دان + جستجو با q
-    پاسخ: [{id, name}]
+    پاسخ: [{id, name}] — با ETag/Last-Modified و fields= (core/utils/lookup_api.py)
     """
+    from core.utils.lookup_api import conditional_json, parse_fields, project, version_stamp
+
     q = (request.GET.get('q') or '').strip()
-    qs = Doctor.objects.all()
-    if q:
-        qs = qs.filter(name__icontains=q)
-    data = [{'id': d.id, 'name': d.name} for d in qs.order_by('name')[:100]]
-    return JsonResponse({'results': data})
+    fields = parse_fields(request, ('id', 'name', 'clinic', 'phone', 'code'), default=('id', 'name'))
+
+    def build():
+        qs = Doctor.objects.all()
+        if q:
+            qs = qs.filter(name__icontains=q)
+        return {'results': project(qs.order_by('name').values(*fields)[:100], fields)}
+
+    return conditional_json(request, 'doctors', [version_stamp(Doctor.objects.all())], build)
+
+
+ORDER_LOOKUP_FIELDS = ('id', 'patient_name', 'serial_number', 'due_date', 'doctor', 'product_code')
 
 
 @require_GET
 def api_orders_by_doctor(request):
+    from core.utils.lookup_api import conditional_json, parse_fields, project, version_stamp
+
     doc_id = request.GET.get('doctor_id')
     q = (request.GET.get('q') or '').strip()
 
@@ -962,45 +834,60 @@ def api_orders_by_doctor(request):
         return JsonResponse({'results': []})
 
     try:
-        doctor = Doctor.objects.get(pk=doc_id)
-    except Doctor.DoesNotExist:
+        doctor = Doctor.objects.only('id', 'name', 'updated_at').get(pk=doc_id)
+    except (Doctor.DoesNotExist, ValueError):
         return JsonResponse({'results': []})
 
-    # فقط سفارش‌های جاری: pending / in_progress
-    qs = (Order._base_manager
-          .select_related('patient')
-          .filter(doctor=doctor.name, status__in=['pending', 'in_progress'])
-          .order_by('-id'))
+    fields = parse_fields(request, ORDER_LOOKUP_FIELDS)
+    # مهر نسخه روی همهٔ سفارش‌های دکتر (نه فقط جاری‌ها) تا تغییر وضعیت هم دیده شود
+    doctor_orders = Order._base_manager.filter(doctor=doctor.name)
+    stamps = [version_stamp(doctor_orders), (doctor.updated_at, f"d{doctor.pk}:{doctor.name}")]
 
-    if q:
-        qs = qs.filter(patient__name__icontains=q)
-
-    results = []
-    for o in qs[:300]:
-        results.append({
-            'id': o.id,
-            'patient_name': (o.patient.name if o.patient_id else ''),
-            'serial_number': o.serial_number or '',
-            'due_date': (str(o.due_date).replace('-', '/') if o.due_date else ''),
-            "doctor": o.doctor,
-            "product_code": getattr(o, "order_type", None),  # ← کلید اصلی: کُد محصول (مثلاً implant_pfm, implant_zirconia, ...)
-        })
-    return JsonResponse({'results': results})
+    def build():
+        # فقط سفارش‌های جاری: pending / in_progress
+        qs = doctor_orders.filter(status__in=['pending', 'in_progress']).order_by('-id')
+        if q:
+            qs = qs.filter(patient__name__icontains=q)
+        rows = []
+        for r in qs.values('id', 'patient__name', 'serial_number', 'due_date', 'doctor', 'order_type')[:300]:
+            due = r['due_date']
+            rows.append({
+                'id': r['id'],
+                'patient_name': r['patient__name'] or '',
+                'serial_number': r['serial_number'] or '',
+                'due_date': (due.strftime('%Y/%m/%d') if due else ''),
+                'doctor': r['doctor'],
+                'product_code': r['order_type'],  # ← کلید اصلی: کُد محصول (مثلاً implant_pfm, implant_zirconia, ...)
+            })
+        return {'results': project(rows, fields)}
+
+    return conditional_json(request, 'orders_by_doctor', stamps, build)
 
 
 @require_GET
 def api_products(request):
     """
     لیست محصولات فعال برای Dropdown/Javascript
-    GET /api/products?q=
+    GET /api/products?q=&fields=code,name
     پاسخ: {"results": [{"code": "...", "name": "..."}]}
     """
+    from core.utils.lookup_api import conditional_json, parse_fields, project, version_stamp
+
     q = (request.GET.get('q') or '').strip()
-    qs = Product.objects.filter(is_active=True)
-    if q:
-        qs = qs.filter(Q(name__icontains=q) | Q(code__icontains=q))
-    data = [{"code": p.code, "name": p.name} for p in qs.order_by("name")[:200]]
-    return JsonResponse({"results": data})
+    fields = parse_fields(request, ('id', 'code', 'name', 'category', 'default_unit_price'),
+                          default=('code', 'name'))
+
+    def build():
+        qs = Product.objects.filter(is_active=True)
+        if q:
+            qs = qs.filter(Q(name__icontains=q) | Q(code__icontains=q))
+        rows = list(qs.order_by('name').values(*fields)[:200])
+        if 'default_unit_price' in fields:
+            for r in rows:
+                r['default_unit_price'] = str(r['default_unit_price']) if r['default_unit_price'] is not None else None
+        return {"results": project(rows, fields)}
+
+    return conditional_json(request, 'products', [version_stamp(Product.objects.all())], build)
 
 # ============================
 # API: stages for a specific order
@@ -1013,6 +900,8 @@ def api_order_stages(request):
     GET /api/order-stages?order_id=123
     پاسخ: {"results":[{"label":"امتحان فریم"}, {"label":"امتحان پرسلن"}, ...]}
     """
+    from core.utils.lookup_api import conditional_json, parse_fields, project, version_stamp
+
     order_id_raw = (request.GET.get("order_id") or "").strip()
     if not order_id_raw:
         return JsonResponse({"results": []})
@@ -1032,16 +921,17 @@ def api_order_stages(request):
     except ValueError:
         return JsonResponse({"results": []})
 
-    try:
-        order = Order.objects.get(pk=oid)
-
-    except Order.DoesNotExist:
+    if not Order.objects.filter(pk=oid).exists():
         return JsonResponse({"results": []})
 
-    # همهٔ مراحل را بده تا optgroup خالی نشود
-    stages = order.stages.all().order_by("order_index", "id")
-    data = [{"id": s.id, "label": s.label} for s in stages]
-    return JsonResponse({"results": data})
+    fields = parse_fields(request, ('id', 'label', 'key', 'order_index', 'status'), default=('id', 'label'))
+    stages = StageInstance.objects.filter(order_id=oid)
+
+    def build():
+        # همهٔ مراحل را بده تا optgroup خالی نشود
+        return {"results": project(stages.order_by("order_index", "id").values(*fields), fields)}
+
+    return conditional_json(request, f'order_stages:{oid}', [version_stamp(stages)], build)
 
 # core/views.py
 from django.shortcuts import render  # بالاتر هست، اگر نبود نگهش دار
@@ -1848,17 +1738,8 @@ def _to_decimal_safe(s):
 
 def _parse_jalali_to_gregorian(s):
     """تبدیل تاریخ شمسی (در قالب 1404/08/10) به میلادی (datetime.date)"""
-    if not s:
-        return None
-    try:
-        s = s.strip().replace("-", "/")
-        parts = [int(x) for x in s.split("/") if x.strip()]
-        if len(parts) != 3:
-            return None
-        j = jdatetime.date(parts[0], parts[1], parts[2])
-        return j.togregorian()  # خروجی datetime.date میلادی
-    except Exception:
-        return None
+    from core.utils.jalali import parse_jalali
+    return parse_jalali(s)
 
 
 class DigitalLabTransferForm(forms.ModelForm):
@@ -1998,19 +1879,13 @@ def digital_lab_transfer_create(request, order_id=None):
 # ===[ /Digital Lab ]======================================================
 
 # ===[ Digital Lab: List & Filters ]========================================
-from django.db.models import Sum, F, Value as V
+from django.db.models import Sum, F, Count, Value as V
 from django.db.models.functions import Coalesce
 
 def _parse_jalali_to_date_or_none(s):
     """ورودی شمسی 'YYYY/MM/DD' → date میلادی یا None (از همان منطق قبلی استفاده می‌کند)"""
-    if not s:
-        return None
-    try:
-        s = s.strip().replace("-", "/")
-        y, m, d = [int(x) for x in s.split("/") if x.strip()]
-        return jdatetime.date(y, m, d).togregorian()
-    except Exception:
-        return None
+    from core.utils.jalali import parse_jalali
+    return parse_jalali(s)
 @xframe_options_exempt
 def digital_lab_transfer_list(request):
     """
@@ -2080,12 +1955,17 @@ def digital_lab_transfer_list(request):
             V(0, output_field=DecimalField(max_digits=18, decimal_places=2)),
             output_field=DecimalField(max_digits=18, decimal_places=2),
         ),
+        rows_count=Count('id'),
     )
 
     sum_charge = agg['total_charge'] or Decimal('0.00')
     sum_credit = agg['total_credit'] or Decimal('0.00')
     net_amount = sum_charge - sum_credit
 
+    # صفحه‌بندی Keyset روی (sent_date, id) به‌جای برش ثابت [:500]
+    from core.utils.keyset import KeysetPaginator
+    page = KeysetPaginator(qs, ordering=('-sent_date', '-id'), per_page=100).page(request.GET)
+
     context = {
         'filters': {
             'q': q, 'doctor': doctor, 'lab': lab,
@@ -2093,8 +1973,9 @@ def digital_lab_transfer_list(request):
             'date_from': request.GET.get('date_from') or '',
             'date_to': request.GET.get('date_to') or '',
         },
-        'rows': qs[:500],           # محدودیت موقت برای نمایش
-        'count': qs.count(),
+        'rows': page.object_list,
+        'page': page,
+        'count': agg['rows_count'] or 0,  # از همان aggregate جمع‌ها؛ بدون COUNT جداگانه
         'sum_charge': sum_charge,
         'sum_credit': sum_credit,
         'sum_net': net_amount,
@@ -2109,7 +1990,10 @@ from django.db.models.functions import Coalesce, TruncMonth
 from django.shortcuts import render
 # فرض بر این است که DigitalLabTransfer و Order از قبل import شده‌اند
 # و تابع _parse_jalali_to_date_or_none قبلاً در فایل هست.
+from core.utils.reporting_db import reporting_db
+
 
+@reporting_db
 def digital_lab_report(request):
     """
     گزارش تحلیلی لاب دیجیتال (مالی‌محور + چند شاخص عملکردی)
@@ -2125,7 +2009,7 @@ def digital_lab_report(request):
     if q:
         from django.db.models import Q
         qs = qs.filter(
-            Q(order__patient_name__icontains=q) |  # اگر این فیلد در Order هست
+            Q(order__patient__name__icontains=q) |
             Q(lab_name__icontains=q) |
             Q(stage_name__icontains=q) |
             Q(note__icontains=q) |
@@ -2155,61 +2039,21 @@ def digital_lab_report(request):
     if date_to:
         qs = qs.filter(sent_date__lte=date_to)
 
-    # ----- KPI های اصلی -----
-    agg = qs.aggregate(
-        total_charge = Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-        total_credit = Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-        rows_count   = Coalesce(Count('id'), V(0)),
-    )
-    sum_charge = agg['total_charge'] or Decimal('0.00')
-    sum_credit = agg['total_credit'] or Decimal('0.00')
-    sum_net    = (sum_charge - sum_credit)
-
-    # تعداد سفارش‌های یکتایی که در گزارش دیده می‌شوند
-    try:
-        # اگر DB اجازه distinct('field') نده، fallback به set در template می‌تونیم بدهیم.
-        unique_orders_count = qs.values('order_id').distinct().count()
-    except Exception:
-        unique_orders_count = 0
-
-    # ----- ریزِ لاب‌ها (Top labs) -----
-    per_lab = (
-        qs.values('lab_name')
-          .annotate(
-              lab_charge=Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-              lab_credit=Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-              rows=Count('id'),
-          )
-          .annotate(lab_net=(Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))
-                             - Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))))
-          .order_by('-lab_net', '-lab_charge')[:20]
-    )
-
-    # ----- ریزِ مرحله‌ها (Top stages) -----
-    per_stage = (
-        qs.values('stage_name')
-          .annotate(
-              st_charge=Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-              st_credit=Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-              rows=Count('id'),
-          )
-          .annotate(st_net=(Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))
-                            - Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))))
-          .order_by('-st_net', '-st_charge')[:20]
-    )
-
-    # ----- سری ماهانه ۶ ماه اخیر (بر اساس sent_date) -----
-    monthly = (
-        qs.annotate(m=TruncMonth('sent_date'))
-          .values('m')
-          .annotate(
-              m_charge=Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-              m_credit=Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2))),
-          )
-          .annotate(m_net=(Coalesce(Sum('charge_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))
-                           - Coalesce(Sum('credit_amount'), V(0, output_field=DecimalField(max_digits=18, decimal_places=2)))))
-          .order_by('m')
-    )
+    # ----- KPIها + ریز لاب/مرحله/ماه/دکتر + زمان چرخه (billing/services/digital_lab_analytics.py) -----
+    import json
+    from billing.services.digital_lab_analytics import analyze
+
+    report = analyze(qs, dimensions=("lab", "stage", "month", "doctor"))
+    totals = report.totals
+    sum_charge = totals['charge'] or Decimal('0.00')
+    sum_credit = totals['credit'] or Decimal('0.00')
+    sum_net    = totals['net'] or Decimal('0.00')
+    monthly = report.by['month']
+    monthly_json = json.dumps([
+        {'m': (r['month'].isoformat() if r['month'] else ''),
+         'm_charge': float(r['charge']), 'm_credit': float(r['credit']), 'm_net': float(r['net'])}
+        for r in monthly
+    ])
 
     # داده‌های جدول (نمونه محدود برای مشاهده سریع)
     rows = qs.select_related('order').only(
@@ -2227,12 +2071,21 @@ def digital_lab_report(request):
             'sum_charge': sum_charge,
             'sum_credit': sum_credit,
             'sum_net':    sum_net,
-            'rows_count': agg['rows_count'] or 0,
-            'unique_orders': unique_orders_count,
+            'rows_count': totals['attempts'] or 0,
+            'unique_orders': totals['orders'] or 0,
+            'redos': totals['redos'] or 0,
+            'redo_rate': totals['redo_rate'],
         },
-        'per_lab': list(per_lab),
-        'per_stage': list(per_stage),
-        'monthly': list(monthly),
+        'per_lab': report.by['lab'],
+        'per_stage': report.by['stage'],
+        'per_doctor': report.by['doctor'],
+        'monthly': monthly,
+        'monthly_json': monthly_json,
+        'turnaround': report.turnaround,
+        'turnaround_by_lab': report.turnaround_by_lab,
+        'first_pass_yield': report.first_pass_yield,
+        'redo_counts': report.redo_counts,
+        'chains': report.chains,
         'rows': rows,
     }
     return render(request, 'core/digital_lab_report.html', context)
@@ -12,15 +12,12 @@ import jdatetime
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
 from django.template.loader import render_to_string
+from core.utils.fa_numbers import format_money_fa
+from core.utils.jalali import parse_jdate, to_jalali
 
 
 def _money_fa(n: int | float | str):
-    try:
-        n = int(float(n or 0))
-        s = f"{n:,}".replace(",", "٬")
-        return s.translate(str.maketrans("0123456789","۰۱۲۳۴۵۶۷۸۹"))
-    except Exception:
-        return str(n)
+    return format_money_fa(n or 0)
 
 @require_http_methods(["GET"])
 def workbench_order(request, order_id: int):
@@ -123,7 +120,6 @@ def worklog_delete(request, pk: int):
     return redirect(reverse("core:core_workbench_order", args=[order_id]))
 
 # برای Export
-import io
 import xlsxwriter
 from weasyprint import HTML
 
@@ -135,21 +131,10 @@ def _esc(s):
         return s
 
 def _money_fa(n: int | float | str):
-    try:
-        n = int(float(n or 0))
-        s = f"{n:,}".replace(",", "٬")
-        return s.translate(str.maketrans("0123456789","۰۱۲۳۴۵۶۷۸۹"))
-    except Exception:
-        return str(n)
+    return format_money_fa(n or 0)
 
 def _parse_jdate(s):
-    if not s:
-        return None
-    try:
-        y, m, d = [int(p) for p in s.replace("-", "/").split("/")[:3]]
-        return jdatetime.date(y, m, d)
-    except Exception:
-        return None
+    return parse_jdate(s)
 
 @require_http_methods(["GET", "POST"])
 def wages_payout_new(request):
@@ -169,9 +154,9 @@ def wages_payout_new(request):
             start_j = None
             end_j = None
             if start_g:
-                start_j = jdatetime.date.fromgregorian(date=start_g)
+                start_j = to_jalali(start_g)
             if end_g:
-                end_j = jdatetime.date.fromgregorian(date=end_g)
+                end_j = to_jalali(end_g)
 
             params = {"technician": tech.id}
             if start_j:
@@ -189,13 +174,30 @@ def wages_payout_new(request):
     return TemplateResponse(request, "core/wages_payout_new.html", {"form": form})
 
 
+def _payout_preview_context(preview, form_confirm):
+    return {
+        "technician": preview.technician,
+        "start": preview.start,
+        "end": preview.end,
+        "logs": preview.logs,
+        "gross_total": preview.totals.gross_total,
+        "by_stage": preview.totals.by_stage,
+        "by_order": preview.totals.by_order,
+        "_money_fa": _money_fa,  # اگر در تمپلیت استفاده نمی‌کنی، ضرری ندارد
+        "form_confirm": form_confirm,
+    }
+
+
 @require_http_methods(["GET", "POST"])
 def wages_payout_preview(request):
     """
     گام ۲: پیش‌نمایش تسویه:
       - GET: تکنسین و بازه را از querystring می‌خواند و لاگ‌های DONE و تسویه‌نشده را نشان می‌دهد.
       - POST: فرم تأیید را می‌گیرد، WagePayout می‌سازد و لاگ‌ها را تسویه می‌کند.
+    انتخاب لاگ‌ها، جمع‌ها و تسویه در billing/services/wage_payout.py است.
     """
+    from billing.services.wage_payout import PayoutConflict, confirm_payout, preview_payout
+
     # ----------------------
     # حالت POST: تأیید تسویه
     # ----------------------
@@ -208,90 +210,47 @@ def wages_payout_preview(request):
             if tech_id:
                 try:
                     tech = Technician.objects.get(pk=int(tech_id))
-                except Technician.DoesNotExist:
+                except (Technician.DoesNotExist, ValueError):
                     tech = None
 
             start_jd = _parse_jdate(confirm_form.data.get("period_start_j") or "")
             end_jd   = _parse_jdate(confirm_form.data.get("period_end_j") or "")
 
-            logs_qs = StageWorkLog.objects.filter(
-                technician=tech,
-                status=StageWorkLog.Status.DONE,
-            ).filter(
-                Q(is_settled=False) | Q(is_settled__isnull=True)
-            )
-
-            if start_jd:
-                logs_qs = logs_qs.filter(finished_at__gte=start_jd)
-            if end_jd:
-                logs_qs = logs_qs.filter(finished_at__lte=end_jd)
-
-            logs_qs = logs_qs.select_related("order", "stage_tpl", "stage_inst").order_by("finished_at", "id")
-            gross_total = logs_qs.aggregate(s=Sum("total_wage"))["s"] or Decimal("0.00")
-
-            ctx = {
-                "technician": tech,
-                "start": start_jd,
-                "end": end_jd,
-                "logs": logs_qs,
-                "gross_total": gross_total,
-                "_money_fa": _money_fa,  # اگر در تمپلیت استفاده نمی‌کنی، ضرری ندارد
-                "form_confirm": confirm_form,
-            }
-            return TemplateResponse(request, "core/wages_payout_preview.html", ctx)
+            preview = preview_payout(tech, start_jd, end_jd)
+            return TemplateResponse(request, "core/wages_payout_preview.html",
+                                    _payout_preview_context(preview, confirm_form))
 
         # فرم تأیید معتبر است → ساخت تسویه
         tech_id = confirm_form.cleaned_data["technician_id"]
         technician = get_object_or_404(Technician, pk=tech_id)
 
-        start_jd = _parse_jdate(confirm_form.cleaned_data.get("period_start_j") or "")
-        end_jd   = _parse_jdate(confirm_form.cleaned_data.get("period_end_j") or "")
-
-        logs_qs = StageWorkLog.objects.filter(
-            technician=technician,
-            status=StageWorkLog.Status.DONE,
-        ).filter(
-            Q(is_settled=False) | Q(is_settled__isnull=True)
-        )
-
-        if start_jd:
-            logs_qs = logs_qs.filter(finished_at__gte=start_jd)
-        if end_jd:
-            logs_qs = logs_qs.filter(finished_at__lte=end_jd)
+        start_str = confirm_form.cleaned_data.get("period_start_j") or ""
+        end_str   = confirm_form.cleaned_data.get("period_end_j") or ""
+        start_jd = _parse_jdate(start_str)
+        end_jd   = _parse_jdate(end_str)
 
-        logs_qs = logs_qs.select_related("order", "stage_tpl", "stage_inst").order_by("finished_at", "id")
-
-        if not logs_qs.exists():
+        try:
+            payout = confirm_payout(
+                technician, start_jd, end_jd,
+                deductions=confirm_form.cleaned_data.get("deductions_total") or Decimal("0.00"),
+                bonus=confirm_form.cleaned_data.get("bonus_total") or Decimal("0.00"),
+                note=confirm_form.cleaned_data.get("note") or "",
+                payment_ref=confirm_form.cleaned_data.get("payment_ref") or "",
+            )
+        except PayoutConflict as ex:
+            messages.error(request, str(ex))
+            params = {"technician": technician.id}
+            if start_str:
+                params["period_start_j"] = start_str
+            if end_str:
+                params["period_end_j"] = end_str
+            return redirect(reverse("core:wages_payout_preview") + "?" + urlencode(params))
+
+        if payout is None:
             messages.warning(request, "هیچ لاگ تسویه‌نشده‌ای برای این بازه یافت نشد.")
             return redirect(reverse("core:wages_payout_new"))
 
-        gross_total = logs_qs.aggregate(s=Sum("total_wage"))["s"] or Decimal("0.00")
-        deductions = confirm_form.cleaned_data.get("deductions_total") or Decimal("0.00")
-        bonus      = confirm_form.cleaned_data.get("bonus_total") or Decimal("0.00")
-        net_payable = gross_total - deductions + bonus
-
-        payout = WagePayout.objects.create(
-            technician=technician,
-            period_start_j=start_jd,
-            period_end_j=end_jd,
-            status=WagePayout.Status.CONFIRMED,
-            gross_total=gross_total,
-            deductions_total=deductions,
-            bonus_total=bonus,
-            net_payable=net_payable,
-            note=confirm_form.cleaned_data.get("note") or "",
-            payment_ref=confirm_form.cleaned_data.get("payment_ref") or "",
-        )
-
-        # به‌روزرسانی لاگ‌ها: اتصال به payout و علامت‌گذاری به‌عنوان تسویه‌شده
-        settled_date = jdatetime.date.today()
-        StageWorkLog.objects.filter(pk__in=logs_qs.values_list("pk", flat=True)).update(
-            payout=payout,
-            is_settled=True,
-            settled_at_j=settled_date,
-        )
-
-        messages.success(request, f"تسویهٔ دستمزد با موفقیت ایجاد شد. خالص قابل پرداخت: {net_payable} تومان.")
+        messages.success(request, f"تسویهٔ دستمزد با موفقیت ایجاد شد. خالص قابل پرداخت: {payout.net_payable} تومان.")
         return redirect(reverse("core:wages_payout_detail", args=[payout.id]))
 
     # ----------------------
@@ -315,26 +274,11 @@ def wages_payout_preview(request):
     start_jd = _parse_jdate(start_str)
     end_jd   = _parse_jdate(end_str)
 
-    logs_qs = StageWorkLog.objects.filter(
-        technician=technician,
-        status=StageWorkLog.Status.DONE,
-    ).filter(
-        Q(is_settled=False) | Q(is_settled__isnull=True)
-    )
-
-    if start_jd:
-        logs_qs = logs_qs.filter(finished_at__gte=start_jd)
-    if end_jd:
-        logs_qs = logs_qs.filter(finished_at__lte=end_jd)
-
-    logs_qs = logs_qs.select_related("order", "stage_tpl", "stage_inst").order_by("finished_at", "id")
-
-    if not logs_qs.exists():
+    preview = preview_payout(technician, start_jd, end_jd)
+    if not preview.logs:
         messages.warning(request, "هیچ لاگ تسویه‌نشده‌ای برای این بازه یافت نشد.")
         return redirect(reverse("core:wages_payout_new"))
 
-    gross_total = logs_qs.aggregate(s=Sum("total_wage"))["s"] or Decimal("0.00")
-
     # فرم تأیید با مقداردهی اولیه
     form_confirm = WagePayoutConfirmForm(initial={
         "technician_id": technician.id,
@@ -344,16 +288,8 @@ def wages_payout_preview(request):
         "bonus_total": Decimal("0.00"),
     })
 
-    ctx = {
-        "technician": technician,
-        "start": start_jd,
-        "end": end_jd,
-        "logs": logs_qs,
-        "gross_total": gross_total,
-        "_money_fa": _money_fa,  # اگر در تمپلیت حذفش کرده‌ای، بودنش ضرری ندارد
-        "form_confirm": form_confirm,
-    }
-    return TemplateResponse(request, "core/wages_payout_preview.html", ctx)
+    return TemplateResponse(request, "core/wages_payout_preview.html",
+                            _payout_preview_context(preview, form_confirm))
 
 
 @require_http_methods(["GET"])
@@ -394,7 +330,7 @@ def wages_report(request):
     end_jd   = _parse_jdate(end_str)
 
     # --------- مدل‌ها ---------
-    from .models import StageWorkLog, Technician, Product, StageTemplate
+    from .models import Technician, Product, StageTemplate
 
     # محصولات برای کشو
     products_qs = Product.objects.all().order_by("name")
@@ -408,29 +344,25 @@ def wages_report(request):
     tech_names = list(Technician.objects.order_by("name").values_list("name", flat=True))
 
     # --------- کوئری گزارش ---------
-    logs = (StageWorkLog.objects
-            .select_related("technician", "stage_tpl", "stage_inst", "order", "stage_tpl__product")
-            .order_by("-finished_at", "-id"))
-
-    if tech_name:
-        logs = logs.filter(technician__name=tech_name)
-    if start_jd:
-        logs = logs.filter(finished_at__gte=start_jd)
-    if end_jd:
-        logs = logs.filter(finished_at__lte=end_jd)
-    if product:
-        logs = logs.filter(Q(stage_tpl__product__code=product) | Q(order__order_type=product))
-    if stage_q:
-        logs = logs.filter(Q(stage_tpl__label=stage_q) | Q(stage_inst__label=stage_q))
-
-    total_wage = logs.aggregate(s=Sum("total_wage"))["s"] or 0
-    by_tech  = (logs.values("technician__name").annotate(total=Sum("total_wage")).order_by("technician__name"))
-    by_stage = (logs.values("stage_tpl__label").annotate(total=Sum("total_wage")).order_by("stage_tpl__label"))
+    # فیلتر محصول روی ستون denormalized و ایندکس‌دار product_code؛ تجمیع‌ها و پیوت سمت DB
+    from billing.services.wages_report import (
+        WagesFilters, filtered_logs, detail_rows, summarize, pivot_tech_stage_month,
+    )
+    logs = filtered_logs(WagesFilters(
+        technician=tech_name, start=start_jd, end=end_jd, product=product, stage=stage_q,
+    ))
+    summary = summarize(logs)
+    total_wage = summary.total_wage
+    by_tech, by_stage, by_product = summary.by_tech, summary.by_stage, summary.by_product
 
     # --------- Export Excel ---------
     if "export_excel" in request.GET:
-        output = io.BytesIO()
-        wb = xlsxwriter.Workbook(output, {'in_memory': True})
+        # constant_memory: هر ردیف بعد از نوشتن روی دیسک flush می‌شود (ردیف‌ها فقط به ترتیب).
+        # با in_memory نادیده گرفته می‌شود، پس خروجی در فایل موقت ساخته و جریانی فرستاده می‌شود.
+        import tempfile
+        from django.http import FileResponse
+        output = tempfile.TemporaryFile()
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True})
         ws = wb.add_worksheet("گزارش دستمزد")
 
         fmt_h = wb.add_format({'bold': True, 'align':'center', 'valign':'vcenter', 'bg_color':'#E0F2FE', 'border':1})
@@ -445,24 +377,17 @@ def wages_report(request):
         ws.set_column(4, 6, 16)
         ws.set_column(7, 7, 14)
 
+        # همهٔ ردیف‌ها به‌صورت dict سبک و جریانی (بدون سقف ۵۰۰۰ و بدون ساخت مدل)
         r = 1
-        for l in logs[:5000]:
-            stage_label = ""
-            prod_name = ""
-            if getattr(l, "stage_tpl_id", None) and getattr(l.stage_tpl, "label", None):
-                stage_label = l.stage_tpl.label
-                prod_name = getattr(getattr(l.stage_tpl, "product", None), "name", "") or (getattr(getattr(l, "order", None), "order_type", "") or "")
-            elif getattr(l, "stage_inst_id", None) and getattr(l.stage_inst, "label", None):
-                stage_label = l.stage_inst.label or ""
-                prod_name = getattr(getattr(l, "order", None), "order_type", "") or ""
-            ws.write(r,0, l.id, fmt)
-            ws.write(r,1, getattr(l.technician,'name','—'), fmt)
-            ws.write(r,2, stage_label, fmt)
-            ws.write(r,3, prod_name or '—', fmt)
-            ws.write(r,4, getattr(l, 'quantity', 0) or 0, fmt)
-            ws.write(r,5, _money_fa(getattr(l, 'unit_wage', 0)), fmt_r)
-            ws.write(r,6, _money_fa(getattr(l, 'total_wage', 0)), fmt_r)
-            ws.write(r,7, str(getattr(l, 'finished_at', '') or ''), fmt)
+        for l in detail_rows(logs.order_by("-finished_at", "-id")).iterator(chunk_size=2000):
+            ws.write(r,0, l["id"], fmt)
+            ws.write(r,1, l["technician__name"] or '—', fmt)
+            ws.write(r,2, l["stage_label"] or '', fmt)
+            ws.write(r,3, l["product_name"] or l["product_code"] or '—', fmt)
+            ws.write(r,4, l["quantity"] or 0, fmt)
+            ws.write(r,5, _money_fa(l["unit_wage"] or 0), fmt_r)
+            ws.write(r,6, _money_fa(l["total_wage"] or 0), fmt_r)
+            ws.write(r,7, str(l["finished_at"] or ''), fmt)
             r += 1
 
         # جمع
@@ -473,30 +398,37 @@ def wages_report(request):
 
         wb.close()
         output.seek(0)
-        resp = HttpResponse(output.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        resp['Content-Disposition'] = 'attachment; filename=wages_report.xlsx'
-        return resp
+        # FileResponse فایل را تکه‌تکه می‌فرستد و در پایان می‌بندد (TemporaryFile هم پاک می‌شود)
+        return FileResponse(output, as_attachment=True, filename="wages_report.xlsx",
+                            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    ctx = {
+        'tech_name': tech_name, 'start': start_str, 'end': end_str, 'product': product, 'stage_q': stage_q,
+        'products_qs': products_qs, 'stages_qs': stages_qs, 'tech_names': tech_names,
+        'total_wage': total_wage, 'logs_count': summary.logs_count,
+        'by_tech': by_tech, 'by_stage': by_stage, 'by_product': by_product,
+        'pivot': pivot_tech_stage_month(logs),
+        '_money_fa': _money_fa,
+    }
+    logs = logs.select_related("technician", "stage_tpl", "stage_inst")
 
     # --------- Export PDF ---------
     if "export_pdf" in request.GET:
         html_str = render_to_string('core/wages_report.html', {
-            'is_export': True,
-            'tech_name': tech_name, 'start': start_str, 'end': end_str, 'product': product, 'stage_q': stage_q,
-            'products_qs': products_qs, 'stages_qs': stages_qs, 'tech_names': tech_names,
-            'logs': logs[:1000], 'total_wage': total_wage, 'by_tech': by_tech, 'by_stage': by_stage,
-            '_money_fa': _money_fa,
+            **ctx, 'is_export': True, 'logs': logs.order_by("-finished_at", "-id")[:1000],
         })
         pdf = HTML(string=html_str, base_url=request.build_absolute_uri('/')).write_pdf()
         resp = HttpResponse(pdf, content_type='application/pdf')
         resp['Content-Disposition'] = 'attachment; filename="wages_report.pdf"'
         return resp
 
-    # --------- رندر HTML تمپلیت ---------
-    ctx = {
-        'is_export': False,
-        'tech_name': tech_name, 'start': start_str, 'end': end_str, 'product': product, 'stage_q': stage_q,
-        'products_qs': products_qs, 'stages_qs': stages_qs, 'tech_names': tech_names,
-        'logs': logs[:1000], 'total_wage': total_wage, 'by_tech': by_tech, 'by_stage': by_stage,
-        '_money_fa': _money_fa,
-    }
+    # --------- رندر HTML تمپلیت (صفحه‌بندی keyset روی finished_at, id) ---------
+    from django.db.models import Value
+    from django_jalali.db import models as jmodels
+    from core.utils.keyset import KeysetPaginator
+    page = KeysetPaginator(
+        logs, ordering=("-finished_at", "-id"), per_page=100,
+        null_defaults={"finished_at": Value(jdatetime.date(1, 1, 1), output_field=jmodels.jDateField())},
+    ).page(request.GET)
+    ctx.update({'is_export': False, 'logs': page.object_list, 'page': page})
     return TemplateResponse(request, 'core/wages_report.html', ctx)
\ No newline at end of file
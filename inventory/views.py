@@ -37,43 +37,30 @@ from django.db.models import Sum, F, Value, DecimalField, Case, When, Expression
 from django.db.models.functions import Coalesce, Abs
 
 class StockReportView(ListView):
+    """
+    گزارش موجودی فعلی از روی اسنپ‌شات MaterialItem.stock_qty (که StockMovement.save نگهش می‌دارد).
+    جمع کل کارتکس اینجا محاسبه نمی‌شود؛ هم‌خوانی اسنپ‌شات با کارتکس به‌صورت آفلاین
+    با `manage.py reconcile_stock` بررسی و در StockDriftRecord ثبت می‌شود.
+    """
     model = MaterialItem
     template_name = "inventory/stock_report.html"
     context_object_name = "items"
 
     def get_queryset(self):
-        dec = DecimalField(max_digits=14, decimal_places=3)
-
-        qs = (
+        return (
             MaterialItem.objects.filter(is_active=True)
-            .annotate(
-                total_in=Coalesce(
-                    Sum(
-                        Case(
-                            When(movements__movement_type__in=["purchase", "adjust_pos"], then=F("movements__qty")),
-                            default=Value(0, output_field=dec),
-                            output_field=dec,
-                        )
-                    ),
-                    Value(0, output_field=dec),
-                ),
-                total_out=Coalesce(
-                    Sum(
-                        Case(
-                            When(movements__movement_type__in=["issue", "adjust_neg"], then=Abs(F("movements__qty"))),
-                            default=Value(0, output_field=dec),
-                            output_field=dec,
-                        )
-                    ),
-                    Value(0, output_field=dec),
-                ),
-            )
-            .annotate(
-                computed_stock_qty=ExpressionWrapper(F("total_in") - F("total_out"), output_field=dec)
-            )
+            .only("id", "name", "uom", "item_type", "min_stock", "stock_qty")
             .order_by("item_type", "name")
         )
-        return qs
+
+    def get_context_data(self, **kwargs):
+        from billing.models import StockDriftRecord
+        ctx = super().get_context_data(**kwargs)
+        # تعداد آیتم‌هایی که آخرین کنترل، اختلاف حل‌نشده برایشان ثبت کرده
+        ctx["open_drift_items"] = (
+            StockDriftRecord.objects.filter(is_resolved=False).values("item_id").distinct().count()
+        )
+        return ctx
 
 
 from billing.models import StockMovement  # اگر بالای فایل نیست، اضافه کن
@@ -85,7 +72,16 @@ class StockMovementListView(ListView):
 
     def get_queryset(self):
         # فقط حرکت‌های ثبت‌شده، مرتب از جدید به قدیم
-        return StockMovement.objects.select_related("item").order_by("-happened_at")
+        return StockMovement.objects.select_related("item", "lot").order_by("-happened_at", "-id")
+
+    def get_context_data(self, **kwargs):
+        # صفحه‌بندی Keyset روی (happened_at, id): صفحه‌های عمیق هم‌هزینهٔ صفحهٔ اول‌اند
+        from core.utils.keyset import KeysetPaginator
+        ctx = super().get_context_data(**kwargs)
+        page = KeysetPaginator(self.get_queryset(), ordering=("-happened_at", "-id"), per_page=100).page(self.request.GET)
+        ctx["movements"] = page.object_list
+        ctx["page"] = page
+        return ctx
 
 
 from billing.models import StockMovement
@@ -3,6 +3,7 @@ Django settings for labmanager_project project.
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # ----------------- مسیر پایه پروژه -----------------
@@ -71,6 +72,8 @@ TEMPLATES = [
                 # --- افزوده‌شده‌ها برای نمایش لوگو و دسترسی به static/media در قالب ---
                 'django.template.context_processors.static',
                 'django.template.context_processors.media',
+                # پروفایل/تنظیمات لابراتوار (کش‌شده) برای همهٔ قالب‌ها
+                'core.context_processors.lab_singletons',
             ],
         },
     },
@@ -84,7 +87,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # اتصال بین درخواست‌ها نگه داشته می‌شود (به‌جای باز کردن فایل در هر درخواست)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # انتظار ماژول sqlite3 برای آزاد شدن قفل (ثانیه)؛ همراه با PRAGMA busy_timeout
+            'timeout': 20,
+        },
+    },
+    # کپی لحظه‌ای DB اصلی برای گزارش‌های سنگین (core/utils/reporting_db.py)؛
+    # با «python manage.py refresh_reporting_db» به‌صورت دوره‌ای تازه می‌شود.
+    'reporting': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('REPORTING_DB_PATH', os.path.join(BASE_DIR, 'db_reporting.sqlite3')),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['core.utils.reporting_db.ReportingRouter']
+# اگر snapshot از این مقدار (ثانیه) کهنه‌تر باشد، گزارش‌ها از DB اصلی خوانده می‌شوند
+REPORTING_DB_MAX_AGE = int(os.environ.get('REPORTING_DB_MAX_AGE', '3600'))
+
+# PRAGMAهای SQLite روی هر اتصال تازه (core/utils/sqlite_tuning.py)؛ برای تغییر پیش‌فرض‌ها:
+# SQLITE_PRAGMAS = {"mmap_size": 0, "cache_size": -32000}
+SQLITE_PRAGMAS = {}
+# اتصال گزارش‌گیری فقط‌خواندنی است (نوشتن تصادفی روی snapshot خطا می‌دهد)
+SQLITE_PRAGMAS_BY_ALIAS = {'reporting': {'query_only': 1}}
+
+# ----------------- Cache -----------------
+# کش باید بین همهٔ workerها مشترک باشد: خلاصهٔ هزینهٔ سفارش (billing/services/order_detail.py)،
+# جدول بهای استاندارد BOM (standard_cost.py) و ابعاد مصرف متریال با سیگنال همان worker ای که
+# نوشته باطل می‌شوند؛ با LocMemCache پیش‌فرض جنگو، workerهای دیگر تا پایان TTL عدد کهنه نشان می‌دادند.
+# پیش‌فرض FileBasedCache روی همین ماشین است؛ برای چند سرور: CACHE_BACKEND=...RedisCache و CACHE_LOCATION=redis://...
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'labmanager_cache')),
+    },
 }
 
 # ----------------- Password validation -----------------
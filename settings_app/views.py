@@ -3,14 +3,14 @@ from django.urls import reverse
 from django.contrib import messages
 
 from billing.models import LabProfile
+from core.utils.lab_singletons import get_lab_profile
 from .forms import LabProfileForm
 
 
 def home(request):
-    # رکورد موجود یا None
-    instance = LabProfile.objects.first()
-
     if request.method == "POST":
+        # برای ویرایش، رکورد تازه از DB (نه نمونهٔ کش‌شده که فرم رویش می‌نویسد)
+        instance = LabProfile.objects.first()
         form = LabProfileForm(request.POST, request.FILES, instance=instance)
         if form.is_valid():
             lab_profile = form.save()
@@ -21,6 +21,7 @@ def home(request):
             messages.error(request, "بررسی کنید: بعضی فیلدها نیاز به اصلاح دارند.")
         lab_profile = instance  # برای سازگاری با context
     else:
+        instance = get_lab_profile()
         form = LabProfileForm(instance=instance)
         lab_profile = instance
 